@@ -3,10 +3,30 @@
 import logging
 import typing as ta
 
-from .blender import MeshMaterialTransformer, ObjectFactory, background
-from .decorator import limit, rule
-from .random import coinflip, prnd, rnd
-from .transform import ObjectTransformer, Transform, Transformer
+from .blender import (
+    Estimate,
+    InstancingObjectFactory,
+    LibraryMaterialTransformer,
+    MaterialCache,
+    MergingObjectFactory,
+    MeshMaterialTransformer,
+    ObjectColorMaterialTransformer,
+    ObjectFactory,
+    ObjectTransformer,
+    background,
+    camera_frustum,
+    library_object,
+)
+from .cache import ExpansionCache
+from .culling import Frustum
+from .decorator import limit, memoize, rule
+from .expansion import Expansion, defer
+from .export import load_npz, save_gltf, save_npz, save_ply
+from .instance import InstanceBuffer, InstanceCounter
+from .profiler import Profiler
+from .random import coinflip, prnd, rnd, seed
+from .spatial import SpatialHash
+from .transform import Transform, Transformer
 
 if ta.TYPE_CHECKING:
     ColorComponent = ta.Annotated[float, ta.ValueRange(0.0, 1.0)]
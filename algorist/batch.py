@@ -0,0 +1,248 @@
+"""Run a script for many seeds and parameters in parallel headless Blenders
+
+python -m algorist.batch SCRIPT.py --seeds 0-99 --output DIR [--render]
+
+Each run gets its own directory in DIR, with the render, the Blender log and
+a stats.json, and a summary.json of all runs is written to DIR. The random
+stream of each run is seeded from its seed, and scripts read their
+parameters with algorist.batch.parameters().
+"""
+
+from __future__ import annotations
+
+import argparse
+import concurrent.futures
+import itertools
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import typing as ta
+
+from .random import SEED_VARIABLE
+
+log = logging.getLogger(__name__)
+
+PARAMETERS_VARIABLE = "ALGORIST_PARAMETERS"
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Written by each run after the script, before rendering
+_STATS_EXPRESSION = """
+import json, bpy
+with open({path!r}, "w") as f:
+    json.dump({{
+        "objects": len(bpy.data.objects),
+        "materials": len(bpy.data.materials),
+        "meshes": len(bpy.data.meshes),
+    }}, f)
+"""
+
+
+def parameters(**defaults: ta.Any) -> dict[str, ta.Any]:
+    """Return defaults updated with the parameters of the current batch run"""
+    return {**defaults, **json.loads(os.environ.get(PARAMETERS_VARIABLE, "{}"))}
+
+
+class Run(ta.NamedTuple):
+    seed: int
+    parameters: dict[str, ta.Any]
+
+    @property
+    def name(self) -> str:
+        return "_".join(
+            [f"seed-{self.seed:04d}"]
+            + [f"{key}-{value}" for key, value in self.parameters.items()]
+        )
+
+
+class Batch:
+    """Runs script once per Run, at most jobs Blender processes at a time
+
+    Blender runs in cwd, defaulting to the current directory, so scripts can
+    load resources relative to it like with algorist.sh. Failed runs are
+    retried retries times, then skipped.
+    """
+
+    def __init__(
+        self,
+        script: str,
+        output: str,
+        blender: str = "blender",
+        template: str = os.path.join(ROOT, "algorist.blend"),
+        jobs: ta.Optional[int] = None,
+        threads: ta.Optional[int] = None,
+        render: bool = False,
+        save: bool = False,
+        retries: int = 1,
+        timeout: ta.Optional[float] = None,
+        cwd: ta.Optional[str] = None,
+    ):
+        self.script = os.path.abspath(script)
+        self.output = os.path.abspath(output)
+        self.blender = blender
+        self.template = template
+        self.jobs = jobs or os.cpu_count() or 1
+        # Share the cores between the Blender processes
+        self.threads = threads or max(1, (os.cpu_count() or 1) // self.jobs)
+        self.render = render
+        self.save = save
+        self.retries = retries
+        self.timeout = timeout
+        self.cwd = os.path.abspath(cwd or os.getcwd())
+
+    def run(self, runs: ta.Sequence[Run]) -> list[dict[str, ta.Any]]:
+        """Run all runs, returning and saving their summary"""
+        os.makedirs(self.output, exist_ok=True)
+        with concurrent.futures.ThreadPoolExecutor(self.jobs) as executor:
+            results = list(executor.map(self._run, runs))
+        with open(os.path.join(self.output, "summary.json"), "w") as f:
+            json.dump(results, f, indent=2)
+        failed = sum(1 for result in results if result["status"] != "ok")
+        log.info(f"Completed {len(results) - failed} runs, {failed} failed")
+        return results
+
+    def _run(self, run: Run) -> dict[str, ta.Any]:
+        directory = os.path.join(self.output, run.name)
+        os.makedirs(directory, exist_ok=True)
+        stats_path = os.path.join(directory, "stats.json")
+        command = [
+            self.blender,
+            "--background",
+            self.template,
+            "--threads",
+            str(self.threads),
+            "--python-exit-code",
+            "1",
+            "--python",
+            self.script,
+            "--python-expr",
+            _STATS_EXPRESSION.format(path=stats_path),
+        ]
+        if self.save:
+            command += [
+                "--python-expr",
+                "import bpy; bpy.ops.wm.save_as_mainfile("
+                f"filepath={os.path.join(directory, 'scene.blend')!r})",
+            ]
+        if self.render:
+            command += ["-o", os.path.join(directory, "render_####"), "-f", "1"]
+        env = {
+            **os.environ,
+            "PYTHONPATH": os.pathsep.join(
+                filter(None, [ROOT, os.environ.get("PYTHONPATH")])
+            ),
+            SEED_VARIABLE: str(run.seed),
+            PARAMETERS_VARIABLE: json.dumps(run.parameters),
+        }
+        result: dict[str, ta.Any] = {
+            "name": run.name,
+            "seed": run.seed,
+            "parameters": run.parameters,
+        }
+        for attempt in range(1, self.retries + 2):
+            start = time.perf_counter()
+            try:
+                with open(os.path.join(directory, "blender.log"), "w") as output:
+                    subprocess.run(
+                        command,
+                        cwd=self.cwd,
+                        env=env,
+                        stdout=output,
+                        stderr=subprocess.STDOUT,
+                        timeout=self.timeout,
+                        check=True,
+                    )
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+                log.warning(f"Run {run.name} attempt {attempt} failed: {e}")
+                result.update(status="failed", attempts=attempt)
+                continue
+            result.update(
+                status="ok",
+                attempts=attempt,
+                time=time.perf_counter() - start,
+            )
+            with open(stats_path) as f:
+                result.update(json.load(f))
+            log.info(f"Run {run.name} completed in {result['time']:.1f}s")
+            break
+        return result
+
+
+def parse_seeds(spec: str) -> list[int]:
+    """Parse seeds like "0-9,20,30-39" """
+    seeds: list[int] = []
+    for part in spec.split(","):
+        first, _, last = part.partition("-")
+        seeds.extend(range(int(first), int(last or first) + 1))
+    return seeds
+
+
+def parse_parameters(specs: ta.Sequence[str]) -> list[dict[str, ta.Any]]:
+    """Parse "name=value1,value2" specs into the product of their values"""
+    names = []
+    choices = []
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        names.append(name)
+        choices.append([parse_value(value) for value in values.split(",")])
+    return [dict(zip(names, values)) for values in itertools.product(*choices)]
+
+
+def parse_value(value: str) -> ta.Any:
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return value
+
+
+def main(argv: ta.Optional[ta.Sequence[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("script", help="Blender python script to run")
+    parser.add_argument("--seeds", default="0", help='seeds, e.g. "0-9,20"')
+    parser.add_argument(
+        "--param",
+        action="append",
+        default=[],
+        metavar="NAME=VALUES",
+        help="parameter values, comma separated. Runs use all combinations",
+    )
+    parser.add_argument("--output", required=True, help="output directory")
+    parser.add_argument("--blender", default=os.environ.get("BLENDER", "blender"))
+    parser.add_argument("--template", default=os.path.join(ROOT, "algorist.blend"))
+    parser.add_argument("--jobs", type=int, help="parallel Blender processes")
+    parser.add_argument("--threads", type=int, help="threads per Blender process")
+    parser.add_argument("--render", action="store_true", help="render frame 1")
+    parser.add_argument("--save", action="store_true", help="save scene.blend")
+    parser.add_argument("--retries", type=int, default=1)
+    parser.add_argument("--timeout", type=float, help="seconds per run")
+    parser.add_argument("--cwd", help="Blender working directory, default current")
+    args = parser.parse_args(argv)
+
+    batch = Batch(
+        args.script,
+        args.output,
+        blender=args.blender,
+        template=args.template,
+        jobs=args.jobs,
+        threads=args.threads,
+        render=args.render,
+        save=args.save,
+        retries=args.retries,
+        timeout=args.timeout,
+        cwd=args.cwd,
+    )
+    runs = [
+        Run(seed, run_parameters)
+        for seed in parse_seeds(args.seeds)
+        for run_parameters in parse_parameters(args.param)
+    ]
+    results = batch.run(runs)
+    if any(result["status"] != "ok" for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,321 @@
 from __future__ import annotations
 
+import collections
 import functools
-import itertools
+import logging
+import os
+import time
 import typing as ta
 
-import bpy
-from mathutils import Matrix
+import numpy as np
+import numpy.typing as npt
 
-from .transform import ObjectTransformer, Transformer, hsva_to_rgba
+from . import primitive
+from .culling import Frustum
+from .instance import (
+    InstanceBuffer,
+    InstanceCounter,
+    Prototype,
+    RecordingTransformer,
+    datakey,
+    decompose,
+    median_scale,
+    prototype_key,
+    transform_points,
+)
+from .transform import Transformer, hsva_to_rgba
 
+# bpy is imported when needed, so grammars can be expanded into an
+# InstanceBuffer outside of Blender
 if ta.TYPE_CHECKING:
+    import bpy
+
     from . import Color
 
+log = logging.getLogger(__name__)
+
 
 def _primitive_wrapper(func: ta.Callable, *args, **kwargs) -> bpy.types.Object:
+    import bpy
+
     func(*args, **kwargs)
     return bpy.context.object
 
 
+def _primitive_mesh(name: str, *args, **kwargs) -> bpy.types.Mesh:
+    """Create mesh data for the named primitive, without operators"""
+    import bpy
+
+    mesh = bpy.data.meshes.new(name)
+    _write_geometry(mesh, primitive.GENERATORS[name](*args, **kwargs))
+    return mesh
+
+
+def _write_geometry(mesh: bpy.types.Mesh, geometry: primitive.Geometry):
+    """Add geometry to the empty mesh"""
+    import bpy
+
+    mesh.vertices.add(len(geometry.vertices))
+    mesh.vertices.foreach_set("co", geometry.vertices.ravel())
+    mesh.edges.add(len(geometry.edges))
+    mesh.edges.foreach_set("vertices", geometry.edges.ravel())
+    mesh.loops.add(len(geometry.loop_vertices))
+    mesh.loops.foreach_set("vertex_index", geometry.loop_vertices)
+    mesh.polygons.add(len(geometry.loop_totals))
+    mesh.polygons.foreach_set("loop_start", geometry.loop_starts)
+    # loop_total is computed from loop_start since Blender 4.0
+    if bpy.app.version < (4, 0, 0):
+        mesh.polygons.foreach_set("loop_total", geometry.loop_totals)
+    if geometry.uvs is not None:
+        uv_layer = mesh.uv_layers.new(name="UVMap")
+        uv_layer.data.foreach_set("uv", geometry.uvs.ravel())
+    mesh.update(calc_edges=True)
+
+
+def _mesh_geometry(mesh: bpy.types.Mesh) -> primitive.Geometry:
+    """Read the geometry of mesh, with its loose edges and active UV map"""
+    vertices = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", vertices)
+    loop_vertices = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get("vertex_index", loop_vertices)
+    loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("loop_total", loop_totals)
+    edges = np.empty(len(mesh.edges) * 2, dtype=np.int32)
+    mesh.edges.foreach_get("vertices", edges)
+    loose = np.empty(len(mesh.edges), dtype=bool)
+    mesh.edges.foreach_get("is_loose", loose)
+    uvs = None
+    if mesh.uv_layers.active is not None:
+        loop_uvs = np.empty(len(mesh.loops) * 2, dtype=np.float32)
+        mesh.uv_layers.active.data.foreach_get("uv", loop_uvs)
+        uvs = loop_uvs.reshape(-1, 2)
+    return primitive.Geometry(
+        vertices.reshape(-1, 3),
+        loop_vertices,
+        loop_totals,
+        edges.reshape(-1, 2)[loose],
+        uvs,
+    )
+
+
+def _merge_geometry(
+    geometry: primitive.Geometry, matrices: np.ndarray
+) -> primitive.Geometry:
+    """Merge copies of geometry transformed by each of the (N, 4, 4) matrices
+
+    Polygons of copies with mirroring matrices are reversed, so their normals
+    still face outwards.
+    """
+    count = len(matrices)
+    vertex_count = len(geometry.vertices)
+    vertices = transform_points(
+        matrices.astype(np.float32), geometry.vertices.astype(np.float32)
+    )
+    # Index of each loop in its polygon, reversed
+    starts = geometry.loop_starts
+    polygons = np.repeat(np.arange(len(starts)), geometry.loop_totals)
+    reversed_order = (
+        2 * starts[polygons]
+        + geometry.loop_totals[polygons]
+        - 1
+        - np.arange(len(geometry.loop_vertices))
+    )
+    reversed_loops = geometry.loop_vertices[reversed_order]
+    mirrored = np.linalg.det(matrices[:, :3, :3]) < 0
+    offsets = (np.arange(count, dtype=np.int32) * vertex_count)[:, np.newaxis]
+    loop_vertices = (
+        np.where(mirrored[:, np.newaxis], reversed_loops, geometry.loop_vertices)
+        + offsets
+    )
+    edges = geometry.edges[np.newaxis] + offsets[:, :, np.newaxis]
+    uvs = None
+    if geometry.uvs is not None:
+        uvs = np.where(
+            mirrored[:, np.newaxis, np.newaxis],
+            geometry.uvs[reversed_order],
+            geometry.uvs,
+        ).reshape(-1, 2)
+    return primitive.Geometry(
+        vertices.reshape(-1, 3),
+        loop_vertices.ravel(),
+        np.tile(geometry.loop_totals, count),
+        edges.reshape(-1, 2),
+        uvs,
+    )
+
+
+def prototype_geometry(prototype: Prototype) -> ta.Optional[primitive.Geometry]:
+    """Geometry of prototypes created by ObjectFactory primitives, or None"""
+    func = prototype.creation_func
+    if not isinstance(func, functools.partial) or func.func is not _primitive_mesh:
+        return None
+    return primitive.GENERATORS[func.args[0]](
+        *func.args[1:], *prototype.args, **prototype.kwargs
+    )
+
+
+def _data_radius(data: bpy.types.ID) -> float:
+    """Radius bounding an object or mesh, or the Transformer default"""
+    import bpy
+
+    if isinstance(data, bpy.types.Object):
+        points = np.array(data.bound_box)
+    elif isinstance(data, bpy.types.Mesh) and len(data.vertices):
+        points = np.empty(len(data.vertices) * 3)
+        data.vertices.foreach_get("co", points)
+        points = points.reshape(-1, 3)
+    else:
+        return Transformer.radius
+    return float(np.linalg.norm(points, axis=1).max())
+
+
+# Objects loaded by library_object, by absolute path, name and link
+_LIBRARY_OBJECTS: dict[tuple[str, str, bool], bpy.types.Object] = {}
+
+
+def library_object(filepath: str, name: str, link: bool = True) -> bpy.types.Object:
+    """Return the object name from the .blend filepath, loaded once per session
+
+    If link is set the object is linked, so its data is shared with the
+    library and not saved, otherwise it is appended. The object is not linked
+    into the scene, ObjectFactory.library instances copies of it.
+    """
+    import bpy
+
+    key = (os.path.abspath(filepath), name, link)
+    obj = _LIBRARY_OBJECTS.get(key)
+    if obj is not None:
+        try:
+            obj.name
+            return obj
+        except ReferenceError:
+            # Removed since it was loaded
+            pass
+    with bpy.data.libraries.load(key[0], link=link) as (data_from, data_to):
+        if name not in data_from.objects:
+            raise ValueError(f"No object {name} in {filepath}")
+        data_to.objects = [name]
+    obj = _LIBRARY_OBJECTS[key] = data_to.objects[0]
+    return obj
+
+
+def _created_data(result: ta.Any) -> bpy.types.ID:
+    """Return data created by a creation_func
+
+    If an object was created, for example by an operator, it is removed and
+    only its data is kept. Objects returned by library_object are kept, and
+    instanced by copying them.
+    """
+    import bpy
+
+    if isinstance(result, bpy.types.ID) and not isinstance(result, bpy.types.Object):
+        return result
+    if result in _LIBRARY_OBJECTS.values():
+        return result
+    # Handle bpy.ops.mesh.primitive_* functions
+    obj = result if isinstance(result, bpy.types.Object) else bpy.context.object
+    data = obj.data
+    bpy.data.objects.remove(obj)
+    return data
+
+
+def _new_object(name: str, data: bpy.types.ID) -> bpy.types.Object:
+    """Create an object for data returned by _created_data"""
+    import bpy
+
+    if isinstance(data, bpy.types.Object):
+        # Copies share the library object data
+        return data.copy()
+    return bpy.data.objects.new(name, data)
+
+
+def reset_caches():
+    """Forget cached materials, for example after they have been removed"""
+    MeshMaterialTransformer.materials.clear()
+    GreasePencilMaterialTransformer.materials.clear()
+
+
+class MaterialCache:
+    """Least recently used cache of materials keyed on quantized RGBA color
+
+    Color components are rounded to multiples of step, so similar colors share
+    a material. At most max_size materials are cached, evicted materials are
+    left in use by the objects they were assigned to.
+    """
+
+    def __init__(self, step: float = 1 / 255, max_size: int = 1024):
+        self.step = step
+        self.max_size = max_size
+        self._materials: collections.OrderedDict[ta.Hashable, bpy.types.Material] = (
+            collections.OrderedDict()
+        )
+
+    def get(
+        self,
+        key: ta.Hashable,
+        color: Color,
+        create: ta.Callable[[Color], bpy.types.Material],
+    ) -> bpy.types.Material:
+        """Return cached material for key and color
+
+        If not cached, create is called with the quantized color.
+        """
+        quantized = tuple(round(c / self.step) for c in color)
+        cachekey = (key, quantized)
+        material = self._materials.get(cachekey)
+        if material is None:
+            material = create(ta.cast("Color", tuple(q * self.step for q in quantized)))
+            self._materials[cachekey] = material
+            if len(self._materials) > self.max_size:
+                self._materials.popitem(last=False)
+        else:
+            self._materials.move_to_end(cachekey)
+        return material
+
+    def clear(self):
+        self._materials.clear()
+
+
+class ObjectTransformer(Transformer):
+    def __init__(self, obj: bpy.types.Object):
+        self._obj = obj
+
+    @property
+    def obj(self) -> bpy.types.Object:
+        return self._obj
+
+    @property
+    def radius(self) -> float:  # type: ignore[override]
+        """Radius of the sphere around the origin bounding the object"""
+        return float(np.linalg.norm(np.array(self.obj.bound_box), axis=1).max())
+
+    def apply_matrix(self, matrix: np.ndarray):
+        """Apply transformation matrix to object"""
+        from mathutils import Matrix
+
+        self.obj.matrix_world = Matrix(matrix.tolist())
+
+    def discard(self):
+        """Remove the culled object"""
+        import bpy
+
+        bpy.data.objects.remove(self.obj)
+
+
 class MeshMaterialTransformer(ObjectTransformer):
+    """Colors objects with materials shared through a MaterialCache
+
+    Subclasses customizing the material should override create_material.
+    """
+
+    materials = MaterialCache()
+
     def apply_color(self, color: Color):
+        self.link_material(self.materials.get(type(self), color, self.create_material))
+
+    def create_material(self, color: Color) -> bpy.types.Material:
         """Create a Principled BSDF Material with Base Color set to RGBA Color"""
-        if not self.obj.material_slots:
-            self.obj.data.materials.append(None)
+        import bpy
 
         material = bpy.data.materials.new("Color")
         material.use_nodes = True
@@ -32,35 +325,179 @@ class MeshMaterialTransformer(ObjectTransformer):
         material.diffuse_color = color
         if color[3] < 1:
             material.blend_method = "BLEND"
+        return material
+
+    def link_material(self, material: bpy.types.Material):
+        if not self.obj.material_slots:
+            self.obj.data.materials.append(None)
 
         # Link the material to the new object, not the shared mesh data
         self.obj.material_slots[0].link = "OBJECT"
         self.obj.material_slots[0].material = material
 
 
+class ObjectColorMaterialTransformer(MeshMaterialTransformer):
+    """Colors objects with a single shared material reading the Object color
+
+    The color is stored in the object color property, so the number of
+    materials does not depend on the number of colors. Transparent objects
+    share a separate, alpha blended material.
+    """
+
+    def apply_color(self, color: Color):
+        self.obj.color = color
+        transparent = color[3] < 1
+        material = self.materials.get(
+            (type(self), transparent), (1.0, 1.0, 1.0, 1.0), self.create_material
+        )
+        if transparent:
+            material.blend_method = "BLEND"
+        self.link_material(material)
+
+    def create_material(self, color: Color) -> bpy.types.Material:
+        """Create a Principled BSDF Material with Base Color from Object Info"""
+        material = super().create_material(color)
+        node_tree = material.node_tree
+        object_info = node_tree.nodes.new("ShaderNodeObjectInfo")
+        bsdf = node_tree.nodes["Principled BSDF"]
+        node_tree.links.new(object_info.outputs["Color"], bsdf.inputs["Base Color"])
+        node_tree.links.new(object_info.outputs["Alpha"], bsdf.inputs["Alpha"])
+        return material
+
+
+class LibraryMaterialTransformer(MeshMaterialTransformer):
+    """Colors library objects with cached copies of their first material
+
+    The color is set on the color_input of the color_node of the copies.
+    Objects without materials are colored like MeshMaterialTransformer.
+    """
+
+    color_node = "Principled BSDF"
+    color_input = "Base Color"
+
+    def apply_color(self, color: Color):
+        if not self.obj.material_slots:
+            super().apply_color(color)
+            return
+        base = self.obj.material_slots[0].material
+        self.link_material(
+            self.materials.get(
+                (type(self), base.as_pointer()),
+                color,
+                functools.partial(self.create_variant, base),
+            )
+        )
+
+    def create_variant(
+        self, base: bpy.types.Material, color: Color
+    ) -> bpy.types.Material:
+        """Copy base, setting its color"""
+        material = base.copy()
+        material.node_tree.nodes[self.color_node].inputs[
+            self.color_input
+        ].default_value = color
+        return material
+
+
 class GreasePencilMaterialTransformer(Transformer):
+    materials = MaterialCache()
+
     def __init__(
         self, grease_pencil: bpy.types.GreasePencil, stroke: bpy.types.GPencilStroke
     ):
         self.grease_pencil = grease_pencil
         self.stroke = stroke
 
-    def apply_matrix(self, matrix: Matrix):
-        for p in self.stroke.points:
-            p.co = matrix @ p.co
-        self.stroke.line_width = int(self.stroke.line_width * matrix.median_scale)
+    def apply_matrix(self, matrix: np.ndarray):
+        points = self.stroke.points
+        co = np.empty(len(points) * 3, dtype=np.float32)
+        points.foreach_get("co", co)
+        co = transform_points(matrix.astype(np.float32), co.reshape(-1, 3))
+        points.foreach_set("co", co.ravel())
+        self.stroke.line_width = int(self.stroke.line_width * median_scale(matrix))
 
     def apply_color(self, color: Color):
+        material = self.materials.get(
+            (type(self), self.grease_pencil.as_pointer()), color, self.create_material
+        )
+        self.stroke.material_index = self.grease_pencil.materials.find(material.name)
+
+    def create_material(self, color: Color) -> bpy.types.Material:
+        """Create a grease pencil Material and append it to the grease pencil"""
+        import bpy
+
         material = bpy.data.materials.new("GPColor")
         self.grease_pencil.materials.append(material)
         bpy.data.materials.create_gpencil_data(material)
         material.grease_pencil.color = color
-        self.stroke.material_index = len(self.grease_pencil.materials)
+        return material
+
+    def discard(self):
+        """Remove the culled stroke"""
+        self.grease_pencil.layers[0].frames[0].strokes.remove(self.stroke)
+
+
+class Estimate(ta.NamedTuple):
+    """Estimated size of the scene materialized from recorded instances
+
+    vertices counts the vertices of every object, mesh_vertices only those of
+    the shared mesh data. memory is a rough estimate in bytes.
+    """
+
+    objects: int
+    prototypes: dict[str, int]
+    materials: int
+    vertices: int
+    mesh_vertices: int
+    memory: int
+
+
+# Approximate sizes of Blender data, for Estimate
+_OBJECT_BYTES = 2048
+_MATERIAL_BYTES = 16384
+_VERTEX_BYTES = 64
 
 
 class ObjectFactory:
-    def __init__(self):
-        self._data_cache: dict[tuple[str, tuple], bpy.types.ID] = {}
+    """Create Blender objects from shared, cached data
+
+    If buffer is specified, meshes are not created immediately. Instead
+    Transform.apply records each instance into the buffer, and the objects
+    are all created at once by materialize(). Lines are always created
+    immediately.
+
+    If chunk_size is also specified, the buffer is materialized into
+    collection and cleared whenever it holds chunk_size instances, so memory
+    use is bounded while recording large scenes.
+
+    For a dry run, pass an InstanceCounter as buffer. Nothing is created,
+    lines included, and estimate() summarizes what would be.
+
+    Primitives such as cube() are generated without operators. They take the
+    arguments of the bpy.ops.mesh.primitive_*_add operators shaping the mesh,
+    but not location, rotation, scale, align or enter_editmode, which raise
+    TypeError. Use a Transform instead. Cubes, planes, grids, spheres and tori
+    have a UV map, laid out differently from the operators'. Circles,
+    cylinders and cones have none.
+    """
+
+    def __init__(
+        self,
+        buffer: ta.Union[InstanceBuffer, InstanceCounter, None] = None,
+        chunk_size: ta.Optional[int] = None,
+        collection: ta.Optional[bpy.types.Collection] = None,
+    ):
+        if chunk_size is not None and not isinstance(buffer, InstanceBuffer):
+            raise ValueError("Cannot set chunk_size without an InstanceBuffer")
+        self._data_cache: dict[ta.Hashable, bpy.types.ID] = {}
+        self._fragment_collections: dict[int, bpy.types.Collection] = {}
+        # Bounding radius of recorded prototypes, for culling and indexing
+        self._radii: dict[ta.Hashable, float] = {}
+        # Spans the flushes of a streaming factory
+        self._progress: ta.Optional[_Progress] = None
+        self.buffer = buffer
+        self.chunk_size = chunk_size
+        self.collection = collection
 
     def create_mesh(
         self,
@@ -69,30 +506,177 @@ class ObjectFactory:
         transformer_cls: ta.Type[ObjectTransformer] = ObjectTransformer,
         *args,
         **kwargs,
-    ) -> ObjectTransformer:
+    ) -> Transformer:
         """Create blender object
 
         name should be a unique name to use as a cache key for the data object
-        creation_func should return a bpy.types.Object or else set
+        creation_func should return the data, a bpy.types.Object or else set
          bpy.context.object to one
         """
-        datakey = (
-            name,
-            tuple(sorted(itertools.chain(args, kwargs.items()))),
+        key = datakey(name, args, kwargs)
+        if self.buffer is not None:
+            if (
+                self.chunk_size is not None
+                and len(self.buffer) >= self.chunk_size
+                and not self.buffer.pinned
+            ):
+                self.materialize()
+            prototype = Prototype(name, creation_func, transformer_cls, args, kwargs)
+            radius = self._radii.get(key)
+            if radius is None:
+                radius = self._radii[key] = self._prototype_radius(prototype)
+            # Data is shared by prototypes with other transformer classes
+            prototype_id = self.buffer.prototype(prototype_key(prototype), prototype)
+            return RecordingTransformer(self.buffer, prototype_id, radius)
+
+        import bpy
+
+        data = self._data_cache.get(key)
+        if not data:
+            data = self._data_cache[key] = _created_data(creation_func(*args, **kwargs))
+        obj = _new_object(name, data)
+        bpy.context.collection.objects.link(obj)
+        return transformer_cls(obj)
+
+    def library(
+        self,
+        filepath: str,
+        name: str,
+        transformer_cls: ta.Type[ObjectTransformer] = LibraryMaterialTransformer,
+        link: bool = True,
+        radius: ta.Optional[float] = None,
+    ) -> Transformer:
+        """Create a copy of the object name from the .blend filepath
+
+        The object is loaded once per session by library_object. Copies keep
+        its modifiers and share its data.
+
+        radius bounds the object, for culling and indexing recorded copies.
+        By default the object is loaded when first recorded to measure it.
+        """
+        if radius is not None:
+            self._radii[datakey(name, (filepath, name, link), {})] = radius
+        return self.create_mesh(
+            name, library_object, transformer_cls, filepath, name, link
         )
-        mesh = self._data_cache.get(datakey)
-        if mesh:
-            obj = bpy.data.objects.new(name, mesh)
-            bpy.context.collection.objects.link(obj)
+
+    def materialize(
+        self,
+        collection: ta.Optional[bpy.types.Collection] = None,
+        chunk_size: ta.Optional[int] = None,
+    ):
+        """Create objects for all instances recorded in the buffer
+
+        Objects are linked into collection, defaulting to the factory
+        collection or else the current collection. They are created and
+        linked in chunks of chunk_size instances, defaulting to the factory
+        chunk_size or else 10000, logging progress after each chunk. The
+        buffer is cleared afterwards.
+
+        When streaming with a factory chunk_size, progress is logged for all
+        instances materialized by the factory so far.
+        """
+        import bpy
+
+        if not isinstance(self.buffer, InstanceBuffer):
+            raise ValueError("ObjectFactory has no buffer to materialize")
+        collection = collection or self.collection or bpy.context.collection
+        chunk_size = chunk_size or self.chunk_size or 10000
+        if self.chunk_size is None:
+            progress = _Progress("Materialized", len(self.buffer))
         else:
-            result = creation_func(*args, **kwargs)
-            # Handle bpy.ops.mesh.primitive_* functions
-            if isinstance(result, bpy.types.Object):
-                obj = result
-            else:
-                obj = bpy.context.object
-            self._data_cache[datakey] = obj.data
-        return transformer_cls(obj)
+            if self._progress is None:
+                # The number of instances streamed is unknown
+                self._progress = _Progress("Materialized")
+            progress = self._progress
+        for start in range(0, len(self.buffer), chunk_size):
+            rows = slice(start, start + chunk_size)
+            progress.update(self._materialize(self.buffer, collection, rows))
+        self.buffer.clear()
+
+    def _materialize(
+        self,
+        buffer: InstanceBuffer,
+        collection: bpy.types.Collection,
+        rows: ta.Union[slice, np.ndarray] = slice(None),
+    ) -> int:
+        """Create and link objects for the rows of buffer, returning the count"""
+        import bpy
+
+        ids = buffer.ids[rows]
+        matrices = buffer.matrices[rows]
+        colors = buffer.colors[rows]
+        objects = []
+        for prototype_id, prototype in enumerate(buffer.prototypes):
+            indices = np.flatnonzero(ids == prototype_id)
+            if not len(indices):
+                continue
+            if prototype.fragment is not None:
+                # Fragments are instanced by empties
+                fragment_collection = self._fragment_collection(prototype)
+                for index in indices:
+                    obj = bpy.data.objects.new(prototype.name, None)
+                    obj.instance_type = "COLLECTION"
+                    obj.instance_collection = fragment_collection
+                    ObjectTransformer(obj).apply_matrix(matrices[index])
+                    objects.append(obj)
+                continue
+            data = self._prototype_data(prototype)
+            transformer_cls = prototype.transformer_cls
+            assert transformer_cls is not None
+            for index in indices:
+                obj = _new_object(prototype.name, data)
+                transformer = transformer_cls(obj)
+                transformer.apply_matrix(matrices[index])
+                transformer.apply_color(tuple(colors[index].tolist()))
+                objects.append(obj)
+        # Link once the chunk is complete
+        link = collection.objects.link
+        for obj in objects:
+            link(obj)
+        return len(objects)
+
+    def _fragment_collection(self, prototype: Prototype) -> bpy.types.Collection:
+        """Return collection of the objects of a fragment prototype
+
+        The collection is not linked into the scene, it is only instanced.
+        """
+        import bpy
+
+        assert prototype.fragment is not None
+        collection = self._fragment_collections.get(id(prototype.fragment))
+        if collection is None:
+            collection = bpy.data.collections.new(prototype.name)
+            self._materialize(prototype.fragment, collection)
+            self._fragment_collections[id(prototype.fragment)] = collection
+        return collection
+
+    def _prototype_radius(self, prototype: Prototype) -> float:
+        """Radius bounding the data of prototype
+
+        Primitives are measured without creating their data. Other data is
+        created and cached, except for dry runs which use the Transformer
+        default.
+        """
+        geometry = prototype_geometry(prototype)
+        if geometry is not None:
+            if not len(geometry.vertices):
+                return Transformer.radius
+            return float(np.linalg.norm(geometry.vertices, axis=1).max())
+        if not isinstance(self.buffer, InstanceBuffer):
+            return Transformer.radius
+        return _data_radius(self._prototype_data(prototype))
+
+    def _prototype_data(self, prototype: Prototype) -> bpy.types.ID:
+        """Return cached data for prototype, creating it if needed"""
+        assert prototype.creation_func is not None
+        key = datakey(prototype.name, prototype.args, prototype.kwargs)
+        data = self._data_cache.get(key)
+        if not data:
+            data = self._data_cache[key] = _created_data(
+                prototype.creation_func(*prototype.args, **prototype.kwargs)
+            )
+        return data
 
     def line(
         self,
@@ -100,6 +684,132 @@ class ObjectFactory:
         thickness: ta.Annotated[int, ta.ValueRange(0, 1000)] = 1,
         transformer_cls=GreasePencilMaterialTransformer,
     ) -> bpy.types.GPencilStroke:
+        if isinstance(self.buffer, InstanceCounter):
+            return RecordingTransformer(self.buffer, self._line_prototype(points))
+        data = self._grease_pencil()
+        stroke = _new_stroke(data, np.asarray(points, dtype=np.float32), thickness)
+        return transformer_cls(data, stroke)
+
+    def lines(
+        self,
+        points: npt.ArrayLike,
+        matrices: npt.ArrayLike,
+        colors: ta.Optional[npt.ArrayLike] = None,
+        thickness: ta.Annotated[int, ta.ValueRange(0, 1000)] = 1,
+        transformer_cls=GreasePencilMaterialTransformer,
+    ) -> list[Transformer]:
+        """Create a stroke for each of the N (4, 4) matrices in one call
+
+        points is either (P, 3) points shared by all strokes, or (N, P, 3)
+        points per stroke. colors are optional (N, 4) RGBA colors.
+        """
+        matrices = np.asarray(matrices, dtype=np.float32).reshape(-1, 4, 4)
+        if isinstance(self.buffer, InstanceCounter):
+            transformer = RecordingTransformer(
+                self.buffer, self._line_prototype(points)
+            )
+            colors = np.broadcast_to(
+                (0.0, 0.0, 0.0, 1.0) if colors is None else colors,
+                (len(matrices), 4),
+            )
+            for matrix, color in zip(matrices, colors.tolist()):
+                self.buffer.append(transformer.prototype_id, matrix, tuple(color))
+            return [transformer] * len(matrices)
+        points = transform_points(matrices, np.asarray(points, dtype=np.float32))
+        widths = thickness * median_scale(matrices)
+        data = self._grease_pencil()
+        transformers = [
+            transformer_cls(data, _new_stroke(data, stroke_points, int(width)))
+            for stroke_points, width in zip(points, widths)
+        ]
+        if colors is not None:
+            for transformer, color in zip(transformers, np.asarray(colors).tolist()):
+                transformer.apply_color(tuple(color))
+        return transformers
+
+    def _line_prototype(self, points: npt.ArrayLike) -> int:
+        assert isinstance(self.buffer, InstanceCounter)
+        # Lines are only counted, by their number of points
+        count = np.shape(points)[-2]
+        prototype = Prototype(
+            "Line", None, GreasePencilMaterialTransformer, (count,), {}
+        )
+        return self.buffer.prototype(("Line", count), prototype)
+
+    def estimate(self) -> Estimate:
+        """Estimate the size of the scene materialize() would create
+
+        Mesh sizes are known for primitives, and for other meshes once they
+        are cached. Lines are only counted in dry runs.
+        """
+        buffer = self.buffer
+        if buffer is None:
+            raise ValueError("ObjectFactory has no buffer to estimate")
+        if isinstance(buffer, InstanceCounter):
+            counts = buffer.counts
+            colors = buffer.colors
+        else:
+            buffer = buffer.flatten()
+            counts = np.bincount(buffer.ids, minlength=len(buffer.prototypes)).tolist()
+            quantized = np.round(buffer.colors * 255).astype(np.int32)
+            colors = [
+                set(map(tuple, np.unique(quantized[buffer.ids == i], axis=0).tolist()))
+                for i in range(len(buffer.prototypes))
+            ]
+        prototypes: dict[str, int] = {}
+        materials: dict[type, set] = {}
+        vertices = mesh_vertices = 0
+        for prototype, count, prototype_colors in zip(
+            buffer.prototypes, counts, colors
+        ):
+            if not count or prototype.fragment is not None:
+                continue
+            prototypes[prototype.name] = prototypes.get(prototype.name, 0) + count
+            transformer_cls = prototype.transformer_cls
+            if transformer_cls is None:
+                pass
+            elif issubclass(transformer_cls, ObjectColorMaterialTransformer):
+                # Opaque and transparent materials
+                materials.setdefault(transformer_cls, set()).update(
+                    color[3] < 255 for color in prototype_colors
+                )
+            elif issubclass(
+                transformer_cls,
+                (MeshMaterialTransformer, GreasePencilMaterialTransformer),
+            ):
+                materials.setdefault(transformer_cls, set()).update(prototype_colors)
+            prototype_vertices = self._prototype_vertices(prototype)
+            vertices += count * prototype_vertices
+            mesh_vertices += prototype_vertices
+        objects = sum(prototypes.values())
+        material_count = sum(len(m) for m in materials.values())
+        return Estimate(
+            objects,
+            prototypes,
+            material_count,
+            vertices,
+            mesh_vertices,
+            objects * _OBJECT_BYTES
+            + material_count * _MATERIAL_BYTES
+            + mesh_vertices * _VERTEX_BYTES,
+        )
+
+    def _prototype_vertices(self, prototype: Prototype) -> int:
+        if prototype.name == "Line" and prototype.creation_func is None:
+            return prototype.args[0]
+        geometry = prototype_geometry(prototype)
+        if geometry is not None:
+            return len(geometry.vertices)
+        data = self._data_cache.get(
+            datakey(prototype.name, prototype.args, prototype.kwargs)
+        )
+        if prototype.creation_func is library_object and data is not None:
+            data = data.data
+        return len(getattr(data, "vertices", ()))
+
+    def _grease_pencil(self) -> bpy.types.GreasePencil:
+        import bpy
+
         datakey: tuple[str, tuple] = (
             "Line",
             tuple(),
@@ -111,71 +821,391 @@ class ObjectFactory:
             obj = bpy.data.objects.new("Line", data)
             bpy.context.collection.objects.link(obj)
             self._data_cache[datakey] = data
-        stroke = data.layers[0].frames[0].strokes.new()
-        stroke.line_width = thickness
-        stroke.points.add(count=len(points))
-        for sp, p in zip(stroke.points, points):
-            sp.co = p
-        return transformer_cls(data, stroke)
+        return data
 
     torus = functools.partialmethod(
         create_mesh,
         "Torus",
-        bpy.ops.mesh.primitive_torus_add,
+        functools.partial(_primitive_mesh, "Torus"),
         transformer_cls=MeshMaterialTransformer,
     )
     plane = functools.partialmethod(
         create_mesh,
         "Plane",
-        bpy.ops.mesh.primitive_plane_add,
+        functools.partial(_primitive_mesh, "Plane"),
         transformer_cls=MeshMaterialTransformer,
     )
     ico_sphere = functools.partialmethod(
         create_mesh,
         "IcoSphere",
-        bpy.ops.mesh.primitive_ico_sphere_add,
+        functools.partial(_primitive_mesh, "IcoSphere"),
         transformer_cls=MeshMaterialTransformer,
     )
     uv_sphere = functools.partialmethod(
         create_mesh,
         "UVSphere",
-        bpy.ops.mesh.primitive_uv_sphere_add,
+        functools.partial(_primitive_mesh, "UVSphere"),
         transformer_cls=MeshMaterialTransformer,
     )
     grid = functools.partialmethod(
         create_mesh,
         "Grid",
-        bpy.ops.mesh.primitive_grid_add,
+        functools.partial(_primitive_mesh, "Grid"),
         transformer_cls=MeshMaterialTransformer,
     )
     cylinder = functools.partialmethod(
         create_mesh,
         "Cylinder",
-        bpy.ops.mesh.primitive_cylinder_add,
+        functools.partial(_primitive_mesh, "Cylinder"),
         transformer_cls=MeshMaterialTransformer,
     )
     cone = functools.partialmethod(
         create_mesh,
         "Cone",
-        bpy.ops.mesh.primitive_cone_add,
+        functools.partial(_primitive_mesh, "Cone"),
         transformer_cls=MeshMaterialTransformer,
     )
     circle = functools.partialmethod(
         create_mesh,
         "Circle",
-        bpy.ops.mesh.primitive_circle_add,
+        functools.partial(_primitive_mesh, "Circle"),
         transformer_cls=MeshMaterialTransformer,
     )
     cube = functools.partialmethod(
         create_mesh,
         "Cube",
-        bpy.ops.mesh.primitive_cube_add,
+        functools.partial(_primitive_mesh, "Cube"),
         transformer_cls=MeshMaterialTransformer,
     )
 
 
+class InstancingObjectFactory(ObjectFactory):
+    """Materialize recorded instances as one point mesh object per prototype
+
+    Each point carries "rotation", "scale" and "color" attributes, and a
+    generated Geometry Nodes modifier instances the prototype on the points.
+    Shear in the instance matrices is not preserved.
+
+    Prototypes using a MeshMaterialTransformer other than
+    LibraryMaterialTransformer share a material per transformer class, created
+    by its create_material with colors read from the "color" attribute of the
+    instancer. Prototypes with transparent colors share a separate, alpha
+    blended material. Otherwise apply_color is not called, library objects
+    keep their own materials.
+    """
+
+    def __init__(self, buffer: ta.Optional[InstanceBuffer] = None):
+        super().__init__(InstanceBuffer() if buffer is None else buffer)
+        self._instance_materials: dict[tuple[type, bool], bpy.types.Material] = {}
+
+    def materialize(
+        self,
+        collection: ta.Optional[bpy.types.Collection] = None,
+        chunk_size: ta.Optional[int] = None,
+    ):
+        """Create a point mesh object for each prototype recorded in the buffer
+
+        The points of a prototype are created at once, so chunk_size is not
+        used. Progress is logged after each prototype.
+        """
+        import bpy
+
+        if not isinstance(self.buffer, InstanceBuffer):
+            raise ValueError("InstancingObjectFactory has no buffer to materialize")
+        link = (collection or self.collection or bpy.context.collection).objects.link
+        # Fragments are instanced as their contents
+        buffer = self.buffer.flatten()
+        progress = _Progress("Instanced", len(buffer))
+        for prototype_id, prototype in enumerate(buffer.prototypes):
+            mask = buffer.ids == prototype_id
+            if not mask.any():
+                continue
+            # The prototype object is referenced by the node group, not linked
+            instance = _new_object(prototype.name, self._prototype_data(prototype))
+            transformer_cls = prototype.transformer_cls
+            assert transformer_cls is not None
+            if issubclass(transformer_cls, MeshMaterialTransformer) and not issubclass(
+                transformer_cls, LibraryMaterialTransformer
+            ):
+                material = self._color_material(
+                    transformer_cls(instance), buffer.colors[mask]
+                )
+                instance.data.materials.clear()
+                instance.data.materials.append(material)
+
+            locations, rotations, scales = decompose(buffer.matrices[mask])
+            mesh = bpy.data.meshes.new(f"{prototype.name}Points")
+            mesh.vertices.add(len(locations))
+            mesh.vertices.foreach_set("co", locations.ravel())
+            _add_attribute(mesh, "rotation", "FLOAT_VECTOR", "vector", rotations)
+            _add_attribute(mesh, "scale", "FLOAT_VECTOR", "vector", scales)
+            _add_attribute(mesh, "color", "FLOAT_COLOR", "color", buffer.colors[mask])
+            obj = bpy.data.objects.new(f"{prototype.name}Points", mesh)
+            _add_instancer(obj, instance)
+            link(obj)
+            progress.update(len(locations))
+        self.buffer.clear()
+
+    def _color_material(
+        self, transformer: MeshMaterialTransformer, colors: np.ndarray
+    ) -> bpy.types.Material:
+        """Material of transformer reading the instancer color attribute"""
+        key = (type(transformer), bool((colors[:, 3] < 1).any()))
+        material = self._instance_materials.get(key)
+        if material is None:
+            material = self._instance_materials[key] = _attribute_material(
+                "InstanceColor", transformer, "INSTANCER", key[1]
+            )
+        return material
+
+
+class MergingObjectFactory(ObjectFactory):
+    """Materialize recorded instances as merged meshes, one per prototype
+
+    The vertices of each prototype mesh are transformed by the instance
+    matrices into a single mesh, with the instance colors in a "color" point
+    attribute. This is much faster to save and export than an object per
+    instance, for static scenes.
+
+    Prototypes using a MeshMaterialTransformer other than
+    LibraryMaterialTransformer share a material per transformer class, created
+    by its create_material with colors read from the "color" attribute. Meshes
+    with transparent colors share a separate, alpha blended material.
+    Otherwise the materials of the prototype mesh are kept. Modifiers of
+    library objects are not applied, and prototypes without mesh data are
+    materialized as separate objects.
+    """
+
+    def __init__(self, buffer: ta.Optional[InstanceBuffer] = None):
+        super().__init__(InstanceBuffer() if buffer is None else buffer)
+        self._merged_materials: dict[tuple[type, bool], bpy.types.Material] = {}
+
+    def materialize(
+        self,
+        collection: ta.Optional[bpy.types.Collection] = None,
+        chunk_size: ta.Optional[int] = None,
+    ):
+        """Create merged mesh objects for the instances recorded in the buffer
+
+        Each mesh merges at most chunk_size instances, defaulting to 100000.
+        Progress is logged after each mesh.
+        """
+        import bpy
+
+        if not isinstance(self.buffer, InstanceBuffer):
+            raise ValueError("MergingObjectFactory has no buffer to materialize")
+        collection = collection or self.collection or bpy.context.collection
+        # Fragments are merged as their contents
+        buffer = self.buffer.flatten()
+        chunk_size = chunk_size or 100000
+        progress = _Progress("Merged", len(buffer))
+        for prototype_id, prototype in enumerate(buffer.prototypes):
+            indices = np.flatnonzero(buffer.ids == prototype_id)
+            if not len(indices):
+                continue
+            geometry = prototype_geometry(prototype)
+            source = None
+            if geometry is None:
+                source = self._prototype_data(prototype)
+                if isinstance(source, bpy.types.Object):
+                    source = source.data
+                if not isinstance(source, bpy.types.Mesh):
+                    progress.update(self._materialize(buffer, collection, indices))
+                    continue
+                geometry = _mesh_geometry(source)
+            for start in range(0, len(indices), chunk_size):
+                rows = indices[start : start + chunk_size]
+                mesh = bpy.data.meshes.new(prototype.name)
+                _write_geometry(mesh, _merge_geometry(geometry, buffer.matrices[rows]))
+                colors = np.repeat(buffer.colors[rows], len(geometry.vertices), axis=0)
+                _add_attribute(mesh, "color", "FLOAT_COLOR", "color", colors)
+                obj = bpy.data.objects.new(prototype.name, mesh)
+                self._merge_materials(prototype, source, obj, buffer.colors[rows])
+                collection.objects.link(obj)
+                progress.update(len(rows))
+        self.buffer.clear()
+
+    def _merge_materials(
+        self,
+        prototype: Prototype,
+        source: ta.Optional[bpy.types.Mesh],
+        obj: bpy.types.Object,
+        colors: np.ndarray,
+    ):
+        """Set materials of the mesh of obj merging copies of source with colors"""
+        mesh = obj.data
+        count = len(colors)
+        transformer_cls = prototype.transformer_cls
+        if (
+            transformer_cls is not None
+            and issubclass(transformer_cls, MeshMaterialTransformer)
+            and not issubclass(transformer_cls, LibraryMaterialTransformer)
+        ):
+            key = (transformer_cls, bool((colors[:, 3] < 1).any()))
+            material = self._merged_materials.get(key)
+            if material is None:
+                material = self._merged_materials[key] = _attribute_material(
+                    "MergedColor", transformer_cls(obj), "GEOMETRY", key[1]
+                )
+            mesh.materials.append(material)
+        elif source is not None:
+            for material in source.materials:
+                mesh.materials.append(material)
+            for name, dtype in (("material_index", np.int32), ("use_smooth", bool)):
+                values = np.empty(len(source.polygons), dtype=dtype)
+                source.polygons.foreach_get(name, values)
+                mesh.polygons.foreach_set(name, np.tile(values, count))
+
+
+def _attribute_material(
+    name: str,
+    transformer: MeshMaterialTransformer,
+    attribute_type: str,
+    transparent: bool,
+) -> bpy.types.Material:
+    """Material created by transformer, with colors from the "color" attribute
+
+    The attribute is linked to the Base Color and Alpha of its Principled BSDF.
+    """
+    material = transformer.create_material((1.0, 1.0, 1.0, 1.0))
+    material.name = name
+    if transparent:
+        material.blend_method = "BLEND"
+    node_tree = material.node_tree
+    bsdf = node_tree.nodes.get("Principled BSDF") if node_tree else None
+    if bsdf is None:
+        log.warning(
+            "%s material has no Principled BSDF, instance colors are ignored",
+            type(transformer).__name__,
+        )
+        return material
+    attribute = node_tree.nodes.new("ShaderNodeAttribute")
+    attribute.attribute_type = attribute_type
+    attribute.attribute_name = "color"
+    node_tree.links.new(attribute.outputs["Color"], bsdf.inputs["Base Color"])
+    node_tree.links.new(attribute.outputs["Alpha"], bsdf.inputs["Alpha"])
+    return material
+
+
+class _Progress:
+    """Logs throughput, elapsed and estimated remaining time of a task"""
+
+    def __init__(self, action: str, total: ta.Optional[int] = None):
+        self.action = action
+        self.total = total
+        self.count = 0
+        self.start = time.perf_counter()
+
+    def update(self, count: int):
+        self.count += count
+        elapsed = time.perf_counter() - self.start
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        message = f"{self.action} {self.count}"
+        if self.total:
+            message += f"/{self.total}"
+        message += f" objects, {rate:.0f} objects/s, {elapsed:.1f}s elapsed"
+        if self.total and rate:
+            message += f", {(self.total - self.count) / rate:.1f}s remaining"
+        log.info(message)
+
+
+def _new_stroke(
+    grease_pencil: bpy.types.GreasePencil, points: np.ndarray, thickness: int
+) -> bpy.types.GPencilStroke:
+    stroke = grease_pencil.layers[0].frames[0].strokes.new()
+    stroke.line_width = thickness
+    stroke.points.add(count=len(points))
+    stroke.points.foreach_set("co", np.ascontiguousarray(points).ravel())
+    return stroke
+
+
+def _add_attribute(
+    mesh: bpy.types.Mesh, name: str, data_type: str, value: str, data: np.ndarray
+):
+    attribute = mesh.attributes.new(name, data_type, "POINT")
+    attribute.data.foreach_set(value, np.ascontiguousarray(data, np.float32).ravel())
+
+
+def _add_instancer(obj: bpy.types.Object, instance: bpy.types.Object):
+    """Add a Geometry Nodes modifier to obj instancing instance on its points
+
+    The "rotation" and "scale" point attributes are bound to the modifier
+    inputs, as the Named Attribute node requires Blender 3.2.
+    """
+    import bpy
+
+    group = bpy.data.node_groups.new(f"{instance.name}Instancer", "GeometryNodeTree")
+    _group_socket(group, "INPUT", "NodeSocketGeometry", "Geometry")
+    attributes = {
+        name: _group_socket(group, "INPUT", "NodeSocketVector", name)
+        for name in ("Rotation", "Scale")
+    }
+    _group_socket(group, "OUTPUT", "NodeSocketGeometry", "Geometry")
+    nodes = group.nodes
+    links = group.links
+    group_input = nodes.new("NodeGroupInput")
+    group_output = nodes.new("NodeGroupOutput")
+    object_info = nodes.new("GeometryNodeObjectInfo")
+    object_info.inputs["Object"].default_value = instance
+    instance_on_points = nodes.new("GeometryNodeInstanceOnPoints")
+    links.new(group_input.outputs["Geometry"], instance_on_points.inputs["Points"])
+    links.new(object_info.outputs["Geometry"], instance_on_points.inputs["Instance"])
+    for name in attributes:
+        links.new(group_input.outputs[name], instance_on_points.inputs[name])
+    links.new(instance_on_points.outputs["Instances"], group_output.inputs["Geometry"])
+    modifier = obj.modifiers.new("Instances", "NODES")
+    modifier.node_group = group
+    for name, socket in attributes.items():
+        modifier[f"{socket.identifier}_use_attribute"] = True
+        modifier[f"{socket.identifier}_attribute_name"] = name.lower()
+
+
+def _group_socket(
+    group: bpy.types.NodeTree, in_out: str, socket_type: str, name: str
+) -> ta.Any:
+    """Add an input or output socket to group, returning its interface"""
+    if hasattr(group, "interface"):
+        # Blender 4.0 and later
+        return group.interface.new_socket(name, in_out=in_out, socket_type=socket_type)
+    sockets = group.inputs if in_out == "INPUT" else group.outputs
+    return sockets.new(socket_type, name)
+
+
 def background(color: Color):
     """Set Blender background color"""
+    import bpy
+
     bpy.context.scene.world.node_tree.nodes["Background"].inputs[
         "Color"
     ].default_value = hsva_to_rgba(color)
+
+
+def camera_frustum(
+    min_pixels: float = 1.0,
+    camera: ta.Optional[bpy.types.Object] = None,
+    scene: ta.Optional[bpy.types.Scene] = None,
+) -> Frustum:
+    """Return Frustum of the scene camera at the scene render resolution
+
+    The camera must be positioned before the grammar is expanded.
+    """
+    import bpy
+
+    scene = scene or bpy.context.scene
+    camera = camera or scene.camera
+    render = scene.render
+    frame = np.array([tuple(corner) for corner in camera.data.view_frame(scene=scene)])
+    orthographic = camera.data.type == "ORTHO"
+    if not orthographic:
+        frame = frame / -frame[:, 2:]
+    return Frustum(
+        np.array(camera.matrix_world),
+        (frame[:, 0].min(), frame[:, 0].max(), frame[:, 1].min(), frame[:, 1].max()),
+        (camera.data.clip_start, camera.data.clip_end),
+        (
+            render.resolution_x * render.resolution_percentage // 100,
+            render.resolution_y * render.resolution_percentage // 100,
+        ),
+        min_pixels,
+        orthographic,
+    )
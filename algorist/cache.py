@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import functools
+import glob
+import hashlib
+import inspect
+import logging
+import os
+import typing as ta
+
+import numpy as np
+
+from . import decorator, random
+from .export import load_npz, save_npz
+from .instance import InstanceBuffer
+from .transform import Transform
+
+log = logging.getLogger(__name__)
+
+
+def default_directory() -> str:
+    """$ALGORIST_CACHE, or algorist in the user cache directory"""
+    return os.environ.get("ALGORIST_CACHE") or os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+        "algorist",
+    )
+
+
+class ExpansionCache:
+    """On-disk cache of the instances recorded by expanding a rule
+
+    Entries are .npz files saved by save_npz and memory mapped by load_npz,
+    keyed by a hash of the source and limits of the rule and all registered
+    rules, the arguments, parameters, seed and initial transform state, and
+    the algorist sources. Changes to globals the rules use are not detected,
+    so they should be passed as parameters.
+
+    Least recently used entries are evicted once the entries total more than
+    max_bytes.
+    """
+
+    def __init__(self, directory: ta.Optional[str] = None, max_bytes: int = 2**30):
+        self.directory = directory or default_directory()
+        self.max_bytes = max_bytes
+
+    def record(
+        self,
+        buffer: InstanceBuffer,
+        rule: ta.Callable,
+        *args,
+        seed: ta.Optional[int] = None,
+        transform: ta.Optional[Transform] = None,
+        parameters: ta.Optional[dict[str, ta.Any]] = None,
+        **kwargs,
+    ) -> bool:
+        """Call rule recording into buffer, or append its cached instances
+
+        The random stream is seeded from seed, or from $ALGORIST_SEED. If
+        neither is set the expansion is not cached, and the stream is left
+        as is. rule can be any function recording into buffer, such as one
+        running an Expansion. Returns whether the instances were cached.
+        """
+        if seed is None and random.SEED_VARIABLE in os.environ:
+            seed = int(os.environ[random.SEED_VARIABLE])
+        if seed is None:
+            log.info("Not caching expansion, it has no seed")
+            rule(*args, **kwargs)
+            return False
+        random.seed(seed)
+        key = self.key(rule, args, kwargs, seed, transform, parameters)
+        path = os.path.join(self.directory, f"{key}.npz")
+        cached = self._load(path)
+        if cached is not None:
+            buffer.extend(cached)
+            log.info(f"Loaded {len(cached)} cached instances from {path}")
+            return True
+        start = len(buffer)
+        # Keep recorded rows in place until saved
+        buffer.pinned += 1
+        try:
+            rule(*args, **kwargs)
+            self._save(buffer.slice(start), key, path)
+        finally:
+            buffer.pinned -= 1
+        return False
+
+    def key(
+        self,
+        rule: ta.Callable,
+        args: tuple = (),
+        kwargs: ta.Optional[dict[str, ta.Any]] = None,
+        seed: ta.Optional[int] = None,
+        transform: ta.Optional[Transform] = None,
+        parameters: ta.Optional[dict[str, ta.Any]] = None,
+    ) -> str:
+        """Return the cache key of expanding rule"""
+        digest = hashlib.blake2b(_package_digest(), digest_size=16)
+        rules = [rule] + [
+            func for variants in decorator._RULES.values() for _, func in variants
+        ]
+        for source in sorted(_rule_source(func) for func in rules):
+            digest.update(source)
+        digest.update(
+            repr(
+                (
+                    args,
+                    sorted((kwargs or {}).items()),
+                    sorted((parameters or {}).items()),
+                    seed,
+                )
+            ).encode()
+        )
+        if transform is not None:
+            matrix, color = transform.snapshot()
+            digest.update(np.asarray(matrix, dtype=np.float64).tobytes())
+            digest.update(repr(color).encode())
+        return digest.hexdigest()
+
+    def clear(self):
+        """Remove all cache entries"""
+        for path in self._entries():
+            os.unlink(path)
+
+    def _load(self, path: str) -> ta.Optional[InstanceBuffer]:
+        if not os.path.exists(path):
+            return None
+        try:
+            cached = load_npz(path)
+        except (OSError, ValueError) as e:
+            log.warning(f"Ignoring unreadable cache entry {path}: {e}")
+            return None
+        if any(
+            prototype.creation_func is None or prototype.transformer_cls is None
+            for prototype in cached.prototypes
+        ):
+            log.info(f"Ignoring cache entry {path}, its prototypes can not be imported")
+            return None
+        # Mark as recently used
+        os.utime(path)
+        return cached
+
+    def _save(self, buffer: InstanceBuffer, key: str, path: str):
+        os.makedirs(self.directory, exist_ok=True)
+        # Written under a temporary name, so concurrent runs never load partial
+        # entries
+        temporary = os.path.join(self.directory, f".{key}.{os.getpid()}.npz")
+        try:
+            save_npz(buffer, temporary)
+        except (TypeError, ValueError) as e:
+            log.warning(f"Can not cache expansion: {e}")
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+            return
+        os.replace(temporary, path)
+        self._evict()
+
+    def _entries(self) -> list[str]:
+        return glob.glob(os.path.join(self.directory, "[!.]*.npz"))
+
+    def _evict(self):
+        entries = []
+        for path in self._entries():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # Evicted concurrently
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            log.info(f"Evicted cache entry {path}")
+
+
+def _rule_source(func: ta.Callable) -> bytes:
+    """Source of func, including its decorators, and its limits"""
+    limits = getattr(func, "limits", None)
+    func = inspect.unwrap(func)
+    try:
+        source = inspect.getsource(func).encode()
+    except (OSError, TypeError):
+        source = func.__code__.co_code
+    return source + repr(sorted(limits.items()) if limits else None).encode()
+
+
+@functools.lru_cache(maxsize=None)
+def _package_digest() -> bytes:
+    """Digest of the algorist sources, as they determine expansions"""
+    digest = hashlib.blake2b(digest_size=16)
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(__file__), "*.py"))):
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.digest()
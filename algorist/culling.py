@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import math
+
+import numpy as np
+import numpy.typing as npt
+
+
+class Frustum:
+    """Culls bounding spheres outside a camera view or smaller than a pixel
+
+    The camera looks down its local -Z axis. bounds are the (left, right,
+    bottom, top) edges of the view, as tangents of the view angles for a
+    perspective camera, or as distances from the axis for an orthographic one.
+    resolution is the rendered (width, height) in pixels, spheres projecting
+    to a diameter less than min_pixels are culled.
+    """
+
+    __slots__ = ("view", "planes", "orthographic", "pixels_per_unit", "min_pixels")
+
+    def __init__(
+        self,
+        matrix_world: npt.ArrayLike,
+        bounds: tuple[float, float, float, float],
+        clip: tuple[float, float] = (0.1, 1000.0),
+        resolution: tuple[int, int] = (1920, 1080),
+        min_pixels: float = 1.0,
+        orthographic: bool = False,
+    ):
+        left, right, bottom, top = bounds
+        clip_start, clip_end = clip
+        self.view = np.linalg.inv(np.asarray(matrix_world, float))
+        self.orthographic = orthographic
+        # Signed distance of a point (x, y, z, 1) is its dot product with a plane
+        if orthographic:
+            sides = [
+                (1.0, 0.0, 0.0, -right),
+                (-1.0, 0.0, 0.0, left),
+                (0.0, 1.0, 0.0, -top),
+                (0.0, -1.0, 0.0, bottom),
+            ]
+        else:
+            sides = [
+                _normalized((1.0, 0.0, right, 0.0)),
+                _normalized((-1.0, 0.0, -left, 0.0)),
+                _normalized((0.0, 1.0, top, 0.0)),
+                _normalized((0.0, -1.0, -bottom, 0.0)),
+            ]
+        self.planes: list[list[float]] = np.array(
+            sides + [(0.0, 0.0, 1.0, clip_start), (0.0, 0.0, -1.0, -clip_end)]
+        ).tolist()
+        self.pixels_per_unit = resolution[0] / (right - left)
+        self.min_pixels = min_pixels
+
+    def visible(self, matrix: np.ndarray, radius: float) -> bool:
+        """Return True if the sphere of radius around the origin of the
+        local space of matrix may be visible
+        """
+        # Plain floats are faster than NumPy for a single sphere
+        x, y, z, (cx, cy, cz) = zip(*(self.view @ matrix)[:3].tolist())
+        radius *= max(math.hypot(*x), math.hypot(*y), math.hypot(*z))
+        for a, b, c, d in self.planes:
+            if a * cx + b * cy + c * cz + d > radius:
+                return False
+        if self.orthographic:
+            depth = 1.0
+        else:
+            depth = -cz
+            # The camera is inside the sphere
+            if depth <= radius:
+                return True
+        return 2 * radius * self.pixels_per_unit / depth >= self.min_pixels
+
+
+def _normalized(
+    plane: tuple[float, float, float, float],
+) -> tuple[float, float, float, float]:
+    x, y, z, w = plane
+    length = math.sqrt(x * x + y * y + z * z)
+    return (x / length, y / length, z / length, w / length)
@@ -1,16 +1,25 @@
 from __future__ import annotations
 
 import functools
+import itertools
 import logging
-import random
+import math
+import os
+import types
 import typing as ta
 
-from .transform import Transform
+import numpy as np
+
+from . import expansion, profiler, random
+from .instance import InstanceBuffer, Prototype
+from .spatial import SpatialHash, bounding_sphere
+from .transform import Transform, matrix_scale
 
 log = logging.getLogger(__name__)
 
 
 _RULES: dict[str, list[tuple[float, ta.Callable]]] = {}
+_SAMPLERS: dict[str, _RuleSampler] = {}
 
 
 def rule(weight=1.0):
@@ -27,23 +36,94 @@ def rule(weight=1.0):
         def wrapper(*args, **kwargs):
             return _invoke_rule(name, *args, **kwargs)
 
-        if name not in _RULES:
-            _RULES[name] = []
-            last_weight = 0
-        else:
-            last_weight = _RULES[name][-1][0]
-        _RULES[name].append((last_weight + weight, func))
+        _RULES.setdefault(name, []).append((weight, func))
+        # Recompiled on next invocation
+        _SAMPLERS.pop(name, None)
 
         return wrapper
 
     return decorator
 
 
+def reset_rules():
+    """Forget all rules, so scripts defining them can be run again"""
+    _RULES.clear()
+    _SAMPLERS.clear()
+
+
+class _RuleSampler:
+    """Weighted choice of rule variants in constant time using Walker's alias method"""
+
+    __slots__ = ("funcs", "probabilities", "aliases")
+
+    def __init__(self, rules: list[tuple[float, ta.Callable]]):
+        self.funcs = [func for _, func in rules]
+        count = len(rules)
+        total = sum(weight for weight, _ in rules)
+        scaled = [weight * count / total for weight, _ in rules]
+        self.probabilities = [1.0] * count
+        self.aliases = list(range(count))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less = small.pop()
+            more = large[-1]
+            self.probabilities[less] = scaled[less]
+            self.aliases[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            if scaled[more] < 1.0:
+                small.append(large.pop())
+
+    def choose(self) -> ta.Callable:
+        if len(self.funcs) == 1:
+            return self.funcs[0]
+        r = random.current().random() * len(self.funcs)
+        i = int(r)
+        return self.funcs[i if r - i < self.probabilities[i] else self.aliases[i]]
+
+    def sample(self, count: int) -> list[ta.Callable]:
+        if len(self.funcs) == 1:
+            return self.funcs * count
+        r = random.current().random_array(count) * len(self.funcs)
+        i = r.astype(np.intp)
+        chosen = np.where(
+            r - i < np.take(self.probabilities, i), i, np.take(self.aliases, i)
+        )
+        return [self.funcs[c] for c in chosen.tolist()]
+
+
+def _sampler(name: str) -> _RuleSampler:
+    sampler = _SAMPLERS.get(name)
+    if sampler is None:
+        sampler = _SAMPLERS[name] = _RuleSampler(_RULES[name])
+    return sampler
+
+
 def _invoke_rule(name: str, *args, **kwargs):
-    rules = _RULES[name]
-    return random.choices(
-        [rule[1] for rule in rules], cum_weights=[rule[0] for rule in rules]
-    )[0](*args, **kwargs)
+    # The variant is chosen by the caller, so invocations which draw nothing
+    # never derive their child stream
+    func = _sampler(name).choose()
+    parent = random.switch(random.current().spawn())
+    try:
+        active = profiler.active()
+        # Limited variants are profiled by limit
+        if active is None or hasattr(func, "reset"):
+            return func(*args, **kwargs)
+        return active.call(func, args, kwargs)
+    finally:
+        random.switch(parent)
+
+
+def sample_rules(name: str, count: int) -> list[ta.Callable]:
+    """Choose count variants of the named rule at once, based on their weights"""
+    return _sampler(name).sample(count)
+
+
+_LIMIT_WARNINGS = {
+    "max_depth": "Max recursion depth exceeded",
+    "max_objects": "Max objects exceeded",
+    "min_scale": "Min scale exceeded",
+}
 
 
 def limit(
@@ -51,9 +131,17 @@ def limit(
     max_objects: int = 10000,
     min_scale: ta.Optional[float] = None,
     transform: ta.Optional[Transform] = None,
+    cull_radius: ta.Optional[float] = None,
 ):
+    """Create a function decorator limiting the expansion of a rule
+
+    If cull_radius is set, calls are skipped when the sphere of that radius
+    bounding the rules subtree is rejected by the culler of transform.
+    """
     if transform is None and min_scale is not None:
         raise ValueError("Cannot set min_scale without transform")
+    if transform is None and cull_radius is not None:
+        raise ValueError("Cannot set cull_radius without transform")
 
     def decorator(func):
         depth = 0
@@ -63,25 +151,193 @@ def limit(
         def wrapper(*args, **kwargs):
             nonlocal depth, objects
             depth += 1
-            objects += 1
-            if depth >= max_depth:
-                log.warning("Max recursion depth exceeded")
-                result = None
+            current = expansion.active()
+            if current is None:
+                objects += 1
+                count = objects
             else:
-                if objects >= max_objects:
-                    log.warning("Max objects exceeded")
-                    result = None
+                # Count per Expansion run
+                count = current.counters[wrapper] = current.counters.get(wrapper, 0) + 1
+            # Generator rules are expanded later, so add the expansion depth
+            if depth + (current.depth - 1 if current else 0) >= max_depth:
+                reason: ta.Optional[str] = "max_depth"
+            elif count >= max_objects:
+                reason = "max_objects"
+            elif min_scale is not None and _below_scale(transform, min_scale):
+                reason = "min_scale"
+            elif (
+                cull_radius is not None
+                and transform.culler is not None
+                and not transform.culler.visible(transform.matrix, cull_radius)
+            ):
+                reason = "culled"
+            else:
+                reason = None
+            active = profiler.active()
+            if reason is None:
+                if active is None:
+                    result = func(*args, **kwargs)
                 else:
-                    if min_scale is not None and any(
-                        (s <= min_scale for s in transform.matrix.to_scale())
-                    ):
-                        log.warning("Min scale exceeded")
-                        result = None
-                    else:
-                        result = func(*args, **kwargs)
+                    result = active.call(func, args, kwargs)
+            else:
+                if reason in _LIMIT_WARNINGS:
+                    log.warning(_LIMIT_WARNINGS[reason])
+                if active is not None:
+                    active.limit(func, reason)
+                result = None
             depth -= 1
             return result
 
+        def reset():
+            """Reset object count for calls made outside of an Expansion"""
+            nonlocal objects
+            objects = 0
+
+        wrapper.reset = reset  # type: ignore[attr-defined]
+        # Read by ExpansionCache keys
+        wrapper.limits = {  # type: ignore[attr-defined]
+            "max_depth": max_depth,
+            "max_objects": max_objects,
+            "min_scale": min_scale,
+            "cull_radius": cull_radius,
+        }
+        return wrapper
+
+    return decorator
+
+
+# Number of min_scale limits evaluated, read by memoize
+_scale_checks = 0
+
+
+def _below_scale(transform: Transform, min_scale: float) -> bool:
+    global _scale_checks
+    _scale_checks += 1
+    return bool((matrix_scale(transform.matrix) <= min_scale).any())
+
+
+class _Fragment(ta.NamedTuple):
+    """Fragment prototype captured by memoize"""
+
+    prototype_id: int
+    # Radius bounding the fragment in its captured space
+    radius: float
+    # Inverse of the scale the fragment was captured at
+    unscale: np.ndarray
+    # Whether a min_scale limit was evaluated while capturing
+    scaled: bool
+
+
+# Distinguishes fragments captured by forked Expansion workers
+_FRAGMENT_IDS = itertools.count()
+
+
+def memoize(transform: Transform, buffer: InstanceBuffer):
+    """Create a function decorator caching the instances a rule records
+
+    The first call with given arguments and color is expanded relative to
+    the origin and captured as a fragment prototype in buffer. Every call
+    then records a single instance of the fragment with the current matrix.
+    Nested memoized rules become nested fragments, so self-similar models
+    record a number of instances proportional to their depth.
+
+    Fragments are captured without culling, and each instance is culled and
+    indexed by the transform as a whole, with a radius bounding the fragment.
+
+    Fragments are captured at the scale of the current matrix. If a min_scale
+    limit is evaluated while capturing, the fragment depends on the scale,
+    so calls at other scales capture their own fragments. Other limits are
+    evaluated while capturing, so a fragment keeps the depth and object
+    counts of its first call. Recursive calls with the arguments and color
+    being captured are expanded into the fragment instead of memoized.
+
+    The rule must be deterministic and not a generator, and must only record
+    into buffer.
+    """
+
+    def decorator(func):
+        fragments: dict[ta.Hashable, _Fragment] = {}
+        # Keys of the fragments being captured
+        capturing: set[ta.Hashable] = set()
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())), transform.snapshot()[1])
+            if key in capturing:
+                func(*args, **kwargs)
+                return
+            scale = None
+            fragment = fragments.get(key)
+            if fragment is not None and fragment.scaled:
+                scale = tuple(matrix_scale(transform.matrix).tolist())
+                fragment = fragments.get((key, scale))
+            if fragment is None:
+                capturing.add(key)
+                try:
+                    fragment = _capture(func, args, kwargs)
+                finally:
+                    capturing.discard(key)
+                if fragment.scaled:
+                    scale = tuple(matrix_scale(transform.matrix).tolist())
+                    fragments[(key, scale)] = fragment
+                # Scaled fragments mark their key as scale dependent
+                fragments.setdefault(key, fragment)
+            matrix = transform.matrix @ fragment.unscale
+            if transform.culler is not None and not transform.culler.visible(
+                matrix, fragment.radius
+            ):
+                return
+            buffer.append(fragment.prototype_id, matrix, transform.color_rgba)
+            if transform.index is not None:
+                transform.index.insert(*bounding_sphere(matrix, fragment.radius))
+
         return wrapper
 
+    def _capture(func, args, kwargs) -> _Fragment:
+        """Record the fragment of func at the scale of the current matrix"""
+        state = transform.snapshot()
+        culler, index = transform.culler, transform.index
+        start = len(buffer)
+        checks = _scale_checks
+        scale = matrix_scale(state[0])
+        scale = np.where(scale > 0, scale, 1.0)
+        transform.restore((np.diag((*scale, 1.0)), state[1]))
+        # Collects the bounding spheres of the fragment
+        bounds = transform.index = SpatialHash()
+        transform.culler = None
+        buffer.pinned += 1
+        try:
+            if isinstance(func(*args, **kwargs), types.GeneratorType):
+                raise TypeError("Cannot memoize generator rules")
+        finally:
+            buffer.pinned -= 1
+            transform.restore(state)
+            transform.culler, transform.index = culler, index
+        fragment = buffer.slice(start)
+        buffer.truncate(start)
+        # Each capture is a distinct prototype, even for equal arguments
+        prototype_id = buffer.prototype(
+            (
+                "Fragment",
+                func.__module__,
+                func.__qualname__,
+                os.getpid(),
+                next(_FRAGMENT_IDS),
+            ),
+            Prototype(func.__name__, None, None, args, kwargs, fragment),
+        )
+        radius = max(
+            (
+                math.hypot(*center) + bound
+                for center, bound in zip(bounds.centers, bounds.radii)
+            ),
+            default=0.0,
+        )
+        return _Fragment(
+            prototype_id,
+            radius,
+            np.diag((*(1 / scale), 1.0)),
+            _scale_checks != checks,
+        )
+
     return decorator
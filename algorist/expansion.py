@@ -0,0 +1,335 @@
+from __future__ import annotations
+
+import abc
+import collections
+import concurrent.futures
+import contextlib
+import heapq
+import itertools
+import logging
+import multiprocessing
+import os
+import types
+import typing as ta
+
+from . import profiler, random
+from .instance import InstanceBuffer, Prototype
+from .transform import Transform, matrix_scale
+
+if ta.TYPE_CHECKING:
+    import numpy as np
+
+    from . import Color
+
+log = logging.getLogger(__name__)
+
+_ACTIVE: ta.Optional[Expansion] = None
+# Expansion, tasks and number of prototypes of its buffer, inherited by forked
+# worker processes
+_FORKED: ta.Optional[tuple[Expansion, list[_Task], int]] = None
+
+
+class Invocation(ta.NamedTuple):
+    func: ta.Callable
+    args: tuple
+    kwargs: dict[str, ta.Any]
+
+
+def defer(func: ta.Callable, *args, **kwargs) -> Invocation:
+    """Create an invocation of func, for a generator rule to yield"""
+    return Invocation(func, args, kwargs)
+
+
+def active() -> ta.Optional[Expansion]:
+    """Return the Expansion currently running, if any"""
+    return _ACTIVE
+
+
+def largest_scale(transform: Transform) -> float:
+    """Priority expanding the largest world-space scale first"""
+    return float(matrix_scale(transform.matrix).max())
+
+
+class _Pending(ta.NamedTuple):
+    depth: int
+    invocation: Invocation
+    state: tuple[np.ndarray, Color]
+    stream: random.Stream
+    priority: float = 0.0
+
+
+class _Task(ta.NamedTuple):
+    pending: _Pending
+    counters: dict[ta.Hashable, int]
+
+
+class Expansion:
+    """Expand rules from an explicit work queue instead of recursion
+
+    Rules written as generators yield the rules to expand next instead of
+    calling them, either as a callable or a defer() Invocation. The transform
+    state at the time of the yield is captured, and restored when the yielded
+    rule is expanded. Rules that are not generators are just called.
+
+    order is "depth" for depth first or "breadth" for breadth first expansion,
+    or "priority" to expand the highest priority invocation first. priority is
+    called with the transform at the time an invocation is yielded.
+
+    Invocations deeper than max_depth are discarded, and expansion stops after
+    max_objects invocations. With priority order, a fixed budget is spent on
+    the most important parts of the model instead of the first ones reached.
+
+    limit counters are scoped to each run.
+
+    Each invocation draws random numbers from its own stream, spawned from
+    the stream of the invocation that yielded it. The root stream is seeded
+    from seed, or spawned from the current stream if seed is None.
+
+    If split_depth is specified, invocations reaching that depth become
+    independent tasks. Tasks are expanded by a pool of workers processes into
+    copies of buffer, and merged back into buffer in order, so the result is
+    the same as expanding the tasks serially with workers=1. Workers are
+    forked, so the rules, transform and buffer need not be picklable, and
+    instances of prototypes registered before the split are returned by id.
+    Prototypes first registered by tasks are pickled back, so must be
+    picklable. Rules must only record into buffer. If fork is not available
+    tasks are expanded serially.
+    limit counters are scoped to each task.
+    """
+
+    def __init__(
+        self,
+        transform: Transform,
+        max_depth: ta.Optional[int] = None,
+        max_objects: ta.Optional[int] = None,
+        order: ta.Literal["depth", "breadth", "priority"] = "depth",
+        priority: ta.Callable[[Transform], float] = largest_scale,
+        split_depth: ta.Optional[int] = None,
+        workers: ta.Optional[int] = None,
+        buffer: ta.Optional[InstanceBuffer] = None,
+        seed: ta.Optional[int] = None,
+    ):
+        if split_depth is not None:
+            if order == "priority" or max_objects is not None:
+                raise ValueError("Cannot split a priority or max_objects expansion")
+            if buffer is None:
+                raise ValueError("Cannot set split_depth without buffer")
+        self.transform = transform
+        self.max_depth = max_depth
+        self.max_objects = max_objects
+        self.order = order
+        self.priority = priority
+        self.split_depth = split_depth
+        self.workers = workers or os.cpu_count() or 1
+        self.buffer = buffer
+        self.seed = seed
+        self.depth = 0
+        self.objects = 0
+        self.counters: dict[ta.Hashable, int] = {}
+
+    def run(self, func: ta.Callable, *args, **kwargs):
+        """Expand func and everything it yields"""
+        global _ACTIVE
+        previous, _ACTIVE = _ACTIVE, self
+        initial_state = self.transform.snapshot()
+        self.objects = 0
+        self.counters = {}
+        stream = (
+            random.current().spawn()
+            if self.seed is None
+            else random.Stream.from_seed(self.seed)
+        )
+        root = _Pending(1, Invocation(func, args, kwargs), initial_state, stream)
+        previous_stream = random.current()
+        try:
+            if self.split_depth is None:
+                self._expand(root)
+            else:
+                self._expand_split(root)
+        finally:
+            self.depth = 0
+            self.transform.restore(initial_state)
+            random.switch(previous_stream)
+            _ACTIVE = previous
+
+    def _expand_split(self, root: _Pending):
+        split: list[_Pending] = []
+        self._expand(root, split)
+        tasks = [_Task(pending, self.counters) for pending in split]
+        workers = min(self.workers, len(tasks))
+        if workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+            self._expand_forked(tasks, workers)
+        else:
+            for task in tasks:
+                self._expand_task(task)
+
+    def _expand_forked(self, tasks: list[_Task], workers: int):
+        global _FORKED
+        assert self.buffer is not None
+        known = len(self.buffer.prototypes)
+        _FORKED = (self, tasks, known)
+        # Workers share the prototypes registered before forking
+        shared = list(zip(self.buffer._keys[:known], self.buffer.prototypes[:known]))
+        try:
+            with concurrent.futures.ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context("fork")
+            ) as executor:
+                for prototypes, ids, matrices, colors in executor.map(
+                    _expand_forked_task,
+                    range(len(tasks)),
+                    chunksize=max(1, len(tasks) // (4 * workers)),
+                ):
+                    self.buffer.extend(
+                        InstanceBuffer.from_arrays(
+                            shared + prototypes, ids, matrices, colors
+                        )
+                    )
+        finally:
+            _FORKED = None
+
+    def _expand_task(self, task: _Task):
+        self.counters = dict(task.counters)
+        self._expand(task.pending)
+
+    def _expand(self, root: _Pending, split: ta.Optional[list[_Pending]] = None):
+        """Expand root, collecting invocations at split_depth into split"""
+        queue = self._queue()
+        queue.push(root)
+        while queue:
+            pending = queue.pop()
+            if self.max_depth is not None and pending.depth > self.max_depth:
+                continue
+            if split is not None and pending.depth == self.split_depth:
+                split.append(pending)
+                continue
+            if self.max_objects is not None and self.objects >= self.max_objects:
+                log.warning("Max objects exceeded")
+                break
+            self.objects += 1
+            self.depth = pending.depth
+            self.transform.restore(pending.state)
+            random.switch(pending.stream)
+            invocation = pending.invocation
+            result = invocation.func(*invocation.args, **invocation.kwargs)
+            if isinstance(result, types.GeneratorType):
+                active = profiler.active()
+                # The rule body runs while its generator is iterated
+                context = (
+                    contextlib.nullcontext()
+                    if active is None
+                    else active.resume(result)
+                )
+                with context:
+                    children = [
+                        self._pending(pending.depth + 1, child) for child in result
+                    ]
+                queue.extend(children)
+
+    def _pending(self, depth: int, child: ta.Union[Invocation, ta.Callable]):
+        return _Pending(
+            depth,
+            child if isinstance(child, Invocation) else Invocation(child, (), {}),
+            self.transform.snapshot(),
+            random.current().spawn(),
+            self.priority(self.transform) if self.order == "priority" else 0.0,
+        )
+
+    def _queue(self) -> _Queue:
+        if self.order == "depth":
+            return _Stack()
+        if self.order == "breadth":
+            return _Fifo()
+        return _PriorityQueue()
+
+
+def _expand_forked_task(
+    index: int,
+) -> tuple[list[tuple[ta.Hashable, Prototype]], np.ndarray, np.ndarray, np.ndarray]:
+    """Expand a task in a forked worker, returning the prototypes registered
+    since forking and the ids, matrices and colors of the recorded instances
+    """
+    global _ACTIVE
+    assert _FORKED is not None
+    expansion, tasks, known = _FORKED
+    buffer = expansion.buffer
+    assert buffer is not None
+    _ACTIVE = expansion
+    start = len(buffer)
+    # The worker only records, it never flushes
+    buffer.pinned += 1
+    expansion._expand_task(tasks[index])
+    result = (
+        list(zip(buffer._keys[known:], buffer.prototypes[known:])),
+        buffer.ids[start:].copy(),
+        buffer.matrices[start:].copy(),
+        buffer.colors[start:].copy(),
+    )
+    buffer.truncate(start)
+    return result
+
+
+class _Queue(abc.ABC):
+    @abc.abstractmethod
+    def __len__(self) -> int:
+        """Number of pending invocations"""
+
+    @abc.abstractmethod
+    def push(self, pending: _Pending):
+        """Add pending invocation"""
+
+    @abc.abstractmethod
+    def pop(self) -> _Pending:
+        """Remove and return the next invocation to expand"""
+
+    def extend(self, children: list[_Pending]):
+        """Add children in the order they were yielded"""
+        for pending in children:
+            self.push(pending)
+
+
+class _Stack(_Queue):
+    def __init__(self):
+        self._items: list[_Pending] = []
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def push(self, pending: _Pending):
+        self._items.append(pending)
+
+    def pop(self) -> _Pending:
+        return self._items.pop()
+
+    def extend(self, children: list[_Pending]):
+        # Reversed so children are expanded in the order they were yielded
+        self._items.extend(reversed(children))
+
+
+class _Fifo(_Queue):
+    def __init__(self):
+        self._items: collections.deque[_Pending] = collections.deque()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def push(self, pending: _Pending):
+        self._items.append(pending)
+
+    def pop(self) -> _Pending:
+        return self._items.popleft()
+
+
+class _PriorityQueue(_Queue):
+    def __init__(self):
+        self._items: list[tuple[float, int, _Pending]] = []
+        # Ties are expanded in the order they were pushed
+        self._sequence = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def push(self, pending: _Pending):
+        heapq.heappush(self._items, (-pending.priority, next(self._sequence), pending))
+
+    def pop(self) -> _Pending:
+        return heapq.heappop(self._items)[2]
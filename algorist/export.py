@@ -0,0 +1,322 @@
+from __future__ import annotations
+
+import functools
+import importlib
+import json
+import logging
+import math
+import os
+import struct
+import typing as ta
+import zipfile
+
+import numpy as np
+
+from . import blender, primitive
+from .instance import InstanceBuffer, Prototype, decompose, prototype_key
+
+log = logging.getLogger(__name__)
+
+PathLike = ta.Union[str, os.PathLike]
+
+# Buffers are saved without Blender. Fragments are flattened into the
+# instances of their contents before saving.
+
+
+def save_npz(buffer: InstanceBuffer, path: PathLike):
+    """Save instances to an uncompressed .npz archive, which load_npz maps
+
+    Prototype creation functions and transformer classes are saved by
+    qualified name, their args and kwargs must be JSON serializable.
+    """
+    buffer = buffer.flatten()
+    prototypes = [
+        {
+            "name": prototype.name,
+            "creation_func": _qualified_name(prototype.creation_func),
+            "transformer_cls": _qualified_name(prototype.transformer_cls),
+            "args": prototype.args,
+            "kwargs": prototype.kwargs,
+        }
+        for prototype in buffer.prototypes
+    ]
+    np.savez(
+        path,
+        ids=buffer.ids,
+        matrices=buffer.matrices,
+        colors=buffer.colors,
+        prototypes=np.array(json.dumps(prototypes)),
+    )
+
+
+def load_npz(path: PathLike) -> InstanceBuffer:
+    """Load instances saved by save_npz
+
+    The instance arrays are memory mapped copy-on-write, so they are only
+    read from disk when accessed. Creation functions and transformer classes
+    which can not be imported are set to None.
+    """
+    arrays = _map_npz(path)
+    prototypes = []
+    for data in json.loads(str(arrays["prototypes"])):
+        prototype = Prototype(
+            data["name"],
+            _resolve(data["creation_func"]),
+            _resolve(data["transformer_cls"]),
+            tuple(data["args"]),
+            data["kwargs"],
+        )
+        prototypes.append((prototype_key(prototype), prototype))
+    return InstanceBuffer.from_arrays(
+        prototypes, arrays["ids"], arrays["matrices"], arrays["colors"]
+    )
+
+
+def save_ply(buffer: InstanceBuffer, path: PathLike):
+    """Save instances to a binary PLY point cloud
+
+    Each vertex is the location of an instance, with its RGBA color, the
+    prototype index and the rows of the 3x3 rotation and scale matrix.
+    Prototype names are listed as comments in the header.
+    """
+    buffer = buffer.flatten()
+    basis = [f"m{row}{column}" for row in range(3) for column in range(3)]
+    dtype = np.dtype(
+        [(name, "<f4") for name in ("x", "y", "z")]
+        + [(name, "u1") for name in ("red", "green", "blue", "alpha")]
+        + [("prototype", "<i4")]
+        + [(name, "<f4") for name in basis]
+    )
+    vertices = np.empty(len(buffer), dtype=dtype)
+    for axis, name in enumerate(("x", "y", "z")):
+        vertices[name] = buffer.matrices[:, axis, 3]
+    rgba = np.round(np.clip(buffer.colors, 0, 1) * 255).astype(np.uint8)
+    for channel, name in enumerate(("red", "green", "blue", "alpha")):
+        vertices[name] = rgba[:, channel]
+    vertices["prototype"] = buffer.ids
+    for name in basis:
+        vertices[name] = buffer.matrices[:, int(name[1]), int(name[2])]
+    types = {"<f4": "float", "|u1": "uchar", "<i4": "int"}
+    header = (
+        ["ply", "format binary_little_endian 1.0"]
+        + [f"comment prototype {prototype.name}" for prototype in buffer.prototypes]
+        + [f"element vertex {len(vertices)}"]
+        + [f"property {types[dtype[name].str]} {name}" for name in dtype.names or ()]
+        + ["end_header"]
+    )
+    with open(path, "wb") as f:
+        f.write(("\n".join(header) + "\n").encode("ascii"))
+        f.write(vertices.tobytes())
+
+
+def save_gltf(buffer: InstanceBuffer, path: PathLike):
+    """Save instances to a binary glTF .glb file with EXT_mesh_gpu_instancing
+
+    Each prototype is a mesh instanced by a node, with the instance colors in
+    the custom _COLOR_0 attribute. Only primitives created by ObjectFactory
+    can be exported, instances of other prototypes are skipped. Shear in the
+    instance matrices is not preserved.
+    """
+    buffer = buffer.flatten()
+    gltf = _GltfBuilder()
+    nodes = []
+    for prototype_id, prototype in enumerate(buffer.prototypes):
+        mask = buffer.ids == prototype_id
+        if not mask.any():
+            continue
+        geometry = blender.prototype_geometry(prototype)
+        if geometry is None or not len(geometry.loop_totals):
+            log.warning(f"Skipping prototype {prototype.name}, it has no geometry")
+            continue
+        mesh = len(gltf.meshes)
+        gltf.meshes.append(
+            {
+                "name": prototype.name,
+                "primitives": [
+                    {
+                        "attributes": {
+                            "POSITION": gltf.accessor(geometry.vertices, "VEC3")
+                        },
+                        "indices": gltf.accessor(_triangles(geometry), "SCALAR"),
+                        "material": 0,
+                    }
+                ],
+            }
+        )
+        matrices = buffer.matrices[mask]
+        locations, _, scales = decompose(matrices)
+        rotations = (
+            matrices[:, :3, :3] / np.where(scales == 0, 1, scales)[:, np.newaxis, :]
+        )
+        attributes = {
+            "TRANSLATION": gltf.accessor(locations, "VEC3"),
+            "ROTATION": gltf.accessor(_quaternions(rotations), "VEC4"),
+            "SCALE": gltf.accessor(scales, "VEC3"),
+            "_COLOR_0": gltf.accessor(buffer.colors[mask], "VEC4"),
+        }
+        nodes.append(
+            {
+                "name": prototype.name,
+                "mesh": mesh,
+                "extensions": {"EXT_mesh_gpu_instancing": {"attributes": attributes}},
+            }
+        )
+    gltf.write(path, nodes)
+
+
+class _GltfBuilder:
+    """Accumulates glTF meshes and accessors into a single binary buffer"""
+
+    COMPONENT_TYPES = {np.dtype(np.float32): 5126, np.dtype(np.uint32): 5125}
+
+    def __init__(self):
+        self.meshes: list[dict] = []
+        self.accessors: list[dict] = []
+        self.buffer_views: list[dict] = []
+        self.chunks: list[bytes] = []
+        self.size = 0
+
+    def accessor(self, data: np.ndarray, type_: str) -> int:
+        data = np.ascontiguousarray(
+            data, dtype=np.uint32 if type_ == "SCALAR" else np.float32
+        )
+        accessor = {
+            "bufferView": len(self.buffer_views),
+            "componentType": self.COMPONENT_TYPES[data.dtype],
+            "count": len(data),
+            "type": type_,
+        }
+        if type_ == "VEC3":
+            # Required for POSITION
+            accessor["min"] = data.min(axis=0).tolist()
+            accessor["max"] = data.max(axis=0).tolist()
+        self.buffer_views.append(
+            {"buffer": 0, "byteOffset": self.size, "byteLength": data.nbytes}
+        )
+        self.chunks.append(data.tobytes())
+        # All components are 4 bytes, so views stay aligned
+        self.size += data.nbytes
+        self.accessors.append(accessor)
+        return len(self.accessors) - 1
+
+    def write(self, path: PathLike, nodes: list[dict]):
+        # Blender is Z up, glTF is Y up
+        root = {
+            "name": "Algorist",
+            "rotation": [-math.sqrt(0.5), 0.0, 0.0, math.sqrt(0.5)],
+            "children": list(range(1, len(nodes) + 1)),
+        }
+        document = {
+            "asset": {"version": "2.0", "generator": "algorist"},
+            "extensionsUsed": ["EXT_mesh_gpu_instancing"],
+            "scene": 0,
+            "scenes": [{"nodes": [0]}],
+            "nodes": [root] + nodes,
+            "meshes": self.meshes,
+            "materials": [{"name": "Instance"}],
+            "accessors": self.accessors,
+            "bufferViews": self.buffer_views,
+            "buffers": [{"byteLength": self.size}],
+        }
+        content = json.dumps(document, separators=(",", ":")).encode()
+        content += b" " * (-len(content) % 4)
+        binary = b"".join(self.chunks)
+        binary += b"\0" * (-len(binary) % 4)
+        with open(path, "wb") as f:
+            f.write(struct.pack("<4sII", b"glTF", 2, 28 + len(content) + len(binary)))
+            f.write(struct.pack("<I4s", len(content), b"JSON"))
+            f.write(content)
+            f.write(struct.pack("<I4s", len(binary), b"BIN\0"))
+            f.write(binary)
+
+
+def _triangles(geometry: primitive.Geometry) -> np.ndarray:
+    """Fan triangulate the convex polygons of geometry"""
+    triangles = [
+        (face[0], face[i], face[i + 1])
+        for face in np.split(geometry.loop_vertices, geometry.loop_starts[1:])
+        for i in range(1, len(face) - 1)
+    ]
+    return np.array(triangles, dtype=np.uint32).ravel()
+
+
+def _quaternions(rotations: np.ndarray) -> np.ndarray:
+    """Convert (N, 3, 3) rotation matrices to (N, 4) XYZW quaternions
+
+    The quaternion is the eigenvector of the largest eigenvalue of a
+    symmetric matrix built from the rotation, which is stable for any angle.
+    """
+    (m00, m01, m02), (m10, m11, m12), (m20, m21, m22) = np.moveaxis(
+        rotations, (1, 2), (0, 1)
+    )
+    k = np.stack(
+        (
+            (m00 - m11 - m22, m10 + m01, m20 + m02, m21 - m12),
+            (m10 + m01, m11 - m00 - m22, m21 + m12, m02 - m20),
+            (m20 + m02, m21 + m12, m22 - m00 - m11, m10 - m01),
+            (m21 - m12, m02 - m20, m10 - m01, m00 + m11 + m22),
+        )
+    )
+    _, vectors = np.linalg.eigh(np.moveaxis(k, (0, 1), (1, 2)))
+    return vectors[:, :, -1]
+
+
+def _qualified_name(obj: ta.Any) -> ta.Any:
+    if obj is None:
+        return None
+    if isinstance(obj, functools.partial):
+        return {
+            "func": _qualified_name(obj.func),
+            "args": obj.args,
+            "kwargs": obj.keywords,
+        }
+    return f"{obj.__module__}:{obj.__qualname__}"
+
+
+def _resolve(name: ta.Any) -> ta.Any:
+    if name is None:
+        return None
+    if isinstance(name, dict):
+        func = _resolve(name["func"])
+        return func and functools.partial(func, *name["args"], **name["kwargs"])
+    module, _, qualname = name.partition(":")
+    try:
+        obj = importlib.import_module(module)
+        for attr in qualname.split("."):
+            obj = getattr(obj, attr)
+    except (ImportError, AttributeError):
+        log.warning(f"Can not import {name}")
+        return None
+    return obj
+
+
+def _map_npz(path: PathLike) -> dict[str, np.ndarray]:
+    """Memory map the arrays stored uncompressed in an .npz archive"""
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{info.filename} in {path} is compressed")
+            # Data follows the local file header, whose extra field may
+            # differ from the one in the central directory
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack("<HH", f.read(4))
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            if np.lib.format.read_magic(f) == (1, 0):
+                header = np.lib.format.read_array_header_1_0(f)
+            else:
+                header = np.lib.format.read_array_header_2_0(f)
+            shape, fortran_order, dtype = header
+            name = info.filename.removesuffix(".npy")
+            if dtype.hasobject or not shape:
+                arrays[name] = np.lib.format.read_array(archive.open(info))
+            else:
+                arrays[name] = np.memmap(
+                    path,
+                    dtype=dtype,
+                    mode="c",
+                    offset=f.tell(),
+                    shape=shape,
+                    order="F" if fortran_order else "C",
+                )
+    return arrays
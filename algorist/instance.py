@@ -0,0 +1,310 @@
+from __future__ import annotations
+
+import typing as ta
+
+import numpy as np
+
+from .transform import Transform, Transformer
+
+if ta.TYPE_CHECKING:
+    from . import Color
+
+
+class Prototype(ta.NamedTuple):
+    """Description of how to create the data shared by recorded instances
+
+    If fragment is set, the prototype is a group of instances recorded
+    relative to the origin, and there is no creation_func or transformer_cls.
+    """
+
+    name: str
+    creation_func: ta.Optional[ta.Callable]
+    transformer_cls: ta.Optional[type]
+    args: tuple
+    kwargs: dict[str, ta.Any]
+    fragment: ta.Optional[InstanceBuffer] = None
+
+
+class InstanceBuffer:
+    """Compact NumPy storage of recorded (prototype id, matrix, RGBA color) rows
+
+    While pinned is nonzero, something relies on the recorded rows staying in
+    place, so the buffer must not be flushed.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.prototypes: list[Prototype] = []
+        self._keys: list[ta.Hashable] = []
+        self._prototype_ids: dict[ta.Hashable, int] = {}
+        self._ids = np.empty(capacity, dtype=np.int32)
+        self._matrices = np.empty((capacity, 4, 4), dtype=np.float32)
+        self._colors = np.empty((capacity, 4), dtype=np.float32)
+        self._size = 0
+        self.pinned = 0
+
+    @classmethod
+    def from_arrays(
+        cls,
+        prototypes: ta.Sequence[tuple[ta.Hashable, Prototype]],
+        ids: np.ndarray,
+        matrices: np.ndarray,
+        colors: np.ndarray,
+    ) -> InstanceBuffer:
+        """Create buffer of (key, prototype) pairs, using the arrays without
+        copying them until more instances are appended
+        """
+        buffer = cls(capacity=0)
+        for key, prototype in prototypes:
+            buffer.prototype(key, prototype)
+        buffer._ids = ids
+        buffer._matrices = matrices
+        buffer._colors = colors
+        buffer._size = len(ids)
+        return buffer
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def ids(self) -> np.ndarray:
+        """Prototype id of each recorded instance"""
+        return self._ids[: self._size]
+
+    @property
+    def matrices(self) -> np.ndarray:
+        """4x4 world matrix of each recorded instance"""
+        return self._matrices[: self._size]
+
+    @property
+    def colors(self) -> np.ndarray:
+        """RGBA color of each recorded instance"""
+        return self._colors[: self._size]
+
+    def prototype(self, key: ta.Hashable, prototype: Prototype) -> int:
+        """Register prototype under key, returning its id
+
+        If a prototype is already registered under key, its id is returned.
+        """
+        prototype_id = self._prototype_ids.get(key)
+        if prototype_id is None:
+            prototype_id = self._prototype_ids[key] = len(self.prototypes)
+            self.prototypes.append(prototype)
+            self._keys.append(key)
+        return prototype_id
+
+    def append(self, prototype_id: int, matrix: np.ndarray, color: Color):
+        """Record an instance of prototype_id"""
+        if self._size == len(self._ids):
+            self._reserve(self._size + 1)
+        index = self._size
+        self._ids[index] = prototype_id
+        self._matrices[index] = matrix
+        self._colors[index] = color
+        self._size += 1
+
+    def extend(self, other: InstanceBuffer):
+        """Append the instances recorded in other, registering its prototypes"""
+        mapping = np.array(
+            [
+                self.prototype(key, prototype)
+                for key, prototype in zip(other._keys, other.prototypes)
+            ],
+            dtype=np.int32,
+        )
+        start = self._size
+        stop = start + len(other)
+        self._reserve(stop)
+        if len(other):
+            self._ids[start:stop] = mapping[other.ids]
+        self._matrices[start:stop] = other.matrices
+        self._colors[start:stop] = other.colors
+        self._size = stop
+
+    def slice(self, start: int, stop: ta.Optional[int] = None) -> InstanceBuffer:
+        """Return a copy of the instances from start to stop"""
+        return self._copy(
+            self.ids[start:stop], self.matrices[start:stop], self.colors[start:stop]
+        )
+
+    def flatten(self) -> InstanceBuffer:
+        """Return a copy with fragment instances replaced by their contents"""
+        is_fragment = np.array(
+            [prototype.fragment is not None for prototype in self.prototypes],
+            dtype=bool,
+        )
+        leaves = ~is_fragment[self.ids]
+        flat = self._copy(self.ids[leaves], self.matrices[leaves], self.colors[leaves])
+        for prototype_id, prototype in enumerate(self.prototypes):
+            mask = self.ids == prototype_id
+            if prototype.fragment is None or not mask.any():
+                continue
+            contents = prototype.fragment.flatten()
+            count = int(np.count_nonzero(mask))
+            flat.extend(
+                contents._copy(
+                    np.tile(contents.ids, count),
+                    (self.matrices[mask][:, np.newaxis] @ contents.matrices).reshape(
+                        -1, 4, 4
+                    ),
+                    np.tile(contents.colors, (count, 1)),
+                )
+            )
+        return flat
+
+    def _copy(
+        self, ids: np.ndarray, matrices: np.ndarray, colors: np.ndarray
+    ) -> InstanceBuffer:
+        """Return a buffer of the given instances, with the same prototypes"""
+        copy = InstanceBuffer(capacity=len(ids))
+        copy.prototypes = list(self.prototypes)
+        copy._keys = list(self._keys)
+        copy._prototype_ids = dict(self._prototype_ids)
+        copy._ids[:] = ids
+        copy._matrices[:] = matrices
+        copy._colors[:] = colors
+        copy._size = len(ids)
+        return copy
+
+    def truncate(self, size: int):
+        """Discard instances recorded after the first size instances"""
+        self._size = min(size, self._size)
+
+    def clear(self):
+        """Discard recorded instances, keeping registered prototypes"""
+        self._size = 0
+
+    def _reserve(self, size: int):
+        if size <= len(self._ids):
+            return
+        capacity = max(2 * len(self._ids), size)
+        self._ids = np.resize(self._ids, capacity)
+        self._matrices = np.resize(self._matrices, (capacity, 4, 4))
+        self._colors = np.resize(self._colors, (capacity, 4))
+
+
+class InstanceCounter:
+    """Counts recorded instances instead of storing them, for dry runs
+
+    It records like an InstanceBuffer, keeping the number of instances and
+    the distinct colors, quantized to steps of 1/255, of each prototype.
+    Fragments are not supported.
+    """
+
+    def __init__(self):
+        self.prototypes: list[Prototype] = []
+        self._prototype_ids: dict[ta.Hashable, int] = {}
+        self.counts: list[int] = []
+        self.colors: list[set[tuple[int, ...]]] = []
+        self.pinned = 0
+
+    def __len__(self) -> int:
+        return sum(self.counts)
+
+    def prototype(self, key: ta.Hashable, prototype: Prototype) -> int:
+        prototype_id = self._prototype_ids.get(key)
+        if prototype_id is None:
+            prototype_id = self._prototype_ids[key] = len(self.prototypes)
+            self.prototypes.append(prototype)
+            self.counts.append(0)
+            self.colors.append(set())
+        return prototype_id
+
+    def append(self, prototype_id: int, matrix: np.ndarray, color: Color):
+        self.counts[prototype_id] += 1
+        self.colors[prototype_id].add(tuple(round(c * 255) for c in color))
+
+    def clear(self):
+        self.counts = [0] * len(self.prototypes)
+        self.colors = [set() for _ in self.prototypes]
+
+
+class RecordingTransformer(Transformer):
+    """Records the transform into an InstanceBuffer instead of modifying an object
+
+    The recorded instance is created later, when the buffer is materialized.
+    radius bounds the prototype, for culling and indexing.
+    """
+
+    def __init__(
+        self,
+        buffer: ta.Union[InstanceBuffer, InstanceCounter],
+        prototype_id: int,
+        radius: float = Transformer.radius,
+    ):
+        self.buffer = buffer
+        self.prototype_id = prototype_id
+        self.radius = radius
+
+    def transform(self, xfm: Transform):
+        self.buffer.append(self.prototype_id, xfm.matrix, xfm.color_rgba)
+
+    def apply_matrix(self, matrix: np.ndarray):
+        raise TypeError(
+            "Recorded instances can only be transformed with Transform.apply"
+        )
+
+
+def datakey(name: str, args: tuple, kwargs: dict) -> tuple[str, ta.Hashable, tuple]:
+    """Return hashable cache key for data created from args and kwargs"""
+    return (
+        name,
+        _hashable(args),
+        tuple((key, _hashable(kwargs[key])) for key in sorted(kwargs)),
+    )
+
+
+def prototype_key(prototype: Prototype) -> ta.Hashable:
+    """Return the key prototype is registered under when recorded
+
+    Prototypes share data when their datakey is equal, but are only the same
+    prototype if they also have the same transformer class.
+    """
+    return (
+        datakey(prototype.name, prototype.args, prototype.kwargs),
+        prototype.transformer_cls,
+    )
+
+
+def _hashable(value: ta.Any) -> ta.Hashable:
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(v) for v in value)
+    if isinstance(value, dict):
+        return tuple((key, _hashable(value[key])) for key in sorted(value))
+    if isinstance(value, np.ndarray):
+        return (value.dtype.str, value.shape, value.tobytes())
+    return value
+
+
+def decompose(matrices: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Decompose (N, 4, 4) matrices into locations, XYZ euler rotations and scales
+
+    Shear can not be represented and is lost.
+    """
+    locations = matrices[:, :3, 3]
+    basis = matrices[:, :3, :3]
+    scales = np.linalg.norm(basis, axis=1)
+    # Mirroring matrices flip the X axis
+    scales[np.linalg.det(basis) < 0, 0] *= -1
+    rotations = basis / np.where(scales == 0, 1, scales)[:, np.newaxis, :]
+    eulers = np.stack(
+        (
+            np.arctan2(rotations[:, 2, 1], rotations[:, 2, 2]),
+            np.arcsin(-np.clip(rotations[:, 2, 0], -1, 1)),
+            np.arctan2(rotations[:, 1, 0], rotations[:, 0, 0]),
+        ),
+        axis=-1,
+    )
+    return locations, eulers, scales
+
+
+def transform_points(matrices: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """Transform (..., P, 3) points by (..., 4, 4) matrices"""
+    return (
+        points @ np.swapaxes(matrices[..., :3, :3], -1, -2)
+        + matrices[..., np.newaxis, :3, 3]
+    )
+
+
+def median_scale(matrices: np.ndarray) -> np.ndarray:
+    """Average scale of the axes of (..., 4, 4) matrices"""
+    return np.linalg.norm(matrices[..., :3, :3], axis=-2).mean(axis=-1)
@@ -0,0 +1,400 @@
+from __future__ import annotations
+
+import math
+import typing as ta
+
+import numpy as np
+
+
+class Geometry(ta.NamedTuple):
+    """Mesh geometry as flat arrays, ready for foreach_set
+
+    Polygon i uses the loop_totals[i] vertex indices in loop_vertices
+    following those of the previous polygons. edges are (E, 2) loose edges,
+    edges of polygons are not included. uvs are the (L, 2) UV coordinates of
+    each loop, or None without a UV map.
+    """
+
+    vertices: np.ndarray
+    loop_vertices: np.ndarray
+    loop_totals: np.ndarray
+    edges: np.ndarray
+    uvs: ta.Optional[np.ndarray] = None
+
+    @classmethod
+    def from_faces(
+        cls,
+        vertices: ta.Any,
+        faces: ta.Sequence[ta.Sequence[int]] = (),
+        edges: ta.Any = (),
+        uvs: ta.Any = None,
+    ) -> Geometry:
+        return cls(
+            np.asarray(vertices, dtype=np.float32).reshape(-1, 3),
+            np.fromiter((v for face in faces for v in face), dtype=np.int32),
+            np.fromiter((len(face) for face in faces), dtype=np.int32),
+            np.asarray(edges, dtype=np.int32).reshape(-1, 2),
+            None if uvs is None else np.asarray(uvs, dtype=np.float32).reshape(-1, 2),
+        )
+
+    @property
+    def loop_starts(self) -> np.ndarray:
+        """Index in loop_vertices of the first vertex of each polygon"""
+        return (np.cumsum(self.loop_totals) - self.loop_totals).astype(np.int32)
+
+
+# Generators match the geometry of the bpy.ops.mesh.primitive_*_add operators
+# with the same arguments. Arguments placing the object, such as location,
+# rotation and align, are not supported, use a Transform instead. Generators
+# taking calc_uvs add a UV map, whose layout may differ from the operator's.
+# Circles, cylinders and cones have no UV map.
+
+# Normal axis and sign of cube faces, by the U and V axes and signs of their
+# UV map and the lower left corner of their square in a cross layout. The
+# sides wrap around the middle row, sharing their vertical edges.
+_CUBE_UVS = {
+    (0, -1): ((1, -1), (2, 1), (0.0, 0.375)),
+    (1, -1): ((0, 1), (2, 1), (0.25, 0.375)),
+    (0, 1): ((1, 1), (2, 1), (0.5, 0.375)),
+    (1, 1): ((0, -1), (2, 1), (0.75, 0.375)),
+    (2, 1): ((0, 1), (1, 1), (0.25, 0.625)),
+    (2, -1): ((0, 1), (1, -1), (0.25, 0.125)),
+}
+
+
+def cube(size: float = 2.0, calc_uvs: bool = True) -> Geometry:
+    h = size / 2
+    vertices = np.array([(x, y, z) for x in (-h, h) for y in (-h, h) for z in (-h, h)])
+    faces = [
+        (0, 1, 3, 2),
+        (2, 3, 7, 6),
+        (6, 7, 5, 4),
+        (4, 5, 1, 0),
+        (2, 6, 4, 0),
+        (7, 3, 1, 5),
+    ]
+    uvs = None
+    if calc_uvs:
+        uvs = []
+        for face in faces:
+            corners = vertices[list(face)] / size
+            axis = int(np.abs(corners.sum(axis=0)).argmax())
+            (u, u_sign), (v, v_sign), cell = _CUBE_UVS[
+                (axis, int(np.sign(corners[0, axis])))
+            ]
+            square = np.stack((u_sign * corners[:, u], v_sign * corners[:, v]), -1)
+            uvs.append(np.add(cell, 0.25 * (square + 0.5)))
+    return Geometry.from_faces(vertices, faces, uvs=uvs)
+
+
+def plane(size: float = 2.0, calc_uvs: bool = True) -> Geometry:
+    h = size / 2
+    return Geometry.from_faces(
+        [(-h, -h, 0), (h, -h, 0), (h, h, 0), (-h, h, 0)],
+        [(0, 1, 2, 3)],
+        uvs=[(0, 0), (1, 0), (1, 1), (0, 1)] if calc_uvs else None,
+    )
+
+
+def grid(
+    x_subdivisions: int = 10,
+    y_subdivisions: int = 10,
+    size: float = 2.0,
+    calc_uvs: bool = True,
+) -> Geometry:
+    h = size / 2
+    xs = np.linspace(-h, h, x_subdivisions + 1)
+    ys = np.linspace(-h, h, y_subdivisions + 1)
+    x, y = np.meshgrid(xs, ys)
+    vertices = np.stack((x, y, np.zeros_like(x)), axis=-1)
+    uvs = None
+    if calc_uvs:
+        u, v = np.meshgrid(
+            np.linspace(0, 1, x_subdivisions + 1), np.linspace(0, 1, y_subdivisions + 1)
+        )
+        uvs = _corners(np.stack((u, v), axis=-1))
+    return Geometry.from_faces(
+        vertices, _quads(np.arange(x.size).reshape(x.shape), wrap=False), uvs=uvs
+    )
+
+
+def circle(
+    vertices: int = 32,
+    radius: float = 1.0,
+    fill_type: ta.Literal["NOTHING", "NGON", "TRIFAN"] = "NOTHING",
+) -> Geometry:
+    ring = _ring(vertices, radius, 0.0)
+    if fill_type == "NGON":
+        return Geometry.from_faces(ring, [range(vertices)])
+    if fill_type == "TRIFAN":
+        return Geometry.from_faces(
+            np.concatenate((ring, [(0, 0, 0)])), _fan(range(vertices), vertices)
+        )
+    edges = [(i, (i + 1) % vertices) for i in range(vertices)]
+    return Geometry.from_faces(ring, edges=edges)
+
+
+def cylinder(
+    vertices: int = 32,
+    radius: float = 1.0,
+    depth: float = 2.0,
+    end_fill_type: ta.Literal["NOTHING", "NGON", "TRIFAN"] = "NGON",
+) -> Geometry:
+    return cone(vertices, radius, radius, depth, end_fill_type)
+
+
+def cone(
+    vertices: int = 32,
+    radius1: float = 1.0,
+    radius2: float = 0.0,
+    depth: float = 2.0,
+    end_fill_type: ta.Literal["NOTHING", "NGON", "TRIFAN"] = "NGON",
+) -> Geometry:
+    h = depth / 2
+    points: list[ta.Any] = []
+    faces: list[ta.Sequence[int]] = []
+    rings = []
+    for radius, z in ((radius1, -h), (radius2, h)):
+        start = len(points)
+        if radius == 0:
+            points.append((0.0, 0.0, z))
+            rings.append([start] * vertices)
+        else:
+            points.extend(_ring(vertices, radius, z))
+            rings.append(list(range(start, start + vertices)))
+    bottom, top = rings
+    for i in range(vertices):
+        j = (i + 1) % vertices
+        faces.append(tuple(dict.fromkeys((bottom[i], bottom[j], top[j], top[i]))))
+    for ring, z, outward in ((bottom, -h, reversed), (top, h, list)):
+        if ring[0] == ring[-1] or end_fill_type == "NOTHING":
+            continue
+        if end_fill_type == "NGON":
+            faces.append(tuple(outward(ring)))
+        else:
+            center = len(points)
+            points.append((0.0, 0.0, z))
+            faces.extend(tuple(outward(face)) for face in _fan(ring, center))
+    return Geometry.from_faces(points, faces)
+
+
+def uv_sphere(
+    segments: int = 32,
+    ring_count: int = 16,
+    radius: float = 1.0,
+    calc_uvs: bool = True,
+) -> Geometry:
+    thetas = np.pi * np.arange(1, ring_count) / ring_count
+    rings = np.concatenate(
+        [_ring(segments, radius * math.sin(t), radius * math.cos(t)) for t in thetas]
+    )
+    vertices = np.vstack(((0, 0, radius), rings, (0, 0, -radius)))
+    indices = 1 + np.arange(len(rings)).reshape(ring_count - 1, segments)
+    south = len(vertices) - 1
+    faces = (
+        [(0, i, j) for i, j in zip(indices[0], np.roll(indices[0], -1))]
+        + _quads(indices[::-1], wrap=True)
+        + [(south, j, i) for i, j in zip(indices[-1], np.roll(indices[-1], -1))]
+    )
+    uvs = None
+    if calc_uvs:
+        # U around the equator from the seam on the Y axis, V from the south
+        u = np.arange(segments + 1) / segments
+        v = 1 - np.arange(1, ring_count) / ring_count
+        middle = (u[:-1] + u[1:]) / 2
+        north_fan = np.stack(
+            (
+                np.stack((middle, np.ones(segments)), axis=-1),
+                np.stack((u[:-1], np.full(segments, v[0])), axis=-1),
+                np.stack((u[1:], np.full(segments, v[0])), axis=-1),
+            ),
+            axis=1,
+        )
+        south_fan = np.stack(
+            (
+                np.stack((middle, np.zeros(segments)), axis=-1),
+                np.stack((u[1:], np.full(segments, v[-1])), axis=-1),
+                np.stack((u[:-1], np.full(segments, v[-1])), axis=-1),
+            ),
+            axis=1,
+        )
+        grid = np.stack(np.meshgrid(u, v), axis=-1)
+        uvs = np.concatenate(
+            (north_fan.reshape(-1, 2), _corners(grid[::-1]), south_fan.reshape(-1, 2))
+        )
+    return Geometry.from_faces(vertices, faces, uvs=uvs)
+
+
+def ico_sphere(
+    subdivisions: int = 2, radius: float = 1.0, calc_uvs: bool = True
+) -> Geometry:
+    t = (1 + math.sqrt(5)) / 2
+    points = [
+        (-1, t, 0),
+        (1, t, 0),
+        (-1, -t, 0),
+        (1, -t, 0),
+        (0, -1, t),
+        (0, 1, t),
+        (0, -1, -t),
+        (0, 1, -t),
+        (t, 0, -1),
+        (t, 0, 1),
+        (-t, 0, -1),
+        (-t, 0, 1),
+    ]
+    faces = [
+        (0, 11, 5),
+        (0, 5, 1),
+        (0, 1, 7),
+        (0, 7, 10),
+        (0, 10, 11),
+        (1, 5, 9),
+        (5, 11, 4),
+        (11, 10, 2),
+        (10, 7, 6),
+        (7, 1, 8),
+        (3, 9, 4),
+        (3, 4, 2),
+        (3, 2, 6),
+        (3, 6, 8),
+        (3, 8, 9),
+        (4, 9, 5),
+        (2, 4, 11),
+        (6, 2, 10),
+        (8, 6, 7),
+        (9, 8, 1),
+    ]
+    vertices = list(map(np.array, points))
+    for _ in range(subdivisions - 1):
+        midpoints: dict[tuple[int, int], int] = {}
+
+        def midpoint(a: int, b: int) -> int:
+            key = (min(a, b), max(a, b))
+            index = midpoints.get(key)
+            if index is None:
+                index = midpoints[key] = len(vertices)
+                vertices.append((vertices[a] + vertices[b]) / 2)
+            return index
+
+        subdivided = []
+        for a, b, c in faces:
+            ab, bc, ca = midpoint(a, b), midpoint(b, c), midpoint(c, a)
+            subdivided += [(a, ab, ca), (b, bc, ab), (c, ca, bc), (ab, bc, ca)]
+        faces = subdivided
+    positions = np.array(vertices)
+    positions /= np.linalg.norm(positions, axis=1)[:, np.newaxis]
+    uvs = None
+    if calc_uvs:
+        uvs = _spherical_uvs(positions[np.array(faces)])
+    return Geometry.from_faces(radius * positions, faces, uvs=uvs)
+
+
+def torus(
+    major_segments: int = 48,
+    minor_segments: int = 12,
+    mode: ta.Literal["MAJOR_MINOR", "EXT_INT"] = "MAJOR_MINOR",
+    major_radius: float = 1.0,
+    minor_radius: float = 0.25,
+    abso_major_rad: float = 1.25,
+    abso_minor_rad: float = 0.75,
+    generate_uvs: bool = True,
+) -> Geometry:
+    if mode == "EXT_INT":
+        major_radius = (abso_major_rad + abso_minor_rad) / 2
+        minor_radius = (abso_major_rad - abso_minor_rad) / 2
+    u = 2 * np.pi * np.arange(major_segments) / major_segments
+    v = 2 * np.pi * np.arange(minor_segments) / minor_segments
+    u, v = np.meshgrid(u, v, indexing="ij")
+    distance = major_radius + minor_radius * np.cos(v)
+    vertices = np.stack(
+        (distance * np.cos(u), distance * np.sin(u), minor_radius * np.sin(v)),
+        axis=-1,
+    )
+    indices = np.arange(u.size).reshape(u.shape)
+    uvs = None
+    if generate_uvs:
+        # U around the major ring, V around the minor ring in the face order
+        grid = np.stack(
+            np.meshgrid(
+                np.linspace(0, 1, major_segments + 1),
+                np.linspace(1, 0, minor_segments + 1),
+                indexing="ij",
+            ),
+            axis=-1,
+        )
+        uvs = _corners(grid)
+    return Geometry.from_faces(
+        vertices, _quads(indices[:, ::-1], wrap=True, wrap_rows=True), uvs=uvs
+    )
+
+
+def vertex_count(name: str, **kwargs) -> int:
+    """Return the number of vertices of the named primitive"""
+    return len(GENERATORS[name](**kwargs).vertices)
+
+
+def _ring(count: int, radius: float, z: float) -> np.ndarray:
+    """count points counterclockwise around Z, starting on the Y axis"""
+    phi = 2 * np.pi * np.arange(count) / count
+    return np.stack(
+        (-radius * np.sin(phi), radius * np.cos(phi), np.full(count, z)), axis=-1
+    )
+
+
+def _fan(ring: ta.Sequence[int], center: int) -> list[tuple[int, int, int]]:
+    return [(ring[i], ring[(i + 1) % len(ring)], center) for i in range(len(ring))]
+
+
+def _quads(
+    indices: np.ndarray, wrap: bool, wrap_rows: bool = False
+) -> list[tuple[int, ...]]:
+    """Quads between (rows, columns) vertex indices, counterclockwise when
+    rows go up and columns go counterclockwise
+    """
+    if wrap:
+        indices = np.concatenate((indices, indices[:, :1]), axis=1)
+    if wrap_rows:
+        indices = np.concatenate((indices, indices[:1]), axis=0)
+    return [tuple(quad) for quad in _corners(indices).reshape(-1, 4).tolist()]
+
+
+def _corners(grid: np.ndarray) -> np.ndarray:
+    """Corners of the quads between (rows, columns, ...) grid values, in the
+    order of _quads, flattened to (4 * quads, ...)
+    """
+    corners = np.stack(
+        (grid[:-1, :-1], grid[:-1, 1:], grid[1:, 1:], grid[1:, :-1]), axis=2
+    )
+    return corners.reshape(-1, *grid.shape[2:])
+
+
+def _spherical_uvs(triangles: np.ndarray) -> np.ndarray:
+    """UV of the (F, 3, 3) corners of triangles on the unit sphere, by longitude
+    and latitude
+
+    Triangles crossing the seam behind the sphere are kept whole, and corners
+    at the poles take the longitude of the triangle.
+    """
+    x, y, z = np.moveaxis(triangles, -1, 0)
+    u = np.arctan2(y, x) / (2 * np.pi) + 0.5
+    v = np.arcsin(np.clip(z, -1, 1)) / np.pi + 0.5
+    pole = np.hypot(x, y) < 1e-6
+    u = np.where(pole, np.nan, u)
+    seam = np.nanmax(u, axis=1) - np.nanmin(u, axis=1) > 0.5
+    u = np.where(seam[:, np.newaxis] & (u < 0.5), u + 1, u)
+    u = np.where(pole, np.nanmean(u, axis=1, keepdims=True), u)
+    return np.stack((u, v), axis=-1).reshape(-1, 2)
+
+
+GENERATORS: dict[str, ta.Callable[..., Geometry]] = {
+    "Cube": cube,
+    "Plane": plane,
+    "Grid": grid,
+    "Circle": circle,
+    "Cylinder": cylinder,
+    "Cone": cone,
+    "UVSphere": uv_sphere,
+    "IcoSphere": ico_sphere,
+    "Torus": torus,
+}
@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import collections
+import contextlib
+import inspect
+import json
+import logging
+import marshal
+import os
+import time
+import types
+import typing as ta
+
+log = logging.getLogger(__name__)
+
+_ACTIVE: ta.Optional[Profiler] = None
+
+# pstats function key
+FunctionKey = tuple[str, int, str]
+
+
+def active() -> ta.Optional[Profiler]:
+    """Return the running Profiler, if any"""
+    return _ACTIVE
+
+
+class Stats:
+    """Statistics of a rule variant or limited function
+
+    Times are in seconds. Inclusive time and objects of recursive calls are
+    only counted by the outermost call.
+    """
+
+    __slots__ = (
+        "key",
+        "calls",
+        "primitive_calls",
+        "inclusive_time",
+        "exclusive_time",
+        "objects",
+        "inclusive_objects",
+        "depths",
+        "limits",
+    )
+
+    def __init__(self, key: FunctionKey):
+        self.key = key
+        self.calls = 0
+        self.primitive_calls = 0
+        self.inclusive_time = 0.0
+        self.exclusive_time = 0.0
+        self.objects = 0
+        self.inclusive_objects = 0
+        self.depths: collections.Counter[int] = collections.Counter()
+        self.limits: collections.Counter[str] = collections.Counter()
+
+    @property
+    def label(self) -> str:
+        filename, line, name = self.key
+        return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+class _Frame:
+    __slots__ = ("stats", "start", "child_time", "start_objects", "counted")
+
+    def __init__(
+        self, stats: Stats, start: int, start_objects: int, counted: bool = True
+    ):
+        self.stats = stats
+        self.start = start
+        self.child_time = 0
+        self.start_objects = start_objects
+        # Whether the frame is a call, rather than a resumed generator
+        self.counted = counted
+
+
+class Profiler:
+    """Collects per rule variant statistics while running
+
+    Calls to rules and limited functions are timed, and objects applied by
+    Transform.apply are attributed to the innermost call. Use as a context
+    manager, a report is logged on exit if report is set. If trace is set,
+    every call is also recorded for save_chrome_trace.
+
+    Generator rules run by an Expansion are timed while it iterates them, as
+    their body only runs then. Rules expanded in forked Expansion workers are
+    not profiled.
+    """
+
+    def __init__(self, report: bool = True, trace: bool = False):
+        self.stats: dict[FunctionKey, Stats] = {}
+        self.callers: dict[tuple[FunctionKey, FunctionKey], list] = {}
+        self.objects = 0
+        self.trace = trace
+        self.events: list[dict[str, ta.Any]] = []
+        self.report_on_exit = report
+        self._stack: list[_Frame] = []
+        self._active: collections.Counter[FunctionKey] = collections.Counter()
+        self._keys: dict[ta.Callable, FunctionKey] = {}
+        self._origin = time.perf_counter_ns()
+        self._previous: ta.Optional[Profiler] = None
+
+    def __enter__(self) -> Profiler:
+        global _ACTIVE
+        self._previous, _ACTIVE = _ACTIVE, self
+        return self
+
+    def __exit__(self, *exc_info):
+        global _ACTIVE
+        _ACTIVE = self._previous
+        if self.report_on_exit:
+            log.info("Profile\n%s", self.report())
+
+    def call(self, func: ta.Callable, args: tuple, kwargs: dict) -> ta.Any:
+        """Call func, collecting its statistics"""
+        stats = self._stats(func)
+        key = stats.key
+        # Imported here, since expansion imports transform which imports this
+        from .expansion import active as active_expansion
+
+        current = active_expansion()
+        stats.depths[len(self._stack) + 1 + (current.depth - 1 if current else 0)] += 1
+        self._active[key] += 1
+        frame = _Frame(stats, time.perf_counter_ns(), self.objects)
+        self._stack.append(frame)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._pop(frame)
+
+    @contextlib.contextmanager
+    def resume(self, generator: types.GeneratorType) -> ta.Iterator[None]:
+        """Collect statistics of the generator rule iterated in the context
+
+        The call creating the generator is already counted, so only time,
+        objects and callers are added to its statistics.
+        """
+        stats = self._code_stats(generator.gi_code)
+        self._active[stats.key] += 1
+        frame = _Frame(stats, time.perf_counter_ns(), self.objects, counted=False)
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._pop(frame)
+
+    def _pop(self, frame: _Frame):
+        elapsed = time.perf_counter_ns() - frame.start
+        self._stack.pop()
+        stats = frame.stats
+        key = stats.key
+        self._active[key] -= 1
+        recursive = self._active[key] > 0
+        if frame.counted:
+            stats.calls += 1
+        stats.exclusive_time += (elapsed - frame.child_time) / 1e9
+        if not recursive:
+            if frame.counted:
+                stats.primitive_calls += 1
+            stats.inclusive_time += elapsed / 1e9
+            stats.inclusive_objects += self.objects - frame.start_objects
+        if self._stack:
+            parent = self._stack[-1]
+            parent.child_time += elapsed
+            edge = self.callers.setdefault((parent.stats.key, key), [0, 0, 0, 0])
+            if frame.counted:
+                edge[0] += 0 if recursive else 1
+                edge[1] += 1
+            edge[2] += (elapsed - frame.child_time) / 1e9
+            edge[3] += 0 if recursive else elapsed / 1e9
+        if self.trace:
+            self.events.append(
+                {
+                    "name": stats.label,
+                    "ph": "X",
+                    "ts": (frame.start - self._origin) / 1e3,
+                    "dur": elapsed / 1e3,
+                    "pid": os.getpid(),
+                    "tid": 0,
+                }
+            )
+
+    def emit(self):
+        """Count an object applied by the innermost call"""
+        self.objects += 1
+        if self._stack:
+            self._stack[-1].stats.objects += 1
+
+    def limit(self, func: ta.Callable, reason: str):
+        """Count a call to func skipped by limit for reason"""
+        self._stats(func).limits[reason] += 1
+
+    def _stats(self, func: ta.Callable) -> Stats:
+        key = self._keys.get(func)
+        if key is None:
+            stats = self._code_stats(inspect.unwrap(func).__code__)
+            self._keys[func] = stats.key
+            return stats
+        return self.stats[key]
+
+    def _code_stats(self, code: types.CodeType) -> Stats:
+        key = (code.co_filename, code.co_firstlineno, code.co_name)
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = Stats(key)
+        return stats
+
+    def report(self) -> str:
+        """Return table of statistics, by descending inclusive time"""
+        lines = [
+            f"{'calls':>9} {'incl s':>9} {'excl s':>9} {'objects':>9} "
+            f"{'incl obj':>9} {'depth':>5}  rule [limits]"
+        ]
+        for stats in sorted(
+            self.stats.values(), key=lambda s: s.inclusive_time, reverse=True
+        ):
+            limits = ", ".join(f"{r}: {n}" for r, n in stats.limits.items())
+            lines.append(
+                f"{stats.calls:>9} {stats.inclusive_time:>9.3f} "
+                f"{stats.exclusive_time:>9.3f} {stats.objects:>9} "
+                f"{stats.inclusive_objects:>9} {max(stats.depths, default=0):>5}  "
+                f"{stats.label}{f' [{limits}]' if limits else ''}"
+            )
+        return "\n".join(lines)
+
+    def save_pstats(self, path: ta.Union[str, os.PathLike]):
+        """Save statistics in the format read by pstats.Stats and cProfile tools"""
+        callers: dict[FunctionKey, dict[FunctionKey, tuple]] = {}
+        for (caller, callee), edge in self.callers.items():
+            callers.setdefault(callee, {})[caller] = tuple(edge)
+        data = {
+            key: (
+                stats.primitive_calls,
+                stats.calls,
+                stats.exclusive_time,
+                stats.inclusive_time,
+                callers.get(key, {}),
+            )
+            for key, stats in self.stats.items()
+        }
+        with open(path, "wb") as f:
+            marshal.dump(data, f)
+
+    def save_chrome_trace(self, path: ta.Union[str, os.PathLike]):
+        """Save the calls recorded with trace set, for chrome://tracing"""
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
@@ -1,17 +1,156 @@
-import random
+from __future__ import annotations
+
+import hashlib
+import os
+import struct
+import typing as ta
+
+import numpy as np
+
+# Seeds the initial stream, set by batch runs
+SEED_VARIABLE = "ALGORIST_SEED"
+
+
+class Stream:
+    """Splittable stream of random numbers, served from pre-generated blocks
+
+    Each stream has a key derived from its parent key and its index among the
+    parents children, so a child stream does not depend on the draws made by
+    any other stream. Spawning is lazy: a child only derives its key when it
+    first draws or spawns, so invocations which draw nothing cost no hashing.
+    A single hash of the parent key derives both the key and a first block of
+    numbers. Streams drawing more numbers switch to a NumPy Philox generator
+    keyed on the stream key, generating blocks of increasing size.
+    """
+
+    __slots__ = (
+        "_key",
+        "_parent",
+        "_index",
+        "_children",
+        "_block",
+        "_size",
+        "_generator",
+    )
+
+    FIRST_BLOCK_SIZE = 6
+    MAX_BLOCK_SIZE = 4096
+
+    def __init__(
+        self, key: ta.Optional[bytes] = None, parent: ta.Optional[Stream] = None
+    ):
+        self._key = key
+        self._parent = parent
+        self._index = 0
+        self._children = 0
+        # Numbers are popped from the end
+        self._block: list[float] = []
+        self._size = 0
+        self._generator: ta.Optional[np.random.Generator] = None
+
+    @classmethod
+    def from_seed(cls, seed: ta.Optional[int] = None) -> Stream:
+        """Create root stream from seed, or from OS entropy if seed is None"""
+        entropy = np.random.SeedSequence().entropy if seed is None else seed
+        return cls(_hash(str(entropy).encode()))
+
+    @property
+    def key(self) -> bytes:
+        if self._key is None:
+            self._derive()
+        assert self._key is not None
+        return self._key
+
+    def spawn(self) -> Stream:
+        """Return the next child stream"""
+        child = Stream(None, self)
+        child._index = self._children
+        self._children += 1
+        return child
+
+    def random(self) -> float:
+        """Return random float in [0, 1)"""
+        block = self._block
+        if not block:
+            self._refill()
+            block = self._block
+        return block.pop()
+
+    def random_array(self, count: int) -> np.ndarray:
+        """Return count random floats in [0, 1)"""
+        return self._numpy().random(count)
+
+    def _derive(self):
+        assert self._parent is not None
+        digest = hashlib.blake2b(
+            self._parent.key + self._index.to_bytes(8, "little"), digest_size=64
+        ).digest()
+        self._key = digest[:16]
+        self._block = [
+            (bits >> 11) * 2.0**-53 for bits in struct.unpack("<16x6Q", digest)
+        ]
+        # The key no longer depends on the parent
+        self._parent = None
+
+    def _refill(self):
+        if self._key is None:
+            self._derive()
+        else:
+            self._size = min(
+                max(2 * self._size, self.FIRST_BLOCK_SIZE), self.MAX_BLOCK_SIZE
+            )
+            self._block = self._numpy().random(self._size).tolist()
+
+    def _numpy(self) -> np.random.Generator:
+        if self._generator is None:
+            self._generator = np.random.Generator(
+                np.random.Philox(key=int.from_bytes(self.key, "little"))
+            )
+        return self._generator
+
+
+def _hash(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+_current = Stream.from_seed(
+    int(os.environ[SEED_VARIABLE]) if SEED_VARIABLE in os.environ else None
+)
+
+
+def seed(value: ta.Optional[int] = None):
+    """Reset the current stream to a root stream seeded from value"""
+    global _current
+    _current = Stream.from_seed(value)
+
+
+def current() -> Stream:
+    """Return the stream random numbers are currently drawn from"""
+    return _current
+
+
+def switch(stream: Stream) -> Stream:
+    """Draw random numbers from stream, returning the previous current stream"""
+    global _current
+    previous, _current = _current, stream
+    return previous
 
 
 def rnd(r: float) -> float:
     """returns random number from -r  to r"""
-    return (random.random() - 0.5) * 2 * r
+    # Inlined Stream.random
+    block = _current._block
+    return ((block.pop() if block else _current.random()) - 0.5) * 2 * r
 
 
 def prnd(r: float) -> float:
     """returns random numbere from 0 to r"""
-    return random.random() * r
+    block = _current._block
+    return (block.pop() if block else _current.random()) * r
 
 
 def coinflip(sides: int = 2) -> bool:
     """returns true as if coin with `sides` sides is flipped"""
-    coin = random.randint(0, sides - 1)
+    block = _current._block
+    coin = int((block.pop() if block else _current.random()) * sides)
     return coin == 1
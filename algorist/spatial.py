@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import math
+import typing as ta
+
+import numpy as np
+
+Point = tuple[float, float, float]
+
+
+class SpatialHash:
+    """Uniform grid index of bounding spheres
+
+    Each sphere is stored in every cell its bounding box touches, so queries
+    only test the spheres in the cells touched by the query. cell_size should
+    be about the diameter of typical spheres. Spheres with a radius of more
+    than MAX_CELL_RADIUS cells are kept in a list tested by every query
+    instead, and queries touching more cells than there are spheres test all
+    spheres, so large spheres do not fill the grid.
+    """
+
+    __slots__ = ("cell_size", "centers", "radii", "_cells", "_large")
+
+    MAX_CELL_RADIUS = 2
+
+    def __init__(self, cell_size: float = 1.0):
+        self.cell_size = cell_size
+        self.centers: list[Point] = []
+        self.radii: list[float] = []
+        self._cells: dict[tuple[int, int, int], list[int]] = {}
+        self._large: list[int] = []
+
+    def __len__(self) -> int:
+        return len(self.centers)
+
+    def insert(self, center: Point, radius: float) -> int:
+        """Add a sphere, returning its index"""
+        index = len(self.centers)
+        self.centers.append(center)
+        self.radii.append(radius)
+        if radius > self.MAX_CELL_RADIUS * self.cell_size:
+            self._large.append(index)
+        else:
+            for cell in self._cells_touched(center, radius):
+                self._cells.setdefault(cell, []).append(index)
+        return index
+
+    def overlaps(self, center: Point, radius: float) -> bool:
+        """Return True if the sphere intersects any indexed sphere"""
+        x, y, z = center
+        centers = self.centers
+        radii = self.radii
+        for indices in self._candidates(center, radius):
+            for index in indices:
+                cx, cy, cz = centers[index]
+                distance = radius + radii[index]
+                if (x - cx) ** 2 + (y - cy) ** 2 + (z - cz) ** 2 < distance**2:
+                    return True
+        return False
+
+    def is_free(self, center: Point, radius: float) -> bool:
+        """Return True if the sphere does not intersect any indexed sphere"""
+        return not self.overlaps(center, radius)
+
+    def neighbours(self, center: Point, distance: float) -> list[int]:
+        """Return indices of the spheres centered within distance of center"""
+        x, y, z = center
+        centers = self.centers
+        found: set[int] = set()
+        for indices in self._candidates(center, distance):
+            for index in indices:
+                cx, cy, cz = centers[index]
+                if (x - cx) ** 2 + (y - cy) ** 2 + (z - cz) ** 2 <= distance**2:
+                    found.add(index)
+        return sorted(found)
+
+    def count(self, center: Point, distance: float) -> int:
+        """Return number of spheres centered within distance of center"""
+        return len(self.neighbours(center, distance))
+
+    def clear(self):
+        self.centers.clear()
+        self.radii.clear()
+        self._cells.clear()
+        self._large.clear()
+
+    def _candidates(
+        self, center: Point, radius: float
+    ) -> ta.Iterator[ta.Sequence[int]]:
+        """Yield lists of the indices of spheres which may touch the sphere"""
+        size = self.cell_size
+        x0, y0, z0 = (math.floor((c - radius) / size) for c in center)
+        x1, y1, z1 = (math.floor((c + radius) / size) for c in center)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) * (z1 - z0 + 1) > len(self.centers):
+            yield range(len(self.centers))
+            return
+        if self._large:
+            yield self._large
+        cells = self._cells
+        for i in range(x0, x1 + 1):
+            for j in range(y0, y1 + 1):
+                for k in range(z0, z1 + 1):
+                    indices = cells.get((i, j, k))
+                    if indices is not None:
+                        yield indices
+
+    def _cells_touched(
+        self, center: Point, radius: float
+    ) -> ta.Iterator[tuple[int, int, int]]:
+        size = self.cell_size
+        x0, y0, z0 = (math.floor((c - radius) / size) for c in center)
+        x1, y1, z1 = (math.floor((c + radius) / size) for c in center)
+        for i in range(x0, x1 + 1):
+            for j in range(y0, y1 + 1):
+                for k in range(z0, z1 + 1):
+                    yield i, j, k
+
+
+def bounding_sphere(matrix: np.ndarray, radius: float) -> tuple[Point, float]:
+    """Return world center and radius of the sphere of radius around the
+    origin of the local space of matrix
+    """
+    x, y, z, center = zip(*matrix[:3].tolist())
+    return center, radius * max(math.hypot(*x), math.hypot(*y), math.hypot(*z))
@@ -4,67 +4,115 @@ import abc
 import colorsys
 import math
 import typing as ta
-from contextlib import contextmanager
 
-import bpy
-from bl_math import clamp
-from mathutils import Matrix, Vector
+import numpy as np
+import numpy.typing as npt
+
+from . import profiler
+from .spatial import bounding_sphere
 
 if ta.TYPE_CHECKING:
     from . import Color, ColorComponent
+    from .culling import Frustum
+    from .spatial import Point, SpatialHash
 
 
 class Transform:
+    """Current transformation matrix and HSVA color
+
+    Operations are context managers which push the current state on a stack,
+    modify it, and pop it on exit. Calling the transform fuses a list of
+    Structure Synth style operations into a single operation, e.g.
+    `with xfm(x=0.9, rz=6, ry=6, s=0.99, sat=0.99):`
+
+    If culler is set, objects it rejects are discarded instead of transformed.
+    If index is set, the bounding sphere of each applied object is added to it.
+    """
+
+    __slots__ = ("_matrix", "_color", "_stack", "culler", "index")
+
     def __init__(
         self,
-        matrix: ta.Optional[Matrix] = None,
+        matrix: ta.Optional[npt.ArrayLike] = None,
         color: Color = (0.0, 0.0, 1.0, 1.0),
+        culler: ta.Optional[Frustum] = None,
+        index: ta.Optional[SpatialHash] = None,
     ):
-        self._matrix = matrix or Matrix()
+        self._matrix = np.identity(4) if matrix is None else np.array(matrix, float)
         self._color = color
+        self._stack: list[tuple[np.ndarray, Color]] = []
+        self.culler = culler
+        self.index = index
+
+    def push(self):
+        """Save current matrix and color on the stack"""
+        self._stack.append((self._matrix, self._color))
+
+    def pop(self):
+        """Restore matrix and color last saved on the stack"""
+        self._matrix, self._color = self._stack.pop()
 
-    @contextmanager
     def scale(
         self,
         x: ta.Optional[float] = None,
         y: ta.Optional[float] = None,
         z: ta.Optional[float] = None,
         xyz: float = 1.0,
-    ):
+    ) -> Operation:
         """Scale specified dimension. xyz is a shortcut for scaling all
         dimensions equally
         """
-        matrix = self._matrix
-        self._matrix = self._matrix @ Matrix.Diagonal(
-            (x or xyz, y or xyz, z or xyz, 1.0)
-        )
-        yield
-        self._matrix = matrix
+        return Operation(self, _cached(_scaling, x or xyz, y or xyz, z or xyz))
 
-    @contextmanager
-    def translate(self, x: float = 0.0, y: float = 0.0, z: float = 0.0):
-        matrix = self._matrix
-        self._matrix = self._matrix @ Matrix.Translation((x, y, z))
-        yield
-        self._matrix = matrix
+    def translate(self, x: float = 0.0, y: float = 0.0, z: float = 0.0) -> Operation:
+        return Operation(self, _cached(_translation, x, y, z))
 
-    @contextmanager
-    def rotate(self, angle: float, axis: ta.Union[ta.Literal["X", "Y", "Z"], Vector]):
+    def rotate(
+        self,
+        angle: float,
+        axis: ta.Union[ta.Literal["X", "Y", "Z"], tuple[float, float, float]],
+    ) -> Operation:
         """Rotate angle radians around axis"""
-        matrix = self._matrix
-        self._matrix = self._matrix @ Matrix.Rotation(angle, 4, axis)
-        yield
-        self._matrix = matrix
+        return Operation(self, _cached(_rotation, angle, axis))
+
+    def __call__(self, **operations: ta.Any) -> Operation:
+        """Fuse Structure Synth style operations, applied in the order given
+
+        x, y, z translate
+        rx, ry, rz rotate in degrees around the axis
+        s scales all dimensions equally, sx, sy, sz scale a single dimension
+        h, sat, b, a adjust hue, saturation, value (brightness) and alpha
+        as in color(), and color sets the base color
+        """
+        key = tuple(operations.items())
+        try:
+            fused = _FUSED.get(key)
+        except TypeError:
+            # Unhashable color, not cached
+            return Operation(self, *_fuse(operations))
+        if fused is None:
+            if len(_FUSED) >= _MAX_FUSED:
+                _FUSED.clear()
+            fused = _FUSED[key] = _fuse(operations)
+        return Operation(self, *fused)
+
+    def snapshot(self) -> tuple[np.ndarray, Color]:
+        """Return current matrix and color state, to be restored later"""
+        return self._matrix, self._color
+
+    def restore(self, state: tuple[np.ndarray, Color]):
+        """Restore state returned by snapshot"""
+        self._matrix, self._color = state
 
     @property
-    def matrix(self) -> Matrix:
+    def matrix(self) -> np.ndarray:
+        """Current 4x4 matrix, which must not be modified in place"""
         return self._matrix
 
     @property
     def color_rgba(self) -> Color:
         return hsva_to_rgba(self._color)
 
-    @contextmanager
     def color(
         self,
         hue: ta.Optional[ColorComponent] = None,
@@ -72,55 +120,237 @@ class Transform:
         value: ta.Optional[ColorComponent] = None,
         alpha: ta.Optional[ColorComponent] = None,
         color: ta.Optional[Color] = None,
-    ):
+    ) -> Operation:
         """Transform color
 
         If color is specified, it is used as the new base color
         hue increments the hue value, and wraps around.
         saturation, value and alpha are multipliers and clamp to 0..1
         """
-        current_color = self._color
-        base_color = color or self._color
-        self._color = (
-            base_color[0] if hue is None else math.modf(base_color[0] + hue)[0],
-            base_color[1] if saturation is None else clamp(base_color[1] * saturation),
-            base_color[2] if value is None else clamp(base_color[2] * value),
-            base_color[3] if alpha is None else clamp(base_color[3] * alpha),
-        )
-        yield
-        self._color = current_color
+        return Operation(self, None, (hue, saturation, value, alpha, color))
 
     def apply(self, transformer: Transformer):
+        if self.culler is not None and not self.culler.visible(
+            self._matrix, transformer.radius
+        ):
+            transformer.discard()
+            return
         transformer.transform(self)
+        if profiler._ACTIVE is not None:
+            profiler._ACTIVE.emit()
+        if self.index is not None:
+            self.index.insert(*self.bounding_sphere(transformer.radius))
+
+    def bounding_sphere(self, radius: float) -> tuple[Point, float]:
+        """Return world center and radius of a sphere of radius at the origin"""
+        return bounding_sphere(self._matrix, radius)
+
+
+class Operation:
+    """Context manager applying a matrix and color adjustment to a Transform
+
+    The adjustment is a tuple of color() arguments. An Operation can be reused.
+    """
+
+    __slots__ = ("_transform", "_matrix", "_adjustment")
+
+    def __init__(
+        self,
+        transform: Transform,
+        matrix: ta.Optional[np.ndarray],
+        adjustment: ta.Optional[tuple] = None,
+    ):
+        self._transform = transform
+        self._matrix = matrix
+        self._adjustment = adjustment
+
+    def __enter__(self):
+        transform = self._transform
+        transform._stack.append((transform._matrix, transform._color))
+        if self._matrix is not None:
+            # np.dot has less overhead than @ for a single 4x4 product
+            transform._matrix = np.dot(transform._matrix, self._matrix)
+        if self._adjustment is not None:
+            transform._color = _adjust_color(transform._color, *self._adjustment)
+
+    def __exit__(self, *exc_info):
+        transform = self._transform
+        transform._matrix, transform._color = transform._stack.pop()
+
+
+def _adjust_color(
+    current_color: Color,
+    hue: ta.Optional[ColorComponent],
+    saturation: ta.Optional[ColorComponent],
+    value: ta.Optional[ColorComponent],
+    alpha: ta.Optional[ColorComponent],
+    color: ta.Optional[Color],
+) -> Color:
+    base_color = color or current_color
+    return (
+        base_color[0] if hue is None else math.modf(base_color[0] + hue)[0],
+        base_color[1] if saturation is None else _clamp(base_color[1] * saturation),
+        base_color[2] if value is None else _clamp(base_color[2] * value),
+        base_color[3] if alpha is None else _clamp(base_color[3] * alpha),
+    )
+
+
+def _clamp(value: float) -> float:
+    return min(max(value, 0.0), 1.0)
+
+
+def _cached(build: ta.Callable[..., np.ndarray], *args: ta.Any) -> np.ndarray:
+    """Return the matrix build(*args), cached like fused operations"""
+    key = (build, *args)
+    try:
+        matrix = _MATRICES.get(key)
+    except TypeError:
+        # Unhashable axis, not cached
+        return build(*args)
+    if matrix is None:
+        if len(_MATRICES) >= _MAX_FUSED:
+            _MATRICES.clear()
+        matrix = _MATRICES[key] = build(*args)
+        matrix.flags.writeable = False
+    return matrix
+
+
+def _scaling(x: float, y: float, z: float) -> np.ndarray:
+    return np.array(
+        (
+            (x, 0.0, 0.0, 0.0),
+            (0.0, y, 0.0, 0.0),
+            (0.0, 0.0, z, 0.0),
+            (0.0, 0.0, 0.0, 1.0),
+        ),
+        dtype=float,
+    )
+
+
+def _translation(x: float, y: float, z: float) -> np.ndarray:
+    return np.array(
+        (
+            (1.0, 0.0, 0.0, x),
+            (0.0, 1.0, 0.0, y),
+            (0.0, 0.0, 1.0, z),
+            (0.0, 0.0, 0.0, 1.0),
+        ),
+        dtype=float,
+    )
+
+
+def _rotation(
+    angle: float,
+    axis: ta.Union[ta.Literal["X", "Y", "Z"], tuple[float, float, float]],
+) -> np.ndarray:
+    """Right handed rotation of angle radians around axis"""
+    x, y, z = _AXES[axis] if isinstance(axis, str) else map(float, axis)
+    length = math.sqrt(x * x + y * y + z * z)
+    x, y, z = x / length, y / length, z / length
+    c = math.cos(angle)
+    s = math.sin(angle)
+    t = 1 - c
+    return np.array(
+        (
+            (t * x * x + c, t * x * y - s * z, t * x * z + s * y, 0.0),
+            (t * x * y + s * z, t * y * y + c, t * y * z - s * x, 0.0),
+            (t * x * z - s * y, t * y * z + s * x, t * z * z + c, 0.0),
+            (0.0, 0.0, 0.0, 1.0),
+        )
+    )
+
+
+def _fuse(operations: dict[str, ta.Any]) -> tuple[np.ndarray, ta.Optional[tuple]]:
+    """Return the matrix and color adjustment of Transform() operations"""
+    # Columns of the upper 3x4 of the matrix, multiplied in place
+    columns = [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0], [0.0, 0.0, 0.0]]
+    adjustment = dict.fromkeys(("hue", "saturation", "value", "alpha", "color"))
+    for name, value in operations.items():
+        if name in _TRANSLATIONS:
+            axis = columns[_TRANSLATIONS[name]]
+            offset = columns[3]
+            for k in range(3):
+                offset[k] += axis[k] * value
+        elif name in _ROTATIONS:
+            i, j = _ROTATIONS[name]
+            angle = math.radians(value)
+            c = math.cos(angle)
+            s = math.sin(angle)
+            a, b = columns[i], columns[j]
+            columns[i] = [c * a[k] + s * b[k] for k in range(3)]
+            columns[j] = [c * b[k] - s * a[k] for k in range(3)]
+        elif name == "s":
+            for k in range(3):
+                columns[k] = [v * value for v in columns[k]]
+        elif name in _SCALES:
+            k = _SCALES[name]
+            columns[k] = [v * value for v in columns[k]]
+        elif name in _ADJUSTMENTS:
+            adjustment[_ADJUSTMENTS[name]] = value
+        else:
+            raise TypeError(f"Unknown transform operation {name!r}")
+    matrix = np.array(
+        [[column[k] for column in columns] for k in range(3)] + [[0.0, 0.0, 0.0, 1.0]]
+    )
+    # Shared by all operations fused from the same arguments
+    matrix.flags.writeable = False
+    adjusted = any(v is not None for v in adjustment.values())
+    return matrix, tuple(adjustment.values()) if adjusted else None
+
+
+def matrix_scale(matrix: np.ndarray) -> np.ndarray:
+    """Scale of each axis of a 4x4 matrix"""
+    return np.linalg.norm(matrix[:3, :3], axis=0)
+
+
+_AXES = {
+    "X": (1.0, 0.0, 0.0),
+    "Y": (0.0, 1.0, 0.0),
+    "Z": (0.0, 0.0, 1.0),
+}
+# Column of each axis
+_TRANSLATIONS = {"x": 0, "y": 1, "z": 2}
+# Columns rotated towards each other
+_ROTATIONS = {"rx": (1, 2), "ry": (2, 0), "rz": (0, 1)}
+_SCALES = {"sx": 0, "sy": 1, "sz": 2}
+_ADJUSTMENTS = {
+    "h": "hue",
+    "sat": "saturation",
+    "b": "value",
+    "a": "alpha",
+    "color": "color",
+}
+# Fused operations by Transform() arguments, cleared when full
+_FUSED: dict[tuple, tuple[np.ndarray, ta.Optional[tuple]]] = {}
+_MAX_FUSED = 4096
+# Matrices of single operations by builder and arguments, cleared when full
+_MATRICES: dict[tuple, np.ndarray] = {}
 
 
 class Transformer(abc.ABC):
-    """Base transformer, applies matrix but not color"""
+    """Base transformer, applies matrix but not color
+
+    radius bounds the object in its local space, for culling. The default
+    bounds Blender primitives created with their default size.
+    """
+
+    radius: float = math.sqrt(3)
 
     def transform(self, xfm: Transform):
         self.apply_matrix(xfm.matrix)
         self.apply_color(xfm.color_rgba)
 
     @abc.abstractmethod
-    def apply_matrix(self, matrix: Matrix):
-        """Apply transformation matrix to object"""
+    def apply_matrix(self, matrix: np.ndarray):
+        """Apply 4x4 transformation matrix to object"""
 
     def apply_color(self, color: Color):
         """Apply color to object"""
         pass
 
-
-class ObjectTransformer(Transformer):
-    def __init__(self, obj: bpy.types.Object):
-        self._obj = obj
-
-    @property
-    def obj(self) -> bpy.types.Object:
-        return self._obj
-
-    def apply_matrix(self, matrix: Matrix):
-        """Apply transformation matrix to object"""
-        self.obj.matrix_world = matrix
+    def discard(self):
+        """Called instead of transform when the object is culled"""
+        pass
 
 
 def hsva_to_rgba(color: Color) -> Color:
@@ -0,0 +1,426 @@
+"""Warm Blender worker running scripts sent over a Unix socket
+
+python -m algorist.worker serve [--socket PATH]
+python -m algorist.worker run SCRIPT.py [--seed N] [--param NAME=VALUE]
+    [--output DIR] [--render] [--save]
+
+The worker keeps Blender, the template and imported modules loaded, and
+resets the scene to the template in memory after each script, so a run only
+costs the time of the script itself.
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import logging
+import os
+import runpy
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+import typing as ta
+
+from . import blender, decorator, random
+from .batch import PARAMETERS_VARIABLE, ROOT, parse_value
+
+if ta.TYPE_CHECKING:
+    import bpy
+
+log = logging.getLogger(__name__)
+
+
+def _runtime_directory() -> str:
+    """Directory private to the user, for the default socket"""
+    return os.environ.get("XDG_RUNTIME_DIR") or os.path.join(
+        tempfile.gettempdir(), f"algorist-{os.getuid()}"
+    )
+
+
+DEFAULT_SOCKET = os.path.join(_runtime_directory(), "algorist.sock")
+
+
+class _Reference(ta.NamedTuple):
+    """Index of a template datablock"""
+
+    position: int
+
+
+class Template:
+    """In memory state of the template, restored after each job
+
+    Datablocks created by a job are removed, except linked libraries and
+    their datablocks, and the properties of the template scenes, objects,
+    cameras, lights, worlds and materials and the links of the template
+    collections restored. Removed template objects are recreated, any other
+    removed datablock reloads the template file.
+    """
+
+    # Datablock types whose properties are restored
+    TYPES = ("Scene", "Object", "Camera", "Light", "World", "Material", "Collection")
+    # Levels of nested structs, e.g. world, node tree, node, socket, value
+    DEPTH = 4
+    # Collections of structs longer than this are not restored
+    MAX_ITEMS = 64
+    # Properties derived from others, or not safe to walk
+    SKIPPED = {"rna_type", "dimensions", "depsgraph", "id_data", "original"}
+
+    def __init__(self):
+        self.capture()
+
+    def capture(self):
+        """Capture the current state as the template"""
+        import bpy
+
+        self.filepath = bpy.data.filepath
+        self.ids: list[bpy.types.ID] = list(bpy.data.user_map())
+        self._indices = {id_: index for index, id_ in enumerate(self.ids)}
+        self.states = [
+            self._capture(id_, self.DEPTH) if self._restored(id_) else None
+            for id_ in self.ids
+        ]
+        # (owner, master collection of scene owner, objects, children)
+        self.links = [
+            (
+                self._indices[owner],
+                isinstance(owner, bpy.types.Scene),
+                [self._indices[obj] for obj in collection.objects],
+                [self._indices[child] for child in collection.children],
+            )
+            for owner, collection in [
+                (c, c) for c in self.ids if isinstance(c, bpy.types.Collection)
+            ]
+            + [(s, s.collection) for s in self.ids if isinstance(s, bpy.types.Scene)]
+        ]
+
+    def restore(self):
+        """Reset all datablocks to the captured template"""
+        import bpy
+
+        removed = [index for index, id_ in enumerate(self.ids) if not _alive(id_)]
+        # Linked libraries are kept, so they are loaded once per session
+        bpy.data.batch_remove(
+            [
+                id_
+                for id_ in bpy.data.user_map()
+                if id_ not in self._indices
+                and id_.library is None
+                and not isinstance(id_, bpy.types.Library)
+            ]
+        )
+        for index in removed:
+            state = self.states[index]
+            data = state and state.get("data")
+            if (
+                state is None
+                or not isinstance(self.ids[index], bpy.types.Object)
+                or (data is not None and not _alive(self.ids[data.position]))
+            ):
+                log.info(f"Template datablock removed, reloading {self.filepath}")
+                bpy.ops.wm.open_mainfile(filepath=self.filepath)
+                self.capture()
+                return
+            self.ids[index] = bpy.data.objects.new(
+                state["name"], data and self.ids[data.position]
+            )
+        if removed:
+            self._indices = {id_: index for index, id_ in enumerate(self.ids)}
+        for id_, state in zip(self.ids, self.states):
+            if state is not None:
+                self._restore(id_, state)
+        for owner, master, objects, children in self.links:
+            collection = self.ids[owner].collection if master else self.ids[owner]
+            _relink(collection.objects, [self.ids[index] for index in objects])
+            _relink(collection.children, [self.ids[index] for index in children])
+
+    def _restored(self, id_: bpy.types.ID) -> bool:
+        import bpy
+
+        types = tuple(getattr(bpy.types, name) for name in self.TYPES)
+        return id_.library is None and isinstance(id_, types)
+
+    def _capture(self, struct: bpy.types.bpy_struct, depth: int) -> dict:
+        import bpy
+
+        state: dict[str, ta.Any] = {}
+        for prop in struct.bl_rna.properties:
+            name = prop.identifier
+            if name in self.SKIPPED:
+                continue
+            try:
+                value = getattr(struct, name)
+            except (AttributeError, RuntimeError):
+                continue
+            if prop.type == "POINTER":
+                if isinstance(value, bpy.types.ID) and not value.is_embedded_data:
+                    if not prop.is_readonly and value in self._indices:
+                        state[name] = _Reference(self._indices[value])
+                elif value is None:
+                    if not prop.is_readonly:
+                        state[name] = None
+                elif depth:
+                    state[name] = self._capture(value, depth - 1)
+            elif prop.type == "COLLECTION":
+                if depth and 0 < len(value) <= self.MAX_ITEMS:
+                    if not isinstance(value[0], bpy.types.ID):
+                        state[name] = [self._capture(v, depth - 1) for v in value]
+            elif not prop.is_readonly:
+                state[name] = _copy(value)
+        return state
+
+    def _restore(self, struct: bpy.types.bpy_struct, state: dict):
+        for name, value in state.items():
+            current = getattr(struct, name)
+            if isinstance(value, dict):
+                if current is not None:
+                    self._restore(current, value)
+            elif isinstance(value, list):
+                for item, item_state in zip(current, value):
+                    self._restore(item, item_state)
+            else:
+                if isinstance(value, _Reference):
+                    value = self.ids[value.position]
+                    if current == value:
+                        continue
+                elif value is None:
+                    if current is None:
+                        continue
+                elif _copy(current) == value:
+                    continue
+                try:
+                    setattr(struct, name, value)
+                except (AttributeError, TypeError, ValueError, RuntimeError) as e:
+                    log.debug(f"Can not restore {name}: {e}")
+
+
+def _alive(id_: bpy.types.ID) -> bool:
+    try:
+        id_.name
+    except ReferenceError:
+        return False
+    return True
+
+
+def _copy(value: ta.Any) -> ta.Any:
+    """Copy property value, so it does not change with the property"""
+    if isinstance(value, (bool, int, float, str)):
+        return value
+    if hasattr(value, "copy"):
+        # mathutils values and enum flag sets
+        return value.copy()
+    return tuple(_copy(v) for v in value)
+
+
+def _relink(collection: bpy.types.bpy_prop_collection, ids: list[bpy.types.ID]):
+    for id_ in set(collection) - set(ids):
+        collection.unlink(id_)
+    for id_ in ids:
+        if id_.name not in collection:
+            collection.link(id_)
+
+
+def run_job(request: dict[str, ta.Any]) -> dict[str, ta.Any]:
+    """Run the script of request in this Blender, returning the response
+
+    request has the script path, and optionally its seed, parameters, args,
+    working directory cwd, and an output directory to save and render to.
+    """
+    import bpy
+
+    script = request["script"]
+    output = request.get("output")
+    response: dict[str, ta.Any] = {
+        "script": script,
+        "seed": request.get("seed"),
+        "parameters": request.get("parameters", {}),
+    }
+    cwd = os.getcwd()
+    argv = sys.argv
+    parameters = os.environ.get(PARAMETERS_VARIABLE)
+    start = time.perf_counter()
+    try:
+        os.chdir(request.get("cwd") or cwd)
+        os.environ[PARAMETERS_VARIABLE] = json.dumps(response["parameters"])
+        sys.argv = [script] + list(request.get("args", []))
+        random.seed(response["seed"])
+        runpy.run_path(script, run_name="__main__")
+        response.update(
+            time=time.perf_counter() - start,
+            objects=len(bpy.data.objects),
+            materials=len(bpy.data.materials),
+            meshes=len(bpy.data.meshes),
+        )
+        if output:
+            os.makedirs(output, exist_ok=True)
+            if request.get("save"):
+                response["blend"] = os.path.join(output, "scene.blend")
+                bpy.ops.wm.save_as_mainfile(filepath=response["blend"], copy=True)
+            if request.get("render"):
+                render = bpy.context.scene.render
+                render.filepath = os.path.join(output, "render")
+                response["render"] = render.filepath + render.file_extension
+                bpy.ops.render.render(write_still=True)
+        response["status"] = "ok"
+    except (Exception, SystemExit):
+        response.update(status="failed", error=traceback.format_exc())
+    finally:
+        os.chdir(cwd)
+        sys.argv = argv
+        if parameters is None:
+            os.environ.pop(PARAMETERS_VARIABLE, None)
+        else:
+            os.environ[PARAMETERS_VARIABLE] = parameters
+    return response
+
+
+def serve(path: str = DEFAULT_SOCKET):
+    """Run requests sent to the Unix socket path, until asked to shut down
+
+    Must run inside Blender, with the template loaded. Each connection sends
+    JSON requests for run_job, or {"shutdown": true}, one per line, and
+    receives a JSON response line for each. Malformed requests get a failed
+    response.
+
+    The socket is only accessible by the user. Its directory is created
+    private to the user if missing, and the directory of the default socket
+    must be.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if directory == os.path.dirname(DEFAULT_SOCKET):
+        stat = os.stat(directory)
+        if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+            raise ValueError(f"Socket directory {directory} is not private")
+    template = Template()
+    if os.path.exists(path):
+        os.unlink(path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        # Not accessible by others between bind and chmod
+        umask = os.umask(0o177)
+        try:
+            server.bind(path)
+        finally:
+            os.umask(umask)
+        os.chmod(path, 0o600)
+        server.listen()
+        log.info(f"Worker listening on {path}")
+        try:
+            while True:
+                connection, _ = server.accept()
+                with connection, connection.makefile("rwb") as stream:
+                    for line in stream:
+                        try:
+                            request = _parse_request(line)
+                        except ValueError as e:
+                            _respond(stream, {"status": "failed", "error": str(e)})
+                            continue
+                        if request.get("shutdown"):
+                            _respond(stream, {"status": "ok"})
+                            return
+                        response = run_job(request)
+                        start = time.perf_counter()
+                        decorator.reset_rules()
+                        template.restore()
+                        blender.reset_caches()
+                        response["reset_time"] = time.perf_counter() - start
+                        _respond(stream, response)
+        finally:
+            os.unlink(path)
+
+
+def _parse_request(line: bytes) -> dict[str, ta.Any]:
+    """Return the request of a JSON line, raising ValueError if malformed"""
+    request = json.loads(line)
+    if not isinstance(request, dict):
+        raise ValueError("Request is not a JSON object")
+    if not request.get("shutdown") and not isinstance(request.get("script"), str):
+        raise ValueError("Request has no script path")
+    return request
+
+
+def _respond(stream: io.BufferedIOBase, response: dict[str, ta.Any]):
+    stream.write(json.dumps(response).encode() + b"\n")
+    stream.flush()
+
+
+def submit(request: dict[str, ta.Any], path: str = DEFAULT_SOCKET) -> dict:
+    """Send request to the worker listening on path, returning its response"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        with connection.makefile("rwb") as stream:
+            _respond(stream, request)
+            return json.loads(stream.readline())
+
+
+def main(argv: ta.Optional[ta.Sequence[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="socket path")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="start a worker in Blender")
+    serve_parser.add_argument("--blender", default=os.environ.get("BLENDER", "blender"))
+    serve_parser.add_argument(
+        "--template", default=os.path.join(ROOT, "algorist.blend")
+    )
+    run_parser = commands.add_parser("run", help="run a script in the worker")
+    run_parser.add_argument("script", help="Blender python script to run")
+    run_parser.add_argument("args", nargs="*", help="script arguments")
+    run_parser.add_argument("--seed", type=int)
+    run_parser.add_argument(
+        "--param", action="append", default=[], metavar="NAME=VALUE"
+    )
+    run_parser.add_argument("--output", help="output directory")
+    run_parser.add_argument("--render", action="store_true", help="render")
+    run_parser.add_argument("--save", action="store_true", help="save scene.blend")
+    commands.add_parser("shutdown", help="stop the worker")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        subprocess.run(
+            [
+                args.blender,
+                "--background",
+                args.template,
+                "--python-expr",
+                f"from algorist.worker import serve; serve({args.socket!r})",
+            ],
+            env={
+                **os.environ,
+                "PYTHONPATH": os.pathsep.join(
+                    filter(None, [ROOT, os.environ.get("PYTHONPATH")])
+                ),
+            },
+            check=True,
+        )
+        return
+    if args.command == "shutdown":
+        submit({"shutdown": True}, args.socket)
+        return
+    parameters = {}
+    for spec in args.param:
+        name, _, value = spec.partition("=")
+        parameters[name] = parse_value(value)
+    response = submit(
+        {
+            "script": os.path.abspath(args.script),
+            "args": args.args,
+            "seed": args.seed,
+            "parameters": parameters,
+            "cwd": os.getcwd(),
+            "output": args.output and os.path.abspath(args.output),
+            "render": args.render,
+            "save": args.save,
+        },
+        args.socket,
+    )
+    json.dump(response, sys.stdout, indent=2)
+    print()
+    if response["status"] != "ok":
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Run a single benchmark case inside Blender, writing measurements as JSON
+
+blender --background algorist.blend --python benchmarks/case.py -- CASE OUT.json
+"""
+
+from __future__ import annotations
+
+import functools
+import json
+import math
+import os
+import resource
+import runpy
+import sys
+import tempfile
+import time
+import typing as ta
+
+import algorist
+from algorist import (
+    InstanceBuffer,
+    InstancingObjectFactory,
+    MergingObjectFactory,
+    ObjectFactory,
+    Transform,
+)
+from algorist.instance import RecordingTransformer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEED = 1
+
+
+def _records(factory: ObjectFactory, *args, **kwargs) -> bool:
+    return factory.buffer is not None
+
+
+def _applies_recorded(transform: Transform, transformer, *args, **kwargs) -> bool:
+    return isinstance(transformer, RecordingTransformer)
+
+
+class CreationTimer:
+    """Accumulates time spent creating and transforming Blender data
+
+    Calls which only record instances into a buffer are part of the
+    expansion, not timed. Nested calls, such as a flush while creating a
+    mesh, are counted once.
+    """
+
+    # Class, method and whether a call only records
+    METHODS: list[tuple[type, str, ta.Optional[ta.Callable[..., bool]]]] = [
+        (ObjectFactory, "create_mesh", _records),
+        (ObjectFactory, "line", None),
+        (ObjectFactory, "lines", None),
+        (ObjectFactory, "materialize", None),
+        (InstancingObjectFactory, "materialize", None),
+        (MergingObjectFactory, "materialize", None),
+        (Transform, "apply", _applies_recorded),
+    ]
+
+    def __init__(self):
+        self.elapsed = 0.0
+        self._depth = 0
+
+    def install(self):
+        for cls, name, records in self.METHODS:
+            setattr(cls, name, self._timed(cls.__dict__[name], records))
+
+    def _timed(
+        self, func: ta.Callable, records: ta.Optional[ta.Callable[..., bool]]
+    ) -> ta.Callable:
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            if records is not None and records(*args, **kwargs):
+                return func(*args, **kwargs)
+            self._depth += 1
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._depth -= 1
+                if not self._depth:
+                    self.elapsed += time.perf_counter() - start
+
+        return timed
+
+
+def example(name: str) -> ta.Callable[[], None]:
+    def run():
+        runpy.run_path(
+            os.path.join(ROOT, "examples", f"{name}.py"), run_name="__main__"
+        )
+
+    return run
+
+
+def cubes(
+    count: int, factory_cls: type = ObjectFactory, record: bool = False
+) -> ta.Callable[[], None]:
+    """count cubes on a grid, with varying colors"""
+
+    def run():
+        factory = factory_cls(InstanceBuffer() if record else None)
+        xfm = Transform()
+        side = math.ceil(count ** (1 / 3))
+        for i in range(count):
+            with xfm(
+                x=3 * (i % side),
+                y=3 * (i // side % side),
+                z=3 * (i // side**2),
+                h=i / count,
+            ):
+                xfm.apply(factory.cube())
+        if record:
+            factory.materialize()
+
+    return run
+
+
+CASES: dict[str, ta.Callable[[], None]] = {
+    "tree": example("tree"),
+    "rules": example("rules"),
+    "sierpinksi": example("sierpinksi"),
+    "icecube": example("icecube"),
+    "ballpit": example("ballpit"),
+    "cubes_1k": cubes(1_000),
+    "cubes_10k": cubes(10_000),
+    "cubes_100k": cubes(100_000),
+    "cubes_100k_recorded": cubes(100_000, record=True),
+    "cubes_100k_instanced": cubes(100_000, InstancingObjectFactory, record=True),
+    "cubes_100k_merged": cubes(100_000, MergingObjectFactory, record=True),
+}
+
+
+def peak_rss() -> int:
+    """Peak resident set size of this process in bytes"""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def main():
+    import bpy
+
+    name, output = sys.argv[sys.argv.index("--") + 1 :]
+    # Examples load resources relative to the repository
+    os.chdir(ROOT)
+    algorist.seed(SEED)
+    timer = CreationTimer()
+    timer.install()
+
+    start = time.perf_counter()
+    CASES[name]()
+    total = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        bpy.ops.wm.save_as_mainfile(
+            filepath=os.path.join(directory, "benchmark.blend"), copy=True
+        )
+        save = time.perf_counter() - start
+
+    result = {
+        "case": name,
+        "total_time": total,
+        "expansion_time": total - timer.elapsed,
+        "creation_time": timer.elapsed,
+        "save_time": save,
+        "peak_rss": peak_rss(),
+        "objects": len(bpy.data.objects),
+        "materials": len(bpy.data.materials),
+        "meshes": len(bpy.data.meshes),
+    }
+    with open(output, "w") as f:
+        json.dump(result, f)
+
+
+if __name__ == "__main__":
+    main()
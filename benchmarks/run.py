@@ -0,0 +1,103 @@
+"""Benchmark the examples and synthetic scaling cases in headless Blender
+
+Each case runs in a fresh Blender process with a fixed seed, and the
+measurements of all cases are written as JSON.
+
+python benchmarks/run.py [--blender BLENDER] [--output OUT.json] [CASE ...]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from case import CASES, SEED  # noqa: E402 isort:skip
+
+
+def run_case(blender: str, name: str, verbose: bool) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, f"{name}.json")
+        subprocess.run(
+            [
+                blender,
+                "--background",
+                os.path.join(ROOT, "algorist.blend"),
+                "--python-exit-code",
+                "1",
+                "--python",
+                os.path.join(ROOT, "benchmarks", "case.py"),
+                "--",
+                name,
+                output,
+            ],
+            env={**os.environ, "PYTHONPATH": ROOT},
+            stdout=None if verbose else subprocess.DEVNULL,
+            check=True,
+        )
+        with open(output) as f:
+            return json.load(f)
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("cases", nargs="*", help=f"cases to run: {', '.join(CASES)}")
+    parser.add_argument(
+        "--blender", default=os.environ.get("BLENDER", "blender"), help="executable"
+    )
+    parser.add_argument("--output", help="JSON output file, defaults to stdout")
+    parser.add_argument("--verbose", action="store_true", help="show Blender output")
+    args = parser.parse_args()
+    unknown = set(args.cases) - set(CASES)
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+
+    results = []
+    for name in args.cases or CASES:
+        result = run_case(args.blender, name, args.verbose)
+        print(
+            f"{name}: {result['total_time']:.2f}s "
+            f"(expansion {result['expansion_time']:.2f}s, "
+            f"creation {result['creation_time']:.2f}s, "
+            f"save {result['save_time']:.2f}s), "
+            f"{result['peak_rss'] / 2**20:.0f} MiB, "
+            f"{result['objects']} objects",
+            file=sys.stderr,
+        )
+        results.append(result)
+
+    report = {
+        "commit": git_commit(),
+        "seed": SEED,
+        "platform": platform.platform(),
+        "cases": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,20 @@
 from __future__ import annotations
 
-import typing as ta
 from math import radians
 
 import bpy
 from mathutils import Matrix
 
-from algorist import ObjectFactory, ObjectTransformer, Transform, limit
+from algorist import LibraryMaterialTransformer, ObjectFactory, Transform, limit
 
-if ta.TYPE_CHECKING:
-    from algorist import Color
 
-with bpy.data.libraries.load("examples/glassball.blend", relative=True) as (
-    data_from,
-    data_to,
-):
-    data_to.objects = data_from.objects
-    data_to.materials = data_from.materials
-    data_to.meshes = data_from.meshes
-
-sphere_prototype = bpy.data.objects["Sphere"]
-
-
-class GlassTransformer(ObjectTransformer):
-    def apply_color(self, color: Color):
-        material = self.obj.material_slots[0].material.copy()
-        self.obj.material_slots[0].material = material
-        material.node_tree.nodes["Glass BSDF"].inputs["Color"].default_value = color
+class GlassTransformer(LibraryMaterialTransformer):
+    color_node = "Glass BSDF"
+    color_input = "Color"
 
 
 def sphere():
-    obj = sphere_prototype.copy()
-    bpy.context.collection.objects.link(obj)
-    return GlassTransformer(obj)
+    return of.library("examples/glassball.blend", "Sphere", GlassTransformer)
 
 
 xfm = Transform()
@@ -24,12 +24,13 @@ of = ObjectFactory()
 
 
 class IceTransformer(MeshMaterialTransformer):
-    def apply_color(self, color: Color):
-        super().apply_color(color)
-        node_tree = self.obj.material_slots[0].material.node_tree
+    def create_material(self, color: Color) -> bpy.types.Material:
+        material = super().create_material(color)
+        node_tree = material.node_tree
         glass_node = node_tree.nodes.new("ShaderNodeBsdfGlass")
         output = node_tree.nodes.get("Material Output")
         node_tree.links.new(output.inputs["Surface"], glass_node.outputs["BSDF"])
+        return material
 
 
 def glasscube():
@@ -0,0 +1,60 @@
+import pytest
+
+from algorist import (
+    Estimate,
+    InstanceBuffer,
+    InstanceCounter,
+    ObjectColorMaterialTransformer,
+    ObjectFactory,
+    Transform,
+)
+from algorist.blender import _MATERIAL_BYTES, _OBJECT_BYTES, _VERTEX_BYTES
+
+
+def scene(of: ObjectFactory):
+    xfm = Transform()
+    for i in range(10):
+        with xfm.translate(x=i), xfm.color(color=(0.5 * (i % 2), 1, 1, 1)):
+            xfm.apply(of.cube())
+            xfm.apply(of.ico_sphere(subdivisions=1))
+            xfm.apply(of.uv_sphere(transformer_cls=ObjectColorMaterialTransformer))
+
+
+@pytest.mark.parametrize("buffer_cls", [InstanceBuffer, InstanceCounter])
+def test_estimate(buffer_cls):
+    of = ObjectFactory(buffer_cls())
+    scene(of)
+    estimate = of.estimate()
+    assert estimate == Estimate(
+        objects=30,
+        prototypes={"Cube": 10, "IcoSphere": 10, "UVSphere": 10},
+        # Two colors shared by the mesh primitives, and an object color material
+        materials=3,
+        vertices=10 * (8 + 12 + 482),
+        mesh_vertices=8 + 12 + 482,
+        memory=30 * _OBJECT_BYTES + 3 * _MATERIAL_BYTES + 502 * _VERTEX_BYTES,
+    )
+
+
+def test_estimate_object_color_transparency():
+    of = ObjectFactory(InstanceBuffer())
+    xfm = Transform()
+    for alpha in (1.0, 0.5, 0.25):
+        with xfm.color(alpha=alpha):
+            xfm.apply(of.cube(transformer_cls=ObjectColorMaterialTransformer))
+    # Transparent objects share a blended material
+    assert of.estimate().materials == 2
+
+
+def test_estimate_lines():
+    of = ObjectFactory(InstanceCounter())
+    xfm = Transform()
+    xfm.apply(of.line(((0, 0, 0), (0, 0, 1), (0, 1, 1))))
+    estimate = of.estimate()
+    assert estimate.prototypes == {"Line": 1}
+    assert estimate.vertices == 3
+
+
+def test_estimate_without_buffer():
+    with pytest.raises(ValueError):
+        ObjectFactory().estimate()
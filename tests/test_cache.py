@@ -0,0 +1,126 @@
+import os
+import typing as ta
+
+import numpy as np
+import pytest
+
+from algorist import (
+    ExpansionCache,
+    InstanceBuffer,
+    ObjectFactory,
+    Transform,
+    limit,
+    rnd,
+    rule,
+)
+from algorist.decorator import reset_rules
+
+
+@pytest.fixture(autouse=True)
+def rules():
+    yield
+    reset_rules()
+
+
+def scatterer(buffer: InstanceBuffer) -> ta.Callable[[int], None]:
+    of = ObjectFactory(buffer)
+    xfm = Transform()
+
+    def scatter(count: int):
+        """Record count randomly placed cubes"""
+        for _ in range(count):
+            with xfm.translate(rnd(10), rnd(10), rnd(10)):
+                xfm.apply(of.cube())
+
+    return scatter
+
+
+def record(cache: ExpansionCache, count: int, **kwargs) -> tuple[InstanceBuffer, bool]:
+    buffer = InstanceBuffer()
+    cached = cache.record(buffer, scatterer(buffer), count, **kwargs)
+    return buffer, cached
+
+
+def test_key():
+    cache = ExpansionCache("unused")
+    scatter = scatterer(InstanceBuffer())
+    key = cache.key(scatter, (10,), seed=1)
+    assert cache.key(scatter, (10,), seed=1) == key
+    xfm = Transform()
+    assert (
+        len(
+            {
+                key,
+                cache.key(scatter, (11,), seed=1),
+                cache.key(scatter, (10,), seed=2),
+                cache.key(scatter, (10,), {"extra": 1}, seed=1),
+                cache.key(scatter, (10,), seed=1, parameters={"size": 2}),
+                cache.key(scatter, (10,), seed=1, transform=xfm),
+            }
+        )
+        == 6
+    )
+    with xfm.translate(x=1):
+        assert cache.key(scatter, (10,), seed=1, transform=xfm) != cache.key(
+            scatter, (10,), seed=1, transform=Transform()
+        )
+
+
+def test_key_rules():
+    cache = ExpansionCache("unused")
+    scatter = scatterer(InstanceBuffer())
+    key = cache.key(scatter, seed=1)
+
+    @limit(max_depth=3)
+    def branch():
+        pass
+
+    # Limits are part of the key
+    limited = cache.key(branch, seed=1)
+    assert limited != cache.key(limit(max_depth=4)(branch.__wrapped__), seed=1)
+
+    @rule()
+    def other():
+        pass
+
+    # So are all registered rules
+    assert cache.key(scatter, seed=1) != key
+
+
+def test_record(tmp_path):
+    cache = ExpansionCache(str(tmp_path))
+    first, cached = record(cache, 20, seed=5)
+    assert not cached and len(first) == 20
+    (entry,) = os.listdir(tmp_path)
+
+    second, cached = record(cache, 20, seed=5)
+    assert cached
+    np.testing.assert_array_equal(second.matrices, first.matrices)
+    assert [p.name for p in second.prototypes] == ["Cube"]
+
+    # Without a seed nothing is cached
+    third, cached = record(cache, 20)
+    assert not cached and len(third) == 20
+    assert os.listdir(tmp_path) == [entry]
+    cache.clear()
+    assert not os.listdir(tmp_path)
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = ExpansionCache(str(tmp_path))
+    entries = []
+    for seed in range(3):
+        record(cache, 100, seed=seed)
+        (entry,) = set(os.listdir(tmp_path)) - set(entries)
+        # Distinct times, oldest first
+        os.utime(tmp_path / entry, (1000 + seed, 1000 + seed))
+        entries.append(entry)
+    size = sum(os.path.getsize(tmp_path / entry) for entry in entries)
+    # Loading an entry marks it as recently used
+    assert record(cache, 100, seed=0)[1]
+
+    cache.max_bytes = size
+    record(cache, 100, seed=3)
+    remaining = set(os.listdir(tmp_path))
+    assert len(remaining) == 3
+    assert entries[0] in remaining and entries[1] not in remaining
@@ -0,0 +1,217 @@
+import numpy as np
+import pytest
+
+from algorist import (
+    Expansion,
+    InstanceBuffer,
+    ObjectFactory,
+    Transform,
+    limit,
+    load_npz,
+    memoize,
+    prnd,
+    rnd,
+    rule,
+    save_npz,
+    seed,
+)
+from algorist.decorator import reset_rules, sample_rules
+
+
+@pytest.fixture(autouse=True)
+def rules():
+    yield
+    reset_rules()
+
+
+def tree(buffer: InstanceBuffer):
+    """Return the root of a randomized tree recording into buffer"""
+    xfm = Transform()
+    of = ObjectFactory(buffer)
+
+    @rule(2)
+    def grow():
+        with xfm.rotate(axis="X", angle=0.2 + prnd(0.5)):
+            yield branch
+
+    @rule()  # type: ignore[no-redef]
+    def grow():  # noqa: F811
+        with xfm.rotate(axis="Y", angle=-0.2):
+            yield branch
+
+    def branch():
+        xfm.apply(of.cube(size=1) if prnd(1) < 0.5 else of.cone())
+        with xfm.translate(z=1), xfm.scale(xyz=0.7 + rnd(0.15)):
+            yield grow
+            yield grow
+
+    return xfm, branch
+
+
+def expand(seed: int, **kwargs) -> InstanceBuffer:
+    reset_rules()
+    buffer = InstanceBuffer()
+    xfm, root = tree(buffer)
+    Expansion(xfm, max_depth=16, buffer=buffer, seed=seed, **kwargs).run(root)
+    return buffer
+
+
+def assert_equal(a: InstanceBuffer, b: InstanceBuffer):
+    assert [p.name for p in a.prototypes] == [p.name for p in b.prototypes]
+    np.testing.assert_array_equal(a.ids, b.ids)
+    np.testing.assert_array_equal(a.matrices, b.matrices)
+    np.testing.assert_array_equal(a.colors, b.colors)
+
+
+def rows(buffer: InstanceBuffer) -> list[tuple]:
+    """Sorted (prototype name, matrix, color) of each instance"""
+    names = [buffer.prototypes[i].name for i in buffer.ids]
+    return sorted(zip(names, buffer.matrices.round(5).tolist(), buffer.colors.tolist()))
+
+
+def test_seeded_expansion_reproducible():
+    buffer = expand(42)
+    # Each branch yields a grow yielding a branch
+    assert len(buffer) == 2**8 - 1
+    assert_equal(buffer, expand(42))
+    assert not np.array_equal(buffer.matrices, expand(43).matrices)
+
+
+def test_split_matches_serial():
+    split = expand(42, split_depth=4, workers=1)
+    # Tasks are merged in order
+    assert_equal(split, expand(42, split_depth=4, workers=4))
+    # Instances above split_depth are recorded before the tasks
+    assert rows(split) == rows(expand(42))
+
+
+def weighted_rules(*weights: float) -> list:
+    """Variants of the rule "variant" returning their index"""
+    variants = []
+    for i, weight in enumerate(weights):
+
+        @rule(weight)
+        def variant(i=i):
+            return i
+
+        variants.append(variant)
+    return variants
+
+
+def test_rule_weights():
+    weights = (1, 2, 3, 0.5)
+    variant = weighted_rules(*weights)[0]
+    seed(3)
+    chosen = np.bincount([variant() for _ in range(20000)], minlength=4)
+    sampled = np.bincount(
+        [func() for func in sample_rules("variant", 20000)], minlength=4
+    )
+    expected = 20000 * np.array(weights) / sum(weights)
+    # Within 4 standard deviations
+    tolerance = 4 * np.sqrt(expected)
+    assert (abs(chosen - expected) < tolerance).all()
+    assert (abs(sampled - expected) < tolerance).all()
+
+
+def test_rule_zero_weight():
+    variant = weighted_rules(1, 0, 1)[0]
+    seed(3)
+    assert 1 not in {variant() for _ in range(1000)}
+    assert 1 not in {func() for func in sample_rules("variant", 1000)}
+
+
+def test_memoize_flatten():
+    buffer = InstanceBuffer()
+    of = ObjectFactory(buffer)
+    xfm = Transform()
+    calls = []
+
+    @memoize(xfm, buffer)
+    def row(count):
+        calls.append(count)
+        for i in range(count):
+            with xfm.translate(x=i):
+                xfm.apply(of.cube())
+
+    for y in range(4):
+        with xfm.translate(y=y):
+            row(3)
+    with xfm.color(hue=0.5):
+        row(3)
+
+    # Captured once per argument and color
+    assert calls == [3, 3]
+    assert len(buffer) == 5
+    flat = buffer.flatten()
+    assert len(flat) == 15
+    assert {flat.prototypes[i].name for i in flat.ids} == {"Cube"}
+    np.testing.assert_allclose(
+        flat.matrices[:3, :3, 3], [[0, 0, 0], [1, 0, 0], [2, 0, 0]]
+    )
+
+
+def binary_tree(memoized: bool, **limits) -> InstanceBuffer:
+    """Record a binary tree bounded by limits, flattened"""
+    buffer = InstanceBuffer()
+    of = ObjectFactory(buffer)
+    xfm = Transform()
+
+    @limit(transform=xfm, **limits)
+    def branch():
+        xfm.apply(of.cube())
+        with xfm.translate(z=1), xfm.scale(xyz=0.5):
+            with xfm.rotate(0.5, "X"):
+                branch()
+            with xfm.rotate(-0.5, "X"):
+                branch()
+
+    if memoized:
+        branch = memoize(xfm, buffer)(branch)
+    with xfm.scale(xyz=2):
+        branch()
+    return buffer.flatten()
+
+
+@pytest.mark.parametrize(
+    "limits", [{"max_depth": 6}, {"max_depth": 100, "min_scale": 0.1}]
+)
+def test_memoize_limited_recursion(limits):
+    plain = binary_tree(False, **limits)
+    assert len(plain) == 31
+    memoized = binary_tree(True, **limits)
+    assert rows(memoized) == rows(plain)
+
+
+def test_memoize_scale():
+    buffer = InstanceBuffer()
+    of = ObjectFactory(buffer)
+    xfm = Transform()
+
+    @memoize(xfm, buffer)
+    def pair():
+        xfm.apply(of.cube())
+        with xfm.translate(x=1):
+            xfm.apply(of.cube())
+
+    pair()
+    with xfm.scale(xyz=3), xfm.translate(y=1):
+        pair()
+    # Reused at another scale
+    assert len(buffer) == 2 and len(buffer.prototypes) == 2
+    np.testing.assert_allclose(
+        buffer.flatten().matrices[:, :3, 3],
+        [[0, 0, 0], [1, 0, 0], [0, 3, 0], [3, 3, 0]],
+    )
+
+
+def test_npz_round_trip(tmp_path):
+    buffer = expand(7)
+    path = tmp_path / "instances.npz"
+    save_npz(buffer, path)
+    loaded = load_npz(path)
+    assert_equal(buffer, loaded)
+    for saved, prototype in zip(buffer.prototypes, loaded.prototypes):
+        assert prototype.creation_func.func is saved.creation_func.func
+        assert prototype.creation_func.args == saved.creation_func.args
+        assert prototype.transformer_cls is saved.transformer_cls
+        assert prototype.args == saved.args
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from algorist import Frustum, Transform
+
+
+def at(x: float, y: float, z: float, scale: float = 1.0) -> np.ndarray:
+    matrix = np.diag([scale, scale, scale, 1.0])
+    matrix[:3, 3] = (x, y, z)
+    return matrix
+
+
+@pytest.fixture
+def frustum() -> Frustum:
+    # 90 degree view down -Z from the origin, 1000 pixels wide
+    return Frustum(np.identity(4), (-1, 1, -1, 1), resolution=(1000, 1000))
+
+
+@pytest.mark.parametrize(
+    "matrix, radius, visible",
+    [
+        (at(0, 0, -10), 1, True),
+        # Behind the camera
+        (at(0, 0, 10), 1, False),
+        # Outside the side planes
+        (at(20, 0, -10), 1, False),
+        (at(0, -20, -10), 1, False),
+        # Straddling a side plane
+        (at(10.5, 0, -10), 1, True),
+        # Beyond the far clip plane
+        (at(0, 0, -1002), 1, False),
+        # Enlarged by the matrix scale
+        (at(20, 0, -10), 0.1, False),
+        (at(20, 0, -10, scale=100), 0.1, True),
+        # Less than a pixel, 1000 pixels span 2 units at depth 1
+        (at(0, 0, -100), 0.05, False),
+        (at(0, 0, -100), 0.2, True),
+        # Containing the camera
+        (at(0, 0, 0.5), 1, True),
+    ],
+)
+def test_perspective(frustum, matrix, radius, visible):
+    assert frustum.visible(matrix, radius) == visible
+
+
+def test_camera_transform():
+    camera = at(100, 0, 0)
+    frustum = Frustum(camera, (-1, 1, -1, 1))
+    assert frustum.visible(at(100, 0, -10), 1)
+    assert not frustum.visible(at(0, 0, -10), 1)
+
+
+def test_orthographic():
+    frustum = Frustum(
+        np.identity(4), (-5, 5, -5, 5), resolution=(100, 100), orthographic=True
+    )
+    assert frustum.visible(at(4, 4, -500), 0.5)
+    assert not frustum.visible(at(6, 0, -10), 0.5)
+    # Pixel size does not depend on depth, 10 pixels per unit
+    assert not frustum.visible(at(0, 0, -10), 0.04)
+    assert frustum.visible(at(0, 0, -900), 0.06)
+
+
+def test_transform_discards_culled():
+    discarded = []
+
+    class Recorder:
+        radius = 1.0
+
+        def transform(self, xfm):
+            discarded.append(False)
+
+        def discard(self):
+            discarded.append(True)
+
+    xfm = Transform(culler=Frustum(np.identity(4), (-1, 1, -1, 1)))
+    with xfm.translate(z=-10):
+        xfm.apply(Recorder())  # type: ignore[arg-type]
+    with xfm.translate(z=10):
+        xfm.apply(Recorder())  # type: ignore[arg-type]
+    assert discarded == [False, True]
@@ -0,0 +1,118 @@
+import json
+import math
+import struct
+
+import numpy as np
+
+from algorist import InstanceBuffer, ObjectFactory, Transform, save_gltf, save_ply
+from algorist.export import _quaternions
+
+
+def instances() -> InstanceBuffer:
+    buffer = InstanceBuffer()
+    of = ObjectFactory(buffer)
+    xfm = Transform()
+    with xfm.translate(1, 2, 3), xfm.color(alpha=0.5):
+        xfm.apply(of.cube())
+    with xfm.rotate(0.5, "Z"), xfm.scale(2, 3, 4):
+        xfm.apply(of.ico_sphere(subdivisions=1))
+        with xfm.translate(z=1):
+            xfm.apply(of.cube())
+    return buffer
+
+
+def test_ply(tmp_path):
+    buffer = instances()
+    path = tmp_path / "instances.ply"
+    save_ply(buffer, path)
+    data = path.read_bytes()
+    header, _, body = data.partition(b"end_header\n")
+    lines = header.decode().splitlines()
+    assert lines[:2] == ["ply", "format binary_little_endian 1.0"]
+    assert "comment prototype Cube" in lines
+    assert "comment prototype IcoSphere" in lines
+    assert "element vertex 3" in lines
+    properties = [line.split()[1:] for line in lines if line.startswith("property")]
+    types = {"float": "<f4", "uchar": "u1", "int": "<i4"}
+    vertices = np.frombuffer(
+        body, dtype=np.dtype([(name, types[type_]) for type_, name in properties])
+    )
+    assert len(vertices) == 3
+    np.testing.assert_allclose(
+        np.stack([vertices[n] for n in "xyz"], axis=-1), buffer.matrices[:, :3, 3]
+    )
+    assert vertices["alpha"].tolist() == [128, 255, 255]
+    assert vertices["prototype"].tolist() == buffer.ids.tolist()
+    np.testing.assert_allclose(vertices["m01"], buffer.matrices[:, 0, 1], rtol=1e-6)
+
+
+def read_glb(path) -> tuple[dict, bytes]:
+    data = path.read_bytes()
+    magic, version, length = struct.unpack_from("<4sII", data)
+    assert (magic, version, length) == (b"glTF", 2, len(data))
+    json_length, json_type = struct.unpack_from("<I4s", data, 12)
+    assert json_type == b"JSON"
+    document = json.loads(data[20 : 20 + json_length])
+    binary_length, binary_type = struct.unpack_from("<I4s", data, 20 + json_length)
+    assert binary_type == b"BIN\0"
+    start = 28 + json_length
+    return document, data[start : start + binary_length]
+
+
+def accessor(document: dict, binary: bytes, index: int) -> np.ndarray:
+    accessor = document["accessors"][index]
+    view = document["bufferViews"][accessor["bufferView"]]
+    dtype = {5126: np.float32, 5125: np.uint32}[accessor["componentType"]]
+    width = {"SCALAR": 1, "VEC3": 3, "VEC4": 4}[accessor["type"]]
+    return np.frombuffer(
+        binary, dtype, view["byteLength"] // 4, view["byteOffset"]
+    ).reshape(accessor["count"], width)
+
+
+def test_gltf(tmp_path):
+    buffer = instances()
+    path = tmp_path / "instances.glb"
+    save_gltf(buffer, path)
+    document, binary = read_glb(path)
+    assert document["extensionsUsed"] == ["EXT_mesh_gpu_instancing"]
+    root, *nodes = document["nodes"]
+    assert [node["name"] for node in nodes] == ["Cube", "IcoSphere"]
+
+    cube, sphere = document["meshes"]
+    (primitive,) = sphere["primitives"]
+    positions = accessor(document, binary, primitive["attributes"]["POSITION"])
+    indices = accessor(document, binary, primitive["indices"])
+    assert positions.shape == (12, 3)
+    assert indices.shape == (60, 1)
+    (primitive,) = cube["primitives"]
+    # Quads are split into two triangles
+    assert accessor(document, binary, primitive["indices"]).shape == (36, 1)
+
+    attributes = nodes[0]["extensions"]["EXT_mesh_gpu_instancing"]["attributes"]
+    translations = accessor(document, binary, attributes["TRANSLATION"])
+    np.testing.assert_allclose(translations, buffer.matrices[[0, 2], :3, 3], atol=1e-6)
+    colors = accessor(document, binary, attributes["_COLOR_0"])
+    np.testing.assert_allclose(colors[:, 3], [0.5, 1])
+    scales = accessor(document, binary, attributes["SCALE"])
+    np.testing.assert_allclose(scales, [[1, 1, 1], [2, 3, 4]], rtol=1e-6)
+    rotations = accessor(document, binary, attributes["ROTATION"])
+    x, y, z, w = rotations[1]
+    assert math.isclose(abs(w), math.cos(0.25), rel_tol=1e-6)
+    assert math.isclose(abs(z), math.sin(0.25), rel_tol=1e-6)
+
+
+def test_quaternions():
+    rng = np.random.default_rng(0)
+    # Random rotations from QR decompositions
+    q, r = np.linalg.qr(rng.normal(size=(50, 3, 3)))
+    rotations = q * np.sign(np.diagonal(r, axis1=1, axis2=2))[:, np.newaxis, :]
+    rotations[np.linalg.det(rotations) < 0] *= -1
+    x, y, z, w = _quaternions(rotations).T
+    expected = np.stack(
+        (
+            (1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)),
+            (2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)),
+            (2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)),
+        )
+    )
+    np.testing.assert_allclose(np.moveaxis(expected, -1, 0), rotations, atol=1e-9)
@@ -0,0 +1,109 @@
+import collections
+
+import numpy as np
+import pytest
+
+from algorist import primitive
+
+
+@pytest.mark.parametrize(
+    "name, kwargs, vertices, faces",
+    [
+        ("Cube", {}, 8, 6),
+        ("Plane", {}, 4, 1),
+        ("Grid", {"x_subdivisions": 3, "y_subdivisions": 2}, 12, 6),
+        ("Circle", {"fill_type": "NGON"}, 32, 1),
+        ("Circle", {"fill_type": "TRIFAN"}, 33, 32),
+        ("Cylinder", {}, 64, 34),
+        ("Cylinder", {"end_fill_type": "TRIFAN"}, 66, 96),
+        ("Cone", {}, 33, 33),
+        ("UVSphere", {}, 482, 512),
+        ("IcoSphere", {}, 42, 80),
+        ("IcoSphere", {"subdivisions": 3}, 162, 320),
+        ("Torus", {}, 576, 576),
+    ],
+)
+def test_counts(name, kwargs, vertices, faces):
+    geometry = primitive.GENERATORS[name](**kwargs)
+    assert len(geometry.vertices) == vertices
+    assert len(geometry.loop_totals) == faces
+    assert geometry.loop_totals.sum() == len(geometry.loop_vertices)
+    assert primitive.vertex_count(name, **kwargs) == vertices
+
+
+def test_circle_edges():
+    geometry = primitive.circle(vertices=8)
+    assert not len(geometry.loop_totals)
+    assert sorted(map(sorted, geometry.edges.tolist())) == sorted(
+        sorted((i, (i + 1) % 8)) for i in range(8)
+    )
+
+
+def faces(geometry: primitive.Geometry) -> list[np.ndarray]:
+    return np.split(geometry.loop_vertices, geometry.loop_starts[1:])
+
+
+@pytest.mark.parametrize(
+    "generator",
+    [
+        primitive.cube,
+        primitive.cylinder,
+        primitive.cone,
+        lambda: primitive.cone(radius1=0, radius2=1, end_fill_type="TRIFAN"),
+        primitive.uv_sphere,
+        primitive.ico_sphere,
+        primitive.torus,
+    ],
+)
+def test_closed_outward(generator):
+    geometry = generator()
+    # Each edge is used once in each direction by consistently wound faces
+    edges = collections.Counter(
+        (a, b) for face in faces(geometry) for a, b in zip(face, np.roll(face, -1))
+    )
+    assert all(count == 1 and edges[(b, a)] == 1 for (a, b), count in edges.items())
+    # Outward faces enclose a positive volume
+    vertices = geometry.vertices.astype(float)
+    volume = sum(
+        np.dot(vertices[face[0]], np.cross(vertices[b], vertices[c])) / 6
+        for face in faces(geometry)
+        for b, c in zip(face[1:-1], face[2:])
+    )
+    assert volume > 0
+
+
+@pytest.mark.parametrize("generator", [primitive.cube, primitive.ico_sphere])
+def test_convex_normals_outward(generator):
+    geometry = generator()
+    for face in faces(geometry):
+        corners = geometry.vertices[face].astype(float)
+        normal = np.cross(corners[1] - corners[0], corners[2] - corners[0])
+        assert np.dot(normal, corners.mean(axis=0)) > 0
+
+
+@pytest.mark.parametrize(
+    "generator",
+    [
+        primitive.cube,
+        primitive.plane,
+        primitive.grid,
+        primitive.uv_sphere,
+        primitive.ico_sphere,
+        primitive.torus,
+    ],
+)
+def test_uvs_follow_winding(generator):
+    geometry = generator()
+    assert geometry.uvs is not None
+    assert geometry.uvs.shape == (len(geometry.loop_vertices), 2)
+    for loops in np.split(
+        np.arange(len(geometry.loop_vertices)), geometry.loop_starts[1:]
+    ):
+        u, v = geometry.uvs[loops].T
+        assert np.dot(u, np.roll(v, -1)) - np.dot(np.roll(u, -1), v) > 0
+
+
+def test_uvs_optional():
+    assert primitive.cube(calc_uvs=False).uvs is None
+    assert primitive.torus(generate_uvs=False).uvs is None
+    assert primitive.cone().uvs is None
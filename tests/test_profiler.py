@@ -0,0 +1,98 @@
+import json
+import pstats
+
+from algorist import (
+    Expansion,
+    InstanceBuffer,
+    ObjectFactory,
+    Profiler,
+    Transform,
+    limit,
+    rule,
+)
+from algorist.decorator import reset_rules
+
+
+def teardown_function():
+    reset_rules()
+
+
+def test_expansion_generator_rules():
+    buffer = InstanceBuffer()
+    of = ObjectFactory(buffer)
+    xfm = Transform()
+
+    @rule()
+    def node(count):
+        xfm.apply(of.cube())
+        if count:
+            with xfm.translate(z=1):
+                yield lambda: node(count - 1)
+
+    with Profiler(report=False) as profiler:
+        Expansion(xfm, buffer=buffer).run(node, 49)
+    (stats,) = profiler.stats.values()
+    assert stats.calls == 50
+    assert stats.objects == stats.inclusive_objects == 50
+    assert max(stats.depths) == 50
+    assert stats.inclusive_time > 0
+
+
+def test_nested_calls():
+    buffer = InstanceBuffer()
+    of = ObjectFactory(buffer)
+    xfm = Transform()
+
+    @rule()
+    def leaf():
+        xfm.apply(of.cube())
+
+    @limit(max_depth=4)
+    def branch():
+        xfm.apply(of.cube())
+        leaf()
+        branch()
+
+    with Profiler(report=False, trace=True) as profiler:
+        branch()
+    stats = {s.key[2]: s for s in profiler.stats.values()}
+    assert stats["branch"].calls == 3
+    assert stats["branch"].primitive_calls == 1
+    assert stats["branch"].objects == 3
+    assert stats["branch"].inclusive_objects == 6
+    assert stats["branch"].limits["max_depth"] == 1
+    assert stats["leaf"].calls == stats["leaf"].objects == 3
+    assert dict(stats["leaf"].depths) == {2: 1, 3: 1, 4: 1}
+    assert len(profiler.events) == 6
+    assert "branch" in profiler.report()
+
+
+def test_save(tmp_path):
+    buffer = InstanceBuffer()
+    of = ObjectFactory(buffer)
+    xfm = Transform()
+
+    @rule()
+    def leaf():
+        xfm.apply(of.cube())
+
+    @rule()
+    def root():
+        for _ in range(3):
+            leaf()
+
+    with Profiler(report=False, trace=True) as profiler:
+        root()
+    profiler.save_pstats(tmp_path / "rules.prof")
+    stats = pstats.Stats(str(tmp_path / "rules.prof"))
+    by_name = {key[2]: value for key, value in stats.stats.items()}
+    primitive_calls, calls, _, _, callers = by_name["leaf"]
+    assert primitive_calls == calls == 3
+    ((caller, edge),) = callers.items()
+    assert caller[2] == "root" and edge[:2] == (3, 3)
+
+    profiler.save_chrome_trace(tmp_path / "trace.json")
+    with open(tmp_path / "trace.json") as f:
+        events = json.load(f)["traceEvents"]
+    assert [event["name"].split()[0] for event in events] == ["leaf"] * 3 + ["root"]
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
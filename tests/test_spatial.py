@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from algorist import SpatialHash
+from algorist.spatial import bounding_sphere
+
+
+def spheres(seed: int, count: int) -> tuple[np.ndarray, np.ndarray]:
+    """Random spheres, some larger than the grid cells"""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(-10, 10, (count, 3))
+    radii = rng.exponential(0.5, count)
+    radii[::17] *= 20
+    return centers, radii
+
+
+@pytest.mark.parametrize("cell_size", [0.5, 1.0, 4.0])
+def test_matches_brute_force(cell_size):
+    centers, radii = spheres(1, 300)
+    index = SpatialHash(cell_size)
+    for center, radius in zip(centers.tolist(), radii.tolist()):
+        index.insert(tuple(center), radius)
+    assert len(index) == 300
+
+    queries, query_radii = spheres(2, 200)
+    for center, radius in zip(queries, query_radii.tolist()):
+        distances = np.linalg.norm(centers - center, axis=1)
+        point = tuple(center.tolist())
+        assert index.overlaps(point, radius) == bool((distances < radius + radii).any())
+        assert index.is_free(point, radius) != index.overlaps(point, radius)
+        expected = np.flatnonzero(distances <= radius).tolist()
+        assert index.neighbours(point, radius) == expected
+        assert index.count(point, radius) == len(expected)
+
+
+def test_clear():
+    index = SpatialHash()
+    index.insert((0, 0, 0), 1)
+    index.insert((0, 0, 0), 100)
+    index.clear()
+    assert not len(index)
+    assert index.is_free((0, 0, 0), 1)
+
+
+def test_bounding_sphere():
+    matrix = np.diag([2.0, 3.0, 0.5, 1.0])
+    matrix[:3, 3] = (1, 2, 3)
+    center, radius = bounding_sphere(matrix, 2.0)
+    assert center == (1, 2, 3)
+    assert radius == 6
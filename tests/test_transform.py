@@ -0,0 +1,71 @@
+import math
+
+import numpy as np
+import pytest
+
+from algorist import Transform
+
+CHAINED = {
+    "x": lambda xfm, v: xfm.translate(x=v),
+    "y": lambda xfm, v: xfm.translate(y=v),
+    "z": lambda xfm, v: xfm.translate(z=v),
+    "rx": lambda xfm, v: xfm.rotate(math.radians(v), "X"),
+    "ry": lambda xfm, v: xfm.rotate(math.radians(v), "Y"),
+    "rz": lambda xfm, v: xfm.rotate(math.radians(v), "Z"),
+    "s": lambda xfm, v: xfm.scale(xyz=v),
+    "sx": lambda xfm, v: xfm.scale(x=v, y=1, z=1),
+    "sy": lambda xfm, v: xfm.scale(x=1, y=v, z=1),
+    "sz": lambda xfm, v: xfm.scale(x=1, y=1, z=v),
+    "h": lambda xfm, v: xfm.color(hue=v),
+    "sat": lambda xfm, v: xfm.color(saturation=v),
+    "b": lambda xfm, v: xfm.color(value=v),
+    "a": lambda xfm, v: xfm.color(alpha=v),
+}
+
+
+def chained(xfm: Transform, operations: dict) -> tuple:
+    state = xfm.snapshot()
+    for name, value in operations.items():
+        CHAINED[name](xfm, value).__enter__()
+    result = xfm.matrix, xfm.color_rgba
+    xfm.restore(state)
+    return result
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_fused_matches_chained(seed):
+    rng = np.random.default_rng(seed)
+    names = rng.choice(list(CHAINED), size=6, replace=False).tolist()
+    operations = {
+        name: float(
+            rng.uniform(0.1, 0.9) if name in ("sat", "b", "a") else rng.uniform(-2, 2)
+        )
+        for name in names
+    }
+    xfm = Transform(color=(0.3, 0.5, 0.5, 1.0))
+    with xfm.rotate(0.3, (1.0, 1.0, 0.0)), xfm.translate(1, 2, 3):
+        expected_matrix, expected_color = chained(xfm, operations)
+        with xfm(**operations):
+            np.testing.assert_allclose(xfm.matrix, expected_matrix, atol=1e-12)
+            np.testing.assert_allclose(xfm.color_rgba, expected_color, atol=1e-12)
+
+
+def test_operations_restore():
+    xfm = Transform()
+    with xfm(x=1, rz=90, s=2, h=0.5):
+        with xfm.translate(x=1):
+            np.testing.assert_allclose(xfm.matrix[:3, 3], (1, 2, 0), atol=1e-12)
+    np.testing.assert_array_equal(xfm.matrix, np.identity(4))
+    assert xfm.color_rgba == Transform().color_rgba
+
+
+def test_cached_matrices_read_only():
+    xfm = Transform()
+    with xfm.scale(xyz=2):
+        with xfm.scale(xyz=2):
+            np.testing.assert_array_equal(xfm.matrix, np.diag([4.0, 4, 4, 1]))
+    for operation in (xfm.scale(xyz=2), xfm.translate(1), xfm.rotate(1, "Z")):
+        assert not operation._matrix.flags.writeable
+    # Unhashable axes are not cached
+    with xfm.rotate(math.pi, [0.0, 0.0, 1.0]):
+        np.testing.assert_allclose(xfm.matrix[:3, :3], np.diag([-1, -1, 1]), atol=1e-12)